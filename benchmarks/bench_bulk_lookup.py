@@ -0,0 +1,68 @@
+# bench_bulk_lookup.py
+# 比較前端欄位查詢的兩種做法：逐列呼叫 query_by_field（每列一次連線 + SELECT）
+# 與 query_by_field_values（整欄去重後 IN (...) 批次查詢），上傳 1k / 10k 列時的總耗時
+# 用法（在專案根目錄）: python -m benchmarks.bench_bulk_lookup --db-rows 200000 --upload-rows 1000,10000
+
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import query
+from benchmarks.synthetic import build_synthetic_db
+
+# dest_port 只有少數幾種值、每個值對應大量記錄，逐列查詢會跑非常久，所以不列入
+FIELDS = ["alert.signature", "domain", "src_ip", "dest_ip"]
+
+
+def upload_column(db_file: str, field: str, n: int, seed: int = 0) -> list:
+    """模擬上傳檔的一欄：大部分是資料庫裡已有的值（會重複），少部分是新值"""
+    conn = sqlite3.connect(db_file)
+    known = [str(r[0]) for r in conn.execute(f'SELECT DISTINCT "{field}" FROM "{query.TABLE_NAME}" LIMIT 2000')]
+    conn.close()
+    rng = random.Random(seed)
+    return [rng.choice(known) if rng.random() < 0.9 else f"new-{rng.randint(0, 10**6)}" for _ in range(n)]
+
+
+def run_loop(field: str, values: list) -> int:
+    return sum(len(query.query_by_field(field, value)) for value in values)
+
+
+def run_bulk(field: str, values: list) -> int:
+    records = query.query_by_field_values(field, values)
+    return sum(len(records[value]) for value in values)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db-rows", type=int, default=200000)
+    parser.add_argument("--upload-rows", default="1000,10000")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "SOC.db")
+        build_synthetic_db(db_file, args.db_rows, table_name=query.TABLE_NAME)
+        query.SQLITE_PATH = f"sqlite:///{db_file}"
+
+        print(f"資料庫 {args.db_rows} 筆")
+        print(f"{'欄位':<18}{'上傳列數':>10}{'不重複值':>10}{'逐列 秒':>10}{'批次 秒':>10}{'加速':>8}")
+        for n in [int(x) for x in args.upload_rows.split(",")]:
+            for field in FIELDS:
+                values = upload_column(db_file, field, n)
+                start = time.perf_counter()
+                loop_total = run_loop(field, values)
+                loop_seconds = time.perf_counter() - start
+
+                start = time.perf_counter()
+                bulk_total = run_bulk(field, values)
+                bulk_seconds = time.perf_counter() - start
+
+                assert loop_total == bulk_total, (field, loop_total, bulk_total)
+                print(f"{field:<18}{n:>10}{len(set(values)):>10}{loop_seconds:>10.2f}{bulk_seconds:>10.2f}"
+                      f"{loop_seconds / bulk_seconds:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
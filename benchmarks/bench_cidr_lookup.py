@@ -0,0 +1,99 @@
+# bench_cidr_lookup.py
+# 大量 CIDR 的網段查詢：比較三種做法的耗時，並驗證找到的筆數相同
+# - 全表掃描：沒有索引時，每列的 IP 在 Python 裡比對是否落在任一網段（一次掃完整張表）
+# - 逐一查詢：每個 CIDR 各跑一次 *_ip_num 索引範圍查詢（不合併）
+# - query_by_cidr：網段先合併成不重疊的範圍，再分批以索引範圍查詢
+# 用法（在專案根目錄）: python -m benchmarks.bench_cidr_lookup --rows 10000000 --cidrs 100000
+# 10M 筆需要數 GB 暫存空間與較長時間
+
+import argparse
+import bisect
+import ipaddress
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import query
+from benchmarks.synthetic import build_synthetic_db
+from utils import cidr_to_key_range
+
+FIELD = "dest_ip"
+
+
+def generate_cidrs(n: int, seed: int = 0) -> list:
+    """10.0.0.0/8 裡的 /28 ~ /32（假資料的 dest_ip 在 10.0.0.0/12），加上少量 IPv6 網段"""
+    rng = random.Random(seed)
+    cidrs = []
+    for _ in range(n):
+        if rng.random() < 0.02:
+            cidrs.append(f"2001:db8:{rng.randint(0, 0xffff):x}::/48")
+            continue
+        prefix = rng.randint(28, 32)
+        address = ipaddress.ip_address((10 << 24) + rng.randint(0, 2**24 - 1))
+        cidrs.append(str(ipaddress.ip_network(f"{address}/{prefix}", strict=False)))
+    return cidrs
+
+
+def run_full_scan(db_file: str, cidrs: list) -> int:
+    ranges = query.merge_cidr_ranges(cidrs)
+    starts = [start for start, _ in ranges]
+
+    def in_ranges(key):
+        i = bisect.bisect_right(starts, key) - 1
+        return key is not None and i >= 0 and key <= ranges[i][1]
+
+    conn = sqlite3.connect(db_file)
+    count = sum(1 for (key,) in conn.execute(f'SELECT "{FIELD}_num" FROM "{query.TABLE_NAME}"') if in_ranges(key))
+    conn.close()
+    return count
+
+
+def run_loop(db_file: str, cidrs: list) -> int:
+    # 網段可能重疊，以 rowid 去重後才是實際的事件數
+    conn = sqlite3.connect(db_file)
+    rows = {}
+    for cidr in cidrs:
+        for row in conn.execute(f'SELECT rowid, * FROM "{query.TABLE_NAME}" WHERE "{FIELD}_num" BETWEEN ? AND ?',
+                                cidr_to_key_range(cidr)):
+            rows[row[0]] = row
+    conn.close()
+    return len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=10000000)
+    parser.add_argument("--cidrs", type=int, default=100000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "SOC.db")
+        build_synthetic_db(db_file, args.rows)
+        query.SQLITE_PATH = f"sqlite:///{db_file}"
+        cidrs = generate_cidrs(args.cidrs)
+
+        start = time.perf_counter()
+        merged = query.merge_cidr_ranges(cidrs)
+        merge_ms = (time.perf_counter() - start) * 1000
+        print(f"資料庫 {args.rows} 筆，{len(cidrs)} 個 CIDR 合併成 {len(merged)} 個範圍（{merge_ms:.0f} ms）")
+
+        results = {}
+        for name, run in (("全表掃描", lambda: run_full_scan(db_file, cidrs)),
+                          ("逐一查詢", lambda: run_loop(db_file, cidrs)),
+                          ("query_by_cidr", lambda: len(query.query_by_cidr(FIELD, cidrs)))):
+            start = time.perf_counter()
+            count = run()
+            results[name] = (count, time.perf_counter() - start)
+
+        baseline = results["全表掃描"][1]
+        print(f"{'做法':<16}{'筆數':>10}{'秒':>10}{'加速':>8}")
+        for name, (count, seconds) in results.items():
+            print(f"{name:<16}{count:>10}{seconds:>10.2f}{baseline / seconds:>7.1f}x")
+        counts = {count for count, _ in results.values()}
+        assert len(counts) == 1, results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# bench_embedding_backends.py
+# 比較 torch / onnx / int8 後端的單筆查詢延遲（p50 / p95）、批次吞吐量與載入後的記憶體
+# 每個後端在獨立子行程執行，記憶體數字才不會互相影響
+# 用法（在專案根目錄）: python -m benchmarks.bench_embedding_backends --backends torch,onnx,int8
+
+import argparse
+import json
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.embedding_corpus import load_corpus
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def run_worker(backend: str, rows: int, queries: int, batch_size: int):
+    from embedding import embed_texts, load_embedding_model
+    texts = load_corpus(rows)
+    model = load_embedding_model(backend)
+    embed_texts(model, texts[:batch_size], batch_size=batch_size)  # 暖機
+
+    latencies = []
+    for text in texts[:queries]:
+        start = time.perf_counter()
+        embed_texts(model, [text])
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    embed_texts(model, texts, batch_size=batch_size)
+    seconds = time.perf_counter() - start
+    print(json.dumps({
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": statistics.quantiles(latencies, n=20)[-1],
+        "texts_per_s": len(texts) / seconds,
+        "peak_mb": peak_rss_mb(),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backends", default="torch,onnx,int8")
+    parser.add_argument("--rows", type=int, default=2000, help="吞吐量測試的筆數")
+    parser.add_argument("--queries", type=int, default=100, help="單筆延遲測試的次數")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.rows, args.queries, args.batch_size)
+        return
+
+    print(f"{'後端':<8}{'p50 ms':>10}{'p95 ms':>10}{'texts/s':>10}{'峰值MB':>10}")
+    for backend in args.backends.split(","):
+        proc = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_embedding_backends", "--worker", backend,
+             "--rows", str(args.rows), "--queries", str(args.queries), "--batch-size", str(args.batch_size)],
+            capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            print(f"{backend:<8}執行失敗：{proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else proc.returncode}")
+            continue
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        print(f"{backend:<8}{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}"
+              f"{result['texts_per_s']:>10.1f}{result['peak_mb']:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
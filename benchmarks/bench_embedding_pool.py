@@ -0,0 +1,48 @@
+# bench_embedding_pool.py
+# 量測 embedding.EmbeddingEngine 在 CPU 上不同 worker 數的 texts/s，並確認向量與單行程結果一致
+# 需要 sentence-transformers 與模型檔（第一次執行會下載 MODEL_NAME）
+# 用法（在專案根目錄）: python -m benchmarks.bench_embedding_pool --rows 5000 --workers 1,2,4,8
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+from benchmarks.synthetic import generate_alerts
+from embedding import EMBED_BATCH_SIZE, MODEL_NAME, EmbeddingEngine
+from utils import dataframe_to_texts
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE)
+    args = parser.parse_args()
+
+    texts = dataframe_to_texts(generate_alerts(args.rows))
+    print(f"模型 {MODEL_NAME}，{len(texts)} 筆文字，CPU 核心 {os.cpu_count()}，batch size {args.batch_size}")
+    print(f"{'workers':>8}{'threads/worker':>16}{'秒':>10}{'texts/s':>10}{'加速':>8}{'最大誤差':>12}")
+
+    baseline_vectors = baseline_seconds = None
+    for workers in [int(w) for w in args.workers.split(",")]:
+        engine = EmbeddingEngine(workers=workers, batch_size=args.batch_size, min_parallel=0)
+        # 暖機：啟動 worker 並載入模型，不列入計時
+        engine.encode(texts[:workers * args.batch_size])
+
+        start = time.perf_counter()
+        vectors = engine.encode(texts)
+        seconds = time.perf_counter() - start
+        threads = engine.threads_per_worker if workers > 1 else "-"
+        engine.close()
+
+        if baseline_vectors is None:
+            baseline_vectors, baseline_seconds = vectors, seconds
+        error = float(np.abs(vectors - baseline_vectors).max())
+        print(f"{workers:>8}{threads:>16}{seconds:>10.2f}{len(texts) / seconds:>10.1f}"
+              f"{baseline_seconds / seconds:>7.2f}x{error:>12.2e}")
+
+
+if __name__ == "__main__":
+    main()
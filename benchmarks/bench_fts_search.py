@@ -0,0 +1,118 @@
+# bench_fts_search.py
+# 比較 payload / note / alert.signature 的部分字串搜尋：LIKE '%...%' 全表掃描 vs FTS5 全文索引（query.search_text）
+# 假資料的 payload 為 HTTP 請求、note 為中文備註；同時驗證兩種做法找到的筆數相同
+# FTS 分兩種排序：rank（bm25，要替所有相符的列算分數）與 recent（新到舊，找到 20 筆就停）
+# 用法（在專案根目錄）: python -m benchmarks.bench_fts_search --rows 1000000
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+
+import query
+from benchmarks.synthetic import build_synthetic_db, generate_alerts
+from data_ingestion.xlsx_to_database import create_fts_index
+from utils import FTS_COLUMNS, fts_table_name
+
+LIMIT = 20
+PATHS = [f"/api/v{i % 3}/resource{i}" for i in range(5000)]
+AGENTS = ["curl/7.88.1", "python-requests/2.31", "Mozilla/5.0 (Windows NT 10.0)", "Go-http-client/1.1"]
+UNITS = ["資訊處/網路組", "數字金融中心/區塊鏈策略發展組", "研發部/雲端平台組", "管理處/總務組"]
+FINDINGS = ["查詢紀錄為正常更新行為", "疑似挖礦程式連線", "同仁安裝瀏覽器外掛觸發", "已封鎖來源並通知同仁", "觀看過去記錄，無其他告警"]
+# (說明, 關鍵字)：常見 / 少見 / 中文 / 多關鍵字 / 查無資料
+TERMS = [
+    ("常見 payload", "python-requests"),
+    ("少見 payload", "resource4242"),
+    ("中文 note", "挖礦程式"),
+    ("中文 + 網域", "區塊鏈 example7"),
+    ("告警名稱", "host1234"),
+    ("查無資料", "not-in-dataset"),
+]
+
+
+def generate_rich_alerts(n: int, seed: int):
+    df = generate_alerts(n, seed=seed)
+    rng = np.random.default_rng(seed)
+    df["payload"] = ("GET " + np.array(PATHS)[rng.integers(0, len(PATHS), n)] + " HTTP/1.1 Host: " + df["domain"]
+                     + " User-Agent: " + np.array(AGENTS)[rng.integers(0, len(AGENTS), n)])
+    df["note"] = (df["note"] + "---" + np.array(UNITS)[rng.integers(0, len(UNITS), n)] + "同仁，"
+                  + np.array(FINDINGS)[rng.integers(0, len(FINDINGS), n)] + "。")
+    return df
+
+
+def build_db(db_file: str, n: int) -> float:
+    """建立資料庫，回傳建立全文索引的秒數"""
+    build_synthetic_db(db_file, n, generator=generate_rich_alerts, table_name=query.TABLE_NAME)
+    conn = sqlite3.connect(db_file)
+    start = time.perf_counter()
+    create_fts_index(conn, query.TABLE_NAME)
+    conn.commit()
+    seconds = time.perf_counter() - start
+    conn.close()
+    return seconds
+
+
+def like_sql(terms, select: str, limit: str = "") -> tuple:
+    conditions = " AND ".join(
+        "(" + " OR ".join(f'"{col}" LIKE ?' for col in FTS_COLUMNS) + ")" for _ in terms
+    )
+    params = [f"%{term}%" for term in terms for _ in FTS_COLUMNS]
+    return f'SELECT {select} FROM "{query.TABLE_NAME}" WHERE {conditions} {limit}', params
+
+
+def fts_count(conn, terms) -> int:
+    fts = fts_table_name(query.TABLE_NAME)
+    match = " ".join(f'"{term}"' for term in terms)
+    return conn.execute(f'SELECT COUNT(*) FROM "{fts}" WHERE "{fts}" MATCH ?', (match,)).fetchone()[0]
+
+
+def timed(fn, repeat: int = 3) -> tuple:
+    """回傳 (結果, 最快一次的毫秒數)"""
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return result, best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "SOC.db")
+        build_seconds = build_db(db_file, args.rows)
+        query.SQLITE_PATH = f"sqlite:///{db_file}"
+        conn = sqlite3.connect(db_file)
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        fts_pages = conn.execute(
+            "SELECT SUM(pgsize) FROM dbstat WHERE name LIKE ?", (fts_table_name(query.TABLE_NAME) + "%",)
+        ).fetchone()[0] if conn.execute("SELECT 1 FROM pragma_compile_options WHERE compile_options = 'ENABLE_DBSTAT_VTAB'").fetchone() else None
+
+        print(f"資料庫 {args.rows} 筆，全文索引建立 {build_seconds:.1f}s，資料庫 {os.path.getsize(db_file) / 2**20:.0f} MB"
+              + (f"（全文索引 {fts_pages / 2**20:.0f} MB）" if fts_pages else "") + f"，page size {page_size}")
+        print(f"{'關鍵字':<24}{'筆數':>8}{'LIKE top20':>12}{'FTS rank':>10}{'FTS recent':>12}"
+              f"{'LIKE 計數':>12}{'FTS 計數':>10}  (ms)")
+        for label, term in TERMS:
+            terms = term.split()
+            sql, params = like_sql(terms, "*", f"LIMIT {LIMIT}")
+            _, like_top_ms = timed(lambda: conn.execute(sql, params).fetchall())
+            _, fts_rank_ms = timed(lambda: query.search_text(term, limit=LIMIT))
+            _, fts_recent_ms = timed(lambda: query.search_text(term, limit=LIMIT, order="recent"))
+
+            count_sql, count_params = like_sql(terms, "COUNT(*)")
+            like_count, like_count_ms = timed(lambda: conn.execute(count_sql, count_params).fetchone()[0], repeat=1)
+            count, fts_count_ms = timed(lambda: fts_count(conn, terms), repeat=1)
+            assert like_count == count, (term, like_count, count)
+            print(f"{label + ' ' + term:<24}{count:>8}{like_top_ms:>12.1f}{fts_rank_ms:>10.1f}{fts_recent_ms:>12.1f}"
+                  f"{like_count_ms:>12.1f}{fts_count_ms:>10.1f}")
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
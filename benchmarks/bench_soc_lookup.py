@@ -0,0 +1,87 @@
+# bench_soc_lookup.py
+# 比較舊版（全部 TEXT、無索引）與新版 xlsx_to_database schema（有型別、有索引）的查詢延遲
+# 用法（在專案根目錄）: python -m benchmarks.bench_soc_lookup --sizes 10000,1000000
+# 10M 筆需要數 GB 暫存空間與較長時間：--sizes 10000000
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+from benchmarks.synthetic import build_synthetic_db, generate_alerts
+
+TABLE_NAME = "SOC_data"
+CHUNK_ROWS = 200000
+
+
+def build_legacy(db_file: str, n: int):
+    # 舊版：所有欄位 TEXT、無索引
+    conn = sqlite3.connect(db_file)
+    for offset in range(0, n, CHUNK_ROWS):
+        df = generate_alerts(min(CHUNK_ROWS, n - offset), seed=offset)
+        if offset == 0:
+            column_defs = ", ".join(f'"{col}" TEXT' for col in df.columns)
+            conn.execute(f'CREATE TABLE "{TABLE_NAME}" ({column_defs})')
+        conn.executemany(f'INSERT INTO "{TABLE_NAME}" VALUES ({", ".join("?" for _ in df.columns)})',
+                         df.itertuples(index=False, name=None))
+    conn.commit()
+    conn.close()
+
+
+def sample_values(db_file: str, k: int):
+    conn = sqlite3.connect(db_file)
+    rows = conn.execute(
+        f'SELECT "alert.signature", src_ip, dest_ip, dest_port, domain FROM "{TABLE_NAME}" '
+        f'ORDER BY random() LIMIT {k}'
+    ).fetchall()
+    conn.close()
+    return rows
+
+
+def time_queries(db_file: str, queries):
+    conn = sqlite3.connect(db_file)
+    latencies = []
+    for sql, params in queries:
+        start = time.perf_counter()
+        conn.execute(sql, params).fetchall()
+        latencies.append(time.perf_counter() - start)
+    conn.close()
+    latencies.sort()
+    return latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.95)] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="10000,1000000")
+    parser.add_argument("--lookups", type=int, default=50, help="每種查詢跑幾次")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{'rows':>10} {'query':>18} {'legacy p50/p95 (ms)':>22} {'indexed p50/p95 (ms)':>22}")
+        for n in [int(x) for x in args.sizes.split(",")]:
+            legacy_db, indexed_db = os.path.join(tmp, f"legacy_{n}.db"), os.path.join(tmp, f"indexed_{n}.db")
+            build_legacy(legacy_db, n)
+            build_synthetic_db(indexed_db, n, table_name=TABLE_NAME)
+            samples = sample_values(legacy_db, args.lookups)
+
+            cases = {
+                "alert.signature": [(f'SELECT * FROM "{TABLE_NAME}" WHERE "alert.signature" = ?', (s[0],)) for s in samples],
+                "src_ip": [(f'SELECT * FROM "{TABLE_NAME}" WHERE src_ip = ?', (s[1],)) for s in samples],
+                "domain": [(f'SELECT * FROM "{TABLE_NAME}" WHERE domain = ?', (s[4],)) for s in samples],
+                "similar_records": [
+                    (f'SELECT * FROM "{TABLE_NAME}" WHERE src_ip = ? AND dest_ip = ? AND dest_port = ? AND domain = ? LIMIT 3',
+                     (s[1], s[2], s[3], s[4])) for s in samples
+                ],
+                "latest_10": [(f'SELECT * FROM "{TABLE_NAME}" ORDER BY time DESC LIMIT 10', ())] * 5,
+            }
+            for name, queries in cases.items():
+                legacy = time_queries(legacy_db, queries)
+                indexed = time_queries(indexed_db, queries)
+                print(f"{n:>10} {name:>18} {legacy[0]:>10.2f}/{legacy[1]:<10.2f} {indexed[0]:>10.2f}/{indexed[1]:<10.2f}")
+            os.remove(legacy_db)
+            os.remove(indexed_db)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# bench_startup.py
+# 用 python -X importtime 量測 main.py 依賴模組的冷啟動 import 時間，並檢查重量級套件沒有在 import 時被載入
+# 超過預算或載入了不該載入的套件就以非 0 結束，可放進 CI 當作冷啟動守門
+# 用法（在專案根目錄）: python -m benchmarks.bench_startup --budget-ms 1500
+
+import argparse
+import ast
+import os
+import re
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 這些只能在第一次真正用到時才載入
+HEAVY_MODULES = [
+    "torch",
+    "sentence_transformers",
+    "chromadb",
+    "langchain_chroma",
+    "langchain_community",
+    "langchain_core",
+    "openpyxl",
+]
+
+
+
+def app_modules(entry: str = os.path.join(ROOT, "main.py")) -> list:
+    """
+    main.py 在最上層 import 的專案模組（不含 streamlit 等第三方套件，streamlit 本身每次都要載入）
+    直接從 main.py 解析，新增 import 時不用另外維護清單
+    """
+    with open(entry, "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0:
+            names = [node.module]
+        else:
+            continue
+        for name in names:
+            top = name.split(".")[0]
+            is_local = os.path.exists(os.path.join(ROOT, f"{top}.py")) or os.path.isdir(os.path.join(ROOT, top))
+            if is_local and name not in modules:
+                modules.append(name)
+    return modules
+
+
+_LINE_RE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure(modules: list) -> list:
+    """回傳 [(模組, self_us, cumulative_us, 深度)]，依 importtime 輸出順序"""
+    code = "; ".join(f"import {module}" for module in modules)
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+    entries = []
+    for line in proc.stderr.splitlines():
+        match = _LINE_RE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            entries.append((name, int(self_us), int(cumulative_us), len(indent) // 2))
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--budget-ms", type=float, default=1500, help="所有專案模組 import 的總時間上限")
+    parser.add_argument("--top", type=int, default=15, help="列出最慢的幾個套件")
+    parser.add_argument("--with-streamlit", action="store_true", help="把 streamlit 本身也算進去")
+    args = parser.parse_args()
+
+    modules = (["streamlit"] if args.with_streamlit else []) + app_modules()
+    # 跑兩次取第二次，避開第一次讀 .pyc / 磁碟快取的誤差
+    measure(modules)
+    entries = measure(modules)
+
+    # 只算我們 import 的模組，直譯器啟動時載入的 site / encodings 不算
+    top_level = [entry for entry in entries if entry[3] == 0 and entry[0] in modules]
+    total_ms = sum(cumulative for _, _, cumulative, _ in top_level) / 1000
+    loaded = {name for name, _, _, _ in entries}
+
+    print(f"{'套件':<40}{'累計 ms':>10}")
+    for name, _, cumulative, _ in sorted(top_level, key=lambda entry: -entry[2])[:args.top]:
+        print(f"{name:<40}{cumulative / 1000:>10.1f}")
+
+    ok = total_ms <= args.budget_ms
+    print(f"\n{'✅' if ok else '❌'} import 總時間 {total_ms:.0f} ms（預算 {args.budget_ms:.0f} ms）")
+    for heavy in HEAVY_MODULES:
+        if heavy in loaded:
+            ok = False
+            print(f"❌ import 時就載入了 {heavy}，應改成第一次使用時才載入")
+    if ok:
+        print(f"✅ 沒有載入任何重量級套件：{', '.join(HEAVY_MODULES)}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# bench_streaming_reader.py
+# 比較一次讀入整個檔案（pd.read_csv / pd.read_excel）與 utils.iter_record_batches 分批讀取的
+# 峰值記憶體（每種方式在獨立子行程執行，取 ru_maxrss）與吞吐量
+# 用法（在專案根目錄）: python -m benchmarks.bench_streaming_reader --csv-rows 1000000 --xlsx-rows 100000
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from benchmarks.synthetic import SOC_COLUMNS, generate_alerts
+
+GENERATE_CHUNK = 100000
+
+
+def write_csv(path: str, n: int):
+    for offset in range(0, n, GENERATE_CHUNK):
+        df = generate_alerts(min(GENERATE_CHUNK, n - offset), seed=offset)
+        df.to_csv(path, mode="a" if offset else "w", header=offset == 0, index=False)
+
+
+def write_xlsx(path: str, n: int):
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(SOC_COLUMNS)
+    for offset in range(0, n, GENERATE_CHUNK):
+        for row in generate_alerts(min(GENERATE_CHUNK, n - offset), seed=offset).itertuples(index=False):
+            sheet.append(list(row))
+    workbook.save(path)
+
+
+def peak_rss_mb() -> float:
+    # Linux 的 ru_maxrss 單位是 KB，macOS 是 bytes
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def run_worker(mode: str, path: str, batch_size: int):
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    if mode == "full":
+        df = pd.read_csv(path, dtype=str) if path.endswith(".csv") else pd.read_excel(path, dtype=str)
+        rows = len(df)
+    else:
+        from utils import iter_record_batches
+        rows = sum(len(batch) for batch in iter_record_batches(path, batch_size))
+    seconds = time.perf_counter() - start
+    print(json.dumps({"rows": rows, "seconds": seconds, "peak_mb": peak_rss_mb(), "baseline_mb": baseline}))
+
+
+def measure(mode: str, path: str, batch_size: int) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_streaming_reader", "--worker", mode, path, str(batch_size)],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--csv-rows", type=int, default=500000)
+    parser.add_argument("--xlsx-rows", type=int, default=50000)
+    parser.add_argument("--batch-size", type=int, default=20000)
+    parser.add_argument("--worker", nargs=3, metavar=("MODE", "PATH", "BATCH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        mode, path, batch_size = args.worker
+        run_worker(mode, path, int(batch_size))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        files = []
+        if args.csv_rows:
+            files.append((os.path.join(tmp, "alerts.csv"), args.csv_rows, write_csv))
+        if args.xlsx_rows:
+            files.append((os.path.join(tmp, "alerts.xlsx"), args.xlsx_rows, write_xlsx))
+
+        print(f"{'檔案':<12}{'筆數':>10}{'大小MB':>10}{'方式':>10}{'秒':>9}{'rows/s':>12}{'峰值MB':>10}{'增加MB':>10}")
+        for path, n, writer in files:
+            writer(path, n)
+            size_mb = os.path.getsize(path) / 1024 / 1024
+            for mode in ("full", "stream"):
+                result = measure(mode, path, args.batch_size)
+                assert result["rows"] == n, result
+                print(f"{os.path.basename(path):<12}{n:>10}{size_mb:>10.1f}{mode:>10}{result['seconds']:>9.2f}"
+                      f"{n / result['seconds']:>12.0f}{result['peak_mb']:>10.0f}"
+                      f"{result['peak_mb'] - result['baseline_mb']:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
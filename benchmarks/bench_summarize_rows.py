@@ -0,0 +1,53 @@
+# bench_summarize_rows.py
+# 量測 rag_core.summarize_rows 在 1/10/50 筆資料時，循序與併發模式的總耗時
+# 用法（在專案根目錄）: python -m benchmarks.bench_summarize_rows --latency 0.5
+
+import argparse
+import os
+import time
+
+from benchmarks.fake_openai_server import start_fake_server
+
+COLUMNS = ["time", "alert.signature", "src_ip", "dest_ip", "domain", "note"]
+
+
+def make_rows(n: int):
+    return [
+        (f"2025-01-07 10:{i % 60:02d}:00", "Suspicious domain example.com has been detected!",
+         f"192.168.1.{i % 255}", "10.0.0.1", "example.com", "暫列觀察")
+        for i in range(n)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.5, help="假伺服器每個請求的延遲（秒）")
+    parser.add_argument("--sizes", default="1,10,50", help="要測的資料筆數，逗號分隔")
+    parser.add_argument("--workers", type=int, default=8, help="併發模式的 max_workers")
+    args = parser.parse_args()
+
+    server, base_url = start_fake_server(latency=args.latency)
+    # OpenAI client 會讀 OPENAI_BASE_URL，必須在 import rag_core 之前設定
+    os.environ["OPENAI_BASE_URL"] = base_url
+    from rag_model.rag_core import summarize_rows
+
+    print(f"假伺服器: {base_url}，延遲 {args.latency}s")
+    print(f"{'rows':>6} {'sequential(s)':>14} {'concurrent(s)':>14} {'speedup':>8}")
+    for n in [int(x) for x in args.sizes.split(",")]:
+        rows = make_rows(n)
+        timings = {}
+        for mode, workers in (("sequential", 1), ("concurrent", args.workers)):
+            start = time.perf_counter()
+            summaries = summarize_rows(rows, COLUMNS, "benchmark", max_workers=workers)
+            timings[mode] = time.perf_counter() - start
+            failed = [s for s in summaries if s.startswith("❌")]
+            if failed:
+                print(f"⚠️ {mode} 有 {len(failed)} 筆失敗：{failed[0]}")
+        speedup = timings["sequential"] / timings["concurrent"] if timings["concurrent"] else 0
+        print(f"{n:>6} {timings['sequential']:>14.2f} {timings['concurrent']:>14.2f} {speedup:>7.1f}x")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
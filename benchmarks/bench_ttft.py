@@ -0,0 +1,46 @@
+# bench_ttft.py
+# 量測一般問答在阻塞模式（call_gpt_api）與串流模式（call_gpt_api_stream）下的首字延遲（TTFT）與總耗時
+# 用法（在專案根目錄）: python -m benchmarks.bench_ttft --latency 0.5 --token-latency 0.05
+
+import argparse
+import os
+import time
+
+from benchmarks.fake_openai_server import start_fake_server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.5, help="假伺服器首字前延遲（秒）")
+    parser.add_argument("--token-latency", type=float, default=0.05, help="假伺服器每個 chunk 間隔（秒）")
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    server, base_url = start_fake_server(latency=args.latency, token_latency=args.token_latency)
+    # llm_gateway 在 import 時讀環境變數，必須先設定；快取關掉才量得到真實延遲
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ["LLM_CACHE_DISABLED"] = "1"
+    from llm_gateway import measure_ttft, last_ttft
+    from rag_model.call_api import call_gpt_api, call_gpt_api_stream
+
+    print(f"{'mode':>10} {'ttft(s)':>9} {'total(s)':>9}")
+    for i in range(args.rounds):
+        messages = [{"role": "user", "content": f"bench ttft {i}"}]
+
+        start = time.perf_counter()
+        call_gpt_api(messages)
+        blocking = time.perf_counter() - start
+        # 阻塞模式要等全文回來才看得到，TTFT 等於總耗時
+        print(f"{'blocking':>10} {blocking:>9.2f} {blocking:>9.2f}")
+
+        start = time.perf_counter()
+        for _ in measure_ttft(call_gpt_api_stream(messages), "bench_stream", start=start):
+            pass
+        total = time.perf_counter() - start
+        print(f"{'stream':>10} {last_ttft['bench_stream']:>9.2f} {total:>9.2f}")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+# check_embedding_backends.py
+# 比較 onnx / int8 後端與 PyTorch fp32 的向量相似度（同一筆文字的 cosine similarity），低於門檻就以非 0 結束
+# 需要 sentence-transformers；onnx 後端另外需要 pip install "optimum[onnxruntime]"
+# 用法（在專案根目錄）: python -m benchmarks.check_embedding_backends --rows 500 --backends onnx,int8
+
+import argparse
+import sys
+
+import numpy as np
+
+from benchmarks.embedding_corpus import load_corpus
+from embedding import embed_texts, load_embedding_model
+
+# 各後端可接受的最低 cosine similarity
+MIN_SIMILARITY = {"onnx": 0.999, "int8": 0.95}
+
+
+def normalize(vectors) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=500)
+    parser.add_argument("--backends", default="onnx,int8")
+    args = parser.parse_args()
+
+    texts = load_corpus(args.rows)
+    reference = normalize(embed_texts(load_embedding_model("torch"), texts))
+    # 檢索看的是排名，順便確認每筆文字的最近鄰是否一致
+    reference_neighbours = np.argsort(-(reference @ reference.T), axis=1)[:, 1]
+
+    ok = True
+    for backend in args.backends.split(","):
+        try:
+            vectors = normalize(embed_texts(load_embedding_model(backend), texts))
+        except ImportError as e:
+            print(f"⚠️ {backend}：缺少套件，略過（{e}）")
+            continue
+        similarity = (vectors * reference).sum(axis=1)
+        neighbours = np.argsort(-(vectors @ vectors.T), axis=1)[:, 1]
+        agreement = float((neighbours == reference_neighbours).mean())
+        passed = float(similarity.min()) >= MIN_SIMILARITY[backend]
+        ok = ok and passed
+        print(f"{'✅' if passed else '❌'} {backend}：{len(texts)} 筆，cosine 平均 {similarity.mean():.5f}，"
+              f"最低 {similarity.min():.5f}（門檻 {MIN_SIMILARITY[backend]}），最近鄰一致率 {agreement:.1%}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# check_llm_gateway.py
+# 用本機假伺服器驗證 llm_gateway 的重試、coalescing 與限流行為，任何一項不符預期就以非 0 結束
+# 用法（在專案根目錄）: python -m benchmarks.check_llm_gateway
+
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fake_openai_server import inject_failures, start_fake_server
+from llm_cache import LLMCache
+from llm_gateway import LLMGateway, TokenBucket
+
+MESSAGES = [{"role": "user", "content": "hello"}]
+
+
+def make_gateway(base_url: str, **kwargs) -> LLMGateway:
+    # 快取關掉，確保每個請求真的打到假伺服器
+    params = dict(api_key="fake", base_url=base_url, rpm=0, tpm=0, backoff_base=0.05,
+                  cache=LLMCache(path=":memory:", enabled=False))
+    params.update(kwargs)
+    return LLMGateway(**params)
+
+
+def check_retry(base_url: str, server) -> bool:
+    gateway = make_gateway(base_url, max_retries=3)
+    inject_failures(server, [429, 503, 500])
+    before = server.request_count
+    content = gateway.chat(MESSAGES)
+    sent = server.request_count - before
+    ok = bool(content) and sent == 4 and gateway.stats()["retries"] == 3
+    print(f"{'✅' if ok else '❌'} 429/5xx 重試：送出 {sent} 次，retries={gateway.stats()['retries']}")
+
+    inject_failures(server, [429] * 3)
+    try:
+        make_gateway(base_url, max_retries=1).chat(MESSAGES)
+        print("❌ 超過重試次數仍應丟出例外")
+        ok = False
+    except Exception as e:
+        print(f"✅ 超過重試次數丟出 {type(e).__name__}")
+    with server.lock:
+        server.failures.clear()
+    return ok
+
+
+def check_coalescing(base_url: str, server) -> bool:
+    gateway = make_gateway(base_url)
+    before = server.request_count
+    with ThreadPoolExecutor(max_workers=10) as pool:
+        results = list(pool.map(lambda _: gateway.chat(MESSAGES, temperature=0.7), range(10)))
+    sent = server.request_count - before
+    ok = sent == 1 and len(set(results)) == 1
+    print(f"{'✅' if ok else '❌'} coalescing：10 個相同請求只送出 {sent} 次（coalesced={gateway.stats()['coalesced']}）")
+    return ok
+
+
+def check_rate_limit(base_url: str, server) -> bool:
+    # 每分鐘 600 次、桶子容量 1 => 每 0.1 秒放行一個；伺服器延遲先歸零，只量限流的等待
+    latency, server.latency = server.latency, 0
+    gateway = make_gateway(base_url)
+    gateway.request_bucket = TokenBucket(600, capacity=1)
+    start = time.perf_counter()
+    for i in range(11):
+        gateway.chat([{"role": "user", "content": f"rate {i}"}])
+    elapsed = time.perf_counter() - start
+    server.latency = latency
+    ok = elapsed >= 0.9
+    print(f"{'✅' if ok else '❌'} 限流：11 個請求耗時 {elapsed:.2f}s（預期 >= 1.0s）")
+    return ok
+
+
+def main():
+    server, base_url = start_fake_server(latency=0.2)
+    results = [
+        check_retry(base_url, server),
+        check_coalescing(base_url, server),
+        check_rate_limit(base_url, server),
+    ]
+    server.shutdown()
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# check_streaming_reader.py
+# 驗證 utils.iter_record_batches 分批讀 XLSX 的結果與 pd.read_excel(dtype=str) 完全相同：
+# 空白儲存格、"NA" 這類空值字串、中間與檔尾的空白列、整數 / 小數 / 日期儲存格；
+# 並確認上傳檔讀進來後（note_pipeline.read_upload）空值一律是 "nan"，不會變成 "None"
+# 任何一項不符就以非 0 結束
+# 用法（在專案根目錄）: python -m benchmarks.check_streaming_reader
+
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+import pandas as pd
+from openpyxl import Workbook
+
+from note_pipeline import read_upload
+from utils import iter_record_batches
+
+COLUMNS = ["time", "alert.signature", "src_ip", "dest_port", "domain", "payload", "note"]
+ROWS = [
+    [datetime(2025, 1, 7, 10, 0), "Suspicious domain a.com has been detected!", "10.0.0.1", 53, "a.com", None, "暫列觀察"],
+    [None, None, None, None, None, None, None],
+    ["2025-01-07 11:00:00", "Suspicious ip 1.2.3.4 has been detected!", None, 443.0, None, "GET /", None],
+    ["2025-01-07 12:00:00", "NA", "10.0.0.2", 8080.5, "None", "", "已通知資管處"],
+    [None, None, "10.0.0.3", None, None, None, None],
+    [None, None, None, None, None, None, None],
+]
+
+
+def write_xlsx(path: str):
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(COLUMNS)
+    for row in ROWS:
+        sheet.append(row)
+    workbook.save(path)
+
+
+def main():
+    ok = True
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "upload.xlsx")
+        write_xlsx(path)
+        expected = pd.read_excel(path, dtype=str)
+        for batch_size in (1, 2, 100):
+            actual = pd.concat(list(iter_record_batches(path, batch_size=batch_size)), ignore_index=True)
+            same = (list(actual.columns) == list(expected.columns) and len(actual) == len(expected)
+                    and actual.isna().equals(expected.isna())
+                    and actual.fillna("").astype(str).equals(expected.fillna("").astype(str)))
+            ok &= same
+            print(f"{'✅' if same else '❌'} batch_size={batch_size}：{len(actual)} 列，"
+                  f"read_excel {len(expected)} 列，空值位置與內容{'相同' if same else '不同'}")
+            if not same:
+                print(actual, expected, sep="\n")
+
+        uploaded = read_upload(path)
+        has_none = bool((uploaded == "None").any().any())
+        ok &= not has_none
+        print("❌ read_upload 的空值出現 \"None\"" if has_none else "✅ read_upload 的空值一律為 \"nan\"")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# check_streamlit_reruns.py
+# 用 Streamlit AppTest 跑 main.py，計算每次 rerun 實際送出的 SQL 與 LLM 呼叫數：
+# 第一次查詢 / 問答會呼叫後端，之後什麼都沒改的 rerun 必須是 0 次，否則以非 0 結束
+# LLM 呼叫全部換成假的回覆，不會真的打 API；SQL 用專案根目錄的 SOC.db
+# 用法（在專案根目錄）: python -m benchmarks.check_streamlit_reruns
+
+import sys
+from unittest import mock
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from streamlit.testing.v1 import AppTest
+
+from benchmarks.synthetic import generate_alerts
+from llm_gateway import LLMGateway
+
+calls = {"sql": 0, "llm": 0}
+
+
+class FakeUpload:
+    """AppTest 不支援 file_uploader，直接回傳一個有 name / getvalue 的物件"""
+    name = "alerts.csv"
+
+    def __init__(self, data: bytes):
+        self._data = data
+
+    def getvalue(self) -> bytes:
+        return self._data
+
+
+def fake_chat(self, messages, *args, **kwargs):
+    calls["llm"] += 1
+    prompt = str(messages[-1]["content"])
+    if "請產出查詢語法" in prompt:
+        return "SELECT * FROM SOC_data LIMIT 2;"
+    return "假的 LLM 回覆"
+
+
+def fake_chat_stream(self, messages, *args, **kwargs):
+    calls["llm"] += 1
+    yield "假的"
+    yield "串流回覆"
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _count_sql(conn, cursor, statement, parameters, context, executemany):
+    calls["sql"] += 1
+
+
+def step(at: AppTest, label: str, action=None) -> dict:
+    before = dict(calls)
+    (action(at) if action else at).run()
+    if at.exception:
+        raise RuntimeError(f"{label}：{at.exception[0].message}")
+    used = {key: calls[key] - before[key] for key in calls}
+    print(f"{label:<28} SQL {used['sql']:>3} 次，LLM {used['llm']:>3} 次")
+    return used
+
+
+def main():
+    upload = FakeUpload(generate_alerts(5).to_csv(index=False).encode("utf-8"))
+    with mock.patch("streamlit.file_uploader", return_value=upload), \
+            mock.patch.object(LLMGateway, "chat", fake_chat), \
+            mock.patch.object(LLMGateway, "chat_stream", fake_chat_stream):
+        at = AppTest.from_file("main.py", default_timeout=120)
+
+        ok = True
+        step(at, "第一次載入（上傳檔案）")
+        reruns = [step(at, "rerun（沒有任何改變）")]
+
+        step(at, "按下 src_ip 查詢", lambda t: next(b for b in t.button if b.label == "src_ip").click())
+        reruns.append(step(at, "rerun（沒有任何改變）"))
+
+        step(at, "送出問題", lambda t: t.chat_input[0].set_value("來源 IP 是 10.0.0.1 的事件有哪些"))
+        reruns.append(step(at, "rerun（沒有任何改變）"))
+
+        for used in reruns:
+            if used["sql"] or used["llm"]:
+                ok = False
+        print(f"\n{'✅' if ok else '❌'} 沒有改變的 rerun {'不會' if ok else '仍會'}呼叫 SQL / LLM")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
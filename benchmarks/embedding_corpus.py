@@ -0,0 +1,32 @@
+# embedding_corpus.py
+# embedding benchmark 用的文字：優先取 SOC.db 的真實告警，沒有資料庫時改用 synthetic.py 的假資料
+
+import os
+import sqlite3
+
+import pandas as pd
+
+from benchmarks.synthetic import generate_alerts
+from utils import dataframe_to_texts
+
+SOC_DB_PATH = "SOC.db"
+TABLE_NAME = "SOC_data"
+# 只取原始欄位，xlsx_to_database 加上的衍生欄位不算
+_DERIVED_COLUMNS = {"row_id", "time_raw", "time_epoch", "src_ip_num", "dest_ip_num"}
+
+
+def load_corpus(n: int, db_path: str = SOC_DB_PATH) -> list:
+    if os.path.exists(db_path):
+        try:
+            with sqlite3.connect(db_path) as conn:
+                df = pd.read_sql_query(f'SELECT * FROM "{TABLE_NAME}" LIMIT {int(n)}', conn)
+            df = df.drop(columns=[col for col in df.columns if col in _DERIVED_COLUMNS])
+            texts = dataframe_to_texts(df)
+            if texts:
+                # 真實資料不夠時補上假資料
+                if len(texts) < n:
+                    texts += dataframe_to_texts(generate_alerts(n - len(texts)))
+                return texts
+        except (sqlite3.Error, pd.errors.DatabaseError) as e:
+            print(f"⚠️ 無法讀取 {db_path}，改用假資料：{e}")
+    return dataframe_to_texts(generate_alerts(n))
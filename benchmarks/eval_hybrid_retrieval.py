@@ -0,0 +1,84 @@
+# eval_hybrid_retrieval.py
+# 離線評估產生筆記用的相似事件檢索：SQL 精確比對、向量搜尋、hybrid 三種做法的 recall@k 與延遲
+# 用 synthetic.py 的假告警建立暫存的 SQLite 與 Chroma，從中抽樣當查詢：
+# - same   : 與歷史事件完全相同（note 清空）
+# - new_ip : 換成沒看過的來源 IP，SQL 的 AND 比對會查不到
+# 正確答案是被抽樣的那筆歷史事件（row_id）
+# 需要 chromadb 與 sentence-transformers
+# 用法（在專案根目錄）: python -m benchmarks.eval_hybrid_retrieval --history 5000 --queries 200 --k 3
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import hybrid_retriever
+import ingest
+import query
+import utils
+from benchmarks.synthetic import build_synthetic_db, generate_alerts
+from utils import compute_row_ids
+
+
+def build_stores(tmp: str, history):
+    db_file = os.path.join(tmp, "SOC.db")
+    # seed 是該批的起始列號，直接切出 history 的對應列
+    build_synthetic_db(db_file, len(history), generator=lambda n, seed: history.iloc[seed:seed + n].copy(),
+                       table_name=query.TABLE_NAME)
+    query.SQLITE_PATH = f"sqlite:///{db_file}"
+
+    chroma_dir = os.path.join(tmp, "chroma_db")
+    ingest.CHROMA_DIR = utils.CHROMA_DIR = chroma_dir
+    ingest.STATE_FILE = os.path.join(chroma_dir, "ingest_state.json")
+    csv_file = os.path.join(tmp, "history.csv")
+    history.to_csv(csv_file, index=False)
+    ingest.ingest_to_chroma(csv_file)
+
+
+def make_queries(history, n: int, seed: int = 0):
+    rng = random.Random(seed)
+    sample = history.sample(n, random_state=seed).copy()
+    expected = compute_row_ids(sample).tolist()
+    same = sample.assign(note="")
+    new_ip = same.assign(src_ip=[f"172.31.{rng.randint(0, 255)}.{rng.randint(1, 254)}" for _ in range(n)])
+    return {"same": same, "new_ip": new_ip}, expected
+
+
+def recall_at_k(results, expected, k: int) -> float:
+    hits = sum(any(hybrid_retriever.record_key(r) == row_id for r in records[:k])
+               for records, row_id in zip(results, expected))
+    return hits / len(expected)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--history", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3)
+    args = parser.parse_args()
+
+    history = generate_alerts(args.history, seed=1)
+    with tempfile.TemporaryDirectory() as tmp:
+        build_stores(tmp, history)
+        query_sets, expected = make_queries(history, args.queries)
+
+        print(f"\n歷史事件 {args.history} 筆，查詢 {args.queries} 筆，k={args.k}")
+        print(f"{'查詢':<8}{'方法':<8}{f'recall@{args.k}':>10}{'總耗時 s':>10}{'ms/列':>10}")
+        for name, df in query_sets.items():
+            methods = {
+                "sql": lambda d: hybrid_retriever.sql_candidates(d, args.k),
+                "ann": lambda d: [[r for r, _ in c] for c in
+                                  hybrid_retriever.ann_candidates(hybrid_retriever.query_texts(d), args.k)],
+                "hybrid": lambda d: hybrid_retriever.hybrid_similar_records(d, top_k=args.k),
+            }
+            for method, run in methods.items():
+                start = time.perf_counter()
+                results = run(df)
+                seconds = time.perf_counter() - start
+                print(f"{name:<8}{method:<8}{recall_at_k(results, expected, args.k):>10.1%}"
+                      f"{seconds:>10.2f}{seconds / len(df) * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# eval_need_retrieval.py
+# 離線評估 need_retrieval 本地判斷（規則 + 最近鄰）與原本 LLM 判斷的準確率與延遲
+# 用法（在專案根目錄）:
+#   python -m benchmarks.eval_need_retrieval            # 同時跑 LLM 判斷做對照
+#   python -m benchmarks.eval_need_retrieval --no-llm   # 只評估本地判斷，不打 API（route_query 需要升級時仍會呼叫 LLM）
+
+import argparse
+import time
+
+import numpy as np
+
+from rag_model.need_retrieval import llm_need_retrieval, route_query
+
+# 與 LABELLED_EXAMPLES 不重複的評估集（True = 需要查資料）
+EVAL_SET = [
+    ("請幫我找出來源 IP 是 10.0.0.1 的所有事件", True),
+    ("192.168.72.41 最近有觸發什麼告警", True),
+    ("目的 port 53 的事件有哪些", True),
+    ("有關 Suspicious domain reqres.in has been detected! 的資料", True),
+    ("zantrilo.com 之前怎麼處理的", True),
+    ("幫我列出時間最近的3筆資料", True),
+    ("最近有沒有可疑 IP 的告警", True),
+    ("林志豪觸發過的事件", True),
+    ("哪些事件的結論是暫列觀察", True),
+    ("列出所有 dest_ip 為 103.211.47.92 的紀錄", True),
+    ("過去有類似 IPFS 的告警嗎", True),
+    ("which signature fired the most last week", True),
+    ("這個月總共有幾筆告警", True),
+    ("幫我整理創研院的告警紀錄", True),
+    ("2001:db8::1 最近有觸發什麼告警", True),
+    ("fe80::1c2d:3e4f:5a6b:7c8d 的事件", True),
+    ("什麼是中間人攻擊", False),
+    ("XSS 和 CSRF 的差別是什麼", False),
+    ("請說明 IDS 與 IPS 的不同", False),
+    ("要怎麼寫一份資安事件報告", False),
+    ("what is lateral movement", False),
+    ("如何強化密碼政策", False),
+    ("早安", False),
+    ("推薦幾本資安入門書", False),
+    ("MFA 可以防止哪些攻擊", False),
+    ("explain the MITRE ATT&CK framework", False),
+    ("會議 10:30:00 開始，什麼是 DDoS", False),
+    ("node.js 有哪些常見漏洞", False),
+    ("什麼是 ASP.NET", False),
+]
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) * 1000 if values else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--no-llm", action="store_true", help="不跑 LLM 對照組")
+    args = parser.parse_args()
+
+    # 暖機：載入 signature 清單與 embedding 模型，不計入延遲
+    route_query("warm up")
+
+    local_latency, llm_latency = [], []
+    local_correct = llm_correct = agree = 0
+    sources = {}
+    print(f"{'label':>5} {'local':>5} {'source':>6} {'llm':>5}  question")
+    for question, label in EVAL_SET:
+        start = time.perf_counter()
+        decision = route_query(question)
+        local_latency.append(time.perf_counter() - start)
+        sources[decision["source"]] = sources.get(decision["source"], 0) + 1
+        local_correct += decision["need"] == label
+
+        llm_answer = "-"
+        if not args.no_llm:
+            start = time.perf_counter()
+            llm_answer = llm_need_retrieval(question)
+            llm_latency.append(time.perf_counter() - start)
+            llm_correct += llm_answer == label
+            agree += llm_answer == decision["need"]
+        print(f"{str(label):>5} {str(decision['need']):>5} {decision['source']:>6} {str(llm_answer):>5}  {question}")
+
+    n = len(EVAL_SET)
+    print("\n==== 結果 ====")
+    print(f"本地判斷 accuracy: {local_correct / n:.2%}，來源分布: {sources}")
+    print(f"本地判斷延遲 p50={percentile(local_latency, 50):.1f}ms p95={percentile(local_latency, 95):.1f}ms")
+    if llm_latency:
+        print(f"LLM 判斷 accuracy: {llm_correct / n:.2%}，與本地判斷一致率: {agree / n:.2%}")
+        print(f"LLM 判斷延遲 p50={percentile(llm_latency, 50):.1f}ms p95={percentile(llm_latency, 95):.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+# fake_openai_server.py
+# 本機假的 OpenAI 相容伺服器，只實作 /v1/chat/completions，用來離線量測 LLM 呼叫的併發行為
+# - latency 為首字前的延遲，token_latency 為每個 token（一個字元算一個）的生成時間
+# - rag_core 產生 SQL 的 prompt 會回覆 sql_reply，其他 prompt 回覆假摘要（reply_tokens 可把回覆補到固定長度）
+# 用法: python -m benchmarks.fake_openai_server --port 8900 --latency 0.5 --tokens-per-second 50
+
+import argparse
+import json
+import re
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# rag_core.SQL_PROMPT_TEMPLATE 結尾的固定字串
+SQL_PROMPT_MARKER = "請產出查詢語法"
+DEFAULT_SQL_REPLY = 'SELECT * FROM SOC_data ORDER BY "time" DESC LIMIT 5;'
+# sql_reply 裡的 {ip} 換成問題中的第一個 IPv4，SQL 帶有問題的字面值，SQL 查詢計畫快取才能套用
+_QUESTION_RE = re.compile(r"使用者問題：(.*)")
+_IPV4_RE = re.compile(r"\b\d{1,3}(?:\.\d{1,3}){3}\b")
+
+
+def fake_sql(prompt: str, sql_reply: str) -> str:
+    question = _QUESTION_RE.search(prompt)
+    ip = _IPV4_RE.search(question.group(1)) if question else None
+    return sql_reply.replace("{ip}", ip.group(0) if ip else "127.0.0.1")
+
+
+def fake_usage(payload: dict, content: str) -> dict:
+    # 大約 2 個字元 1 個 token，與 llm_gateway 的估算方式相同
+    prompt_chars = sum(len(json.dumps(m.get("content", ""), ensure_ascii=False)) for m in payload.get("messages", []))
+    usage = {"prompt_tokens": prompt_chars // 2, "completion_tokens": len(content)}
+    usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+    return usage
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    # latency / request_count 等設定掛在 server 物件上，讓每個 handler 共用
+    def _reply_json(self, status: int, body: dict):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _reply_stream(self, payload: dict, content: str):
+        # SSE 格式，每個字元一個 chunk，chunk 之間間隔 token_latency 秒
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for piece in content:
+            chunk = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": payload.get("model", "fake"),
+                "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            time.sleep(self.server.token_latency)
+        if (payload.get("stream_options") or {}).get("include_usage"):
+            # 與 OpenAI 相同：最後多一個沒有 choices、只有 usage 的 chunk
+            chunk = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": payload.get("model", "fake"),
+                "choices": [],
+                "usage": fake_usage(payload, content),
+            }
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("chat/completions"):
+            self._reply_json(404, {"error": {"message": f"unknown path {self.path}"}})
+            return
+
+        time.sleep(self.server.latency)
+        with self.server.lock:
+            self.server.request_count += 1
+            failure = self.server.failures.popleft() if self.server.failures else None
+        if failure is not None:
+            # 模擬 429 / 5xx，讓呼叫端的重試邏輯可以離線驗證
+            self._reply_json(failure, {"error": {"message": f"injected {failure}", "type": "fake_error"}})
+            return
+
+        messages = payload.get("messages", [])
+        prompt = str(messages[-1].get("content", "")) if messages else ""
+        if SQL_PROMPT_MARKER in prompt:
+            content = fake_sql(prompt, self.server.sql_reply)
+        else:
+            content = f"【假摘要】收到 {len(payload.get('messages', []))} 則訊息"
+            if self.server.reply_tokens:
+                content = content.ljust(self.server.reply_tokens, "。")
+        if payload.get("stream"):
+            self._reply_stream(payload, content)
+            return
+        # 非串流要等整段「生成」完才回覆
+        time.sleep(self.server.token_latency * len(content))
+        self._reply_json(200, {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model", "fake"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": fake_usage(payload, content),
+        })
+
+    def log_message(self, format, *args):
+        # 關掉每個 request 的 access log，避免干擾 benchmark 輸出
+        pass
+
+
+def start_fake_server(latency: float = 0.5, host: str = "127.0.0.1", port: int = 0,
+                      token_latency: float = 0.0, reply_tokens: int = 0, sql_reply: str = DEFAULT_SQL_REPLY):
+    """在背景 thread 啟動假伺服器，回傳 (server, base_url)；latency 為首字前延遲，token_latency 為串流時每個 chunk 的間隔"""
+    server = ThreadingHTTPServer((host, port), FakeOpenAIHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.token_latency = token_latency
+    server.reply_tokens = reply_tokens
+    server.sql_reply = sql_reply
+    server.request_count = 0
+    server.lock = threading.Lock()
+    server.failures = deque()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base_url = f"http://{host}:{server.server_address[1]}/v1"
+    return server, base_url
+
+
+def inject_failures(server, status_codes):
+    """接下來的請求依序回傳這些錯誤狀態碼，用完後恢復正常"""
+    with server.lock:
+        server.failures.extend(status_codes)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=0.5, help="每個請求的模擬延遲（秒）")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="串流時每個 chunk 的間隔（秒）")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="生成速度，設定時取代 --token-latency")
+    parser.add_argument("--reply-tokens", type=int, default=0, help="假摘要補到這個長度（一個字元算一個 token）")
+    args = parser.parse_args()
+
+    token_latency = 1.0 / args.tokens_per_second if args.tokens_per_second > 0 else args.token_latency
+    server, base_url = start_fake_server(args.latency, args.host, args.port, token_latency, args.reply_tokens)
+    print(f"🧪 假 OpenAI 伺服器啟動於 {base_url}（延遲 {args.latency}s），Ctrl+C 結束")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
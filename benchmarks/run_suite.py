@@ -0,0 +1,300 @@
+# run_suite.py
+# 可重現的整體 benchmark：用 synthetic.py 的長尾假資料與本機假 OpenAI 伺服器，依序量測
+# - xlsx_to_database.create_sqlite_from_excel：完整重建與增量匯入的 rows/s
+# - ingest.ingest_to_chroma：rows/s（缺 chromadb / sentence-transformers 時記為略過）
+# - query.py：query_by_field p50/p95、query_by_field_values、query_by_cidr、search_text
+# - query.find_and_generate_note_from_sql：每列延遲
+# - rag_core.dual_query 端到端：SQL 計畫快取冷 / 熱的 p50/p95，以及 tracing 各階段的 p50/p95
+# 結果寫成 JSON（預設 benchmarks/results/<commit>.json），--compare 可與另一個 commit 的結果比較，
+# 任何一項變差超過 --tolerance 就以非 0 結束
+# 所有檔案都寫在暫存目錄，不會動到專案的 SOC.db、data/ 與快取
+# 用法（在專案根目錄）: python -m benchmarks.run_suite --rows 1000000
+#                       python -m benchmarks.run_suite --rows 1000000 --compare benchmarks/results/abc1234.json
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from benchmarks.fake_openai_server import start_fake_server
+from benchmarks.synthetic import generate_realistic_alerts, write_alerts_csv
+
+# SQLite 一定會建立（其他階段都要用），這些階段可以用 --stages 挑選
+STAGES = ["ingest", "lookup", "note", "dual_query"]
+# 假伺服器對每個問題回覆的 SQL（{ip} 換成問題裡的 IP），每題都是 5 筆事件摘要 + 比較
+SQL_REPLY = 'SELECT * FROM SOC_data WHERE src_ip = \'{ip}\' ORDER BY "time" DESC LIMIT 5;'
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def percentile(values, q: float) -> float:
+    # nearest-rank，與 tracing.Metrics.summary 相同
+    values = sorted(values)
+    return values[max(0, math.ceil(q * len(values)) - 1)]
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def median_seconds(repeat: int, fn, *args, **kwargs) -> float:
+    # 只跑一次的量測雜訊很大，重複幾次取中位數
+    return sorted(timed(fn, *args, **kwargs)[1] for _ in range(repeat))[repeat // 2]
+
+
+class Results:
+    def __init__(self):
+        self.values = {}
+
+    def add(self, name: str, value: float, unit: str, better: str = "lower"):
+        """better 為 lower（耗時）或 higher（吞吐量），--compare 依此判斷是否變差"""
+        self.values[name] = {"value": round(value, 6), "unit": unit, "better": better}
+        print(f"  {name:<48}{value:>14.4f} {unit}")
+
+    def add_latencies(self, name: str, seconds: list):
+        self.add(f"{name}.p50_ms", percentile(seconds, 0.5) * 1000, "ms")
+        self.add(f"{name}.p95_ms", percentile(seconds, 0.95) * 1000, "ms")
+
+    def skip(self, name: str, reason: str):
+        self.values[name] = {"skipped": reason}
+        print(f"  {name:<48}略過：{reason}")
+
+
+def git_info() -> dict:
+    def git(*args):
+        try:
+            return subprocess.run(["git", *args], capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return ""
+    return {
+        "commit": git("rev-parse", "--short", "HEAD") or "unknown",
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+    }
+
+
+# ==== 各階段 ====
+
+def bench_build(results: Results, csv_file: str, extra_csv: str, db_file: str, rows: int, extra_rows: int):
+    from data_ingestion import xlsx_to_database
+    _, elapsed = timed(xlsx_to_database.create_sqlite_from_excel, csv_file, db_file, xlsx_to_database.TABLE_NAME)
+    results.add("build.full.seconds", elapsed, "s")
+    results.add("build.full.rows_per_s", rows / elapsed, "rows/s", "higher")
+    _, elapsed = timed(xlsx_to_database.create_sqlite_from_excel, extra_csv, db_file, xlsx_to_database.TABLE_NAME,
+                       incremental=True)
+    results.add("build.incremental.seconds", elapsed, "s")
+    results.add("build.incremental.rows_per_s", extra_rows / elapsed, "rows/s", "higher")
+    results.add("build.db_mb", os.path.getsize(db_file) / 1024 / 1024, "MB")
+
+
+def bench_ingest(results: Results, tmp: str, sample: pd.DataFrame):
+    try:
+        import ingest
+        import utils
+        ingest.EmbeddingEngine(workers=1).encode(["warmup"])
+    except Exception as e:
+        results.skip("ingest", f"{type(e).__name__}: {e}")
+        return
+    # 模型載入不算在內，只量 embedding + 寫入
+    chroma_dir = os.path.join(tmp, "chroma_db")
+    ingest.CHROMA_DIR = utils.CHROMA_DIR = chroma_dir
+    ingest.STATE_FILE = os.path.join(chroma_dir, "ingest_state.json")
+    csv_file = os.path.join(tmp, "ingest.csv")
+    sample.to_csv(csv_file, index=False)
+    _, elapsed = timed(ingest.ingest_to_chroma, csv_file)
+    results.add("ingest.seconds", elapsed, "s")
+    results.add("ingest.rows_per_s", len(sample) / elapsed, "rows/s", "higher")
+
+
+def bench_lookup(results: Results, sample: pd.DataFrame, n: int, seed: int):
+    import query
+    rng = random.Random(seed)
+    # 查詢值從同分布的資料抽，熱門值被查到的機率也比較高
+    for field in ("src_ip", "dest_ip", "domain"):
+        values = rng.sample(list(sample[field]), n)
+        query.query_by_field(field, values[0])   # 反射資料表、建立連線池
+        latencies = [timed(query.query_by_field, field, value)[1] for value in values]
+        results.add_latencies(f"lookup.query_by_field.{field}", latencies)
+
+    values = list(sample["dest_ip"].drop_duplicates()[:1000])
+    results.add("lookup.query_by_field_values.1000.seconds",
+                median_seconds(5, query.query_by_field_values, "dest_ip", values), "s")
+
+    cidrs = [f"10.{i // 254 % 256}.{i % 254}.0/24" for i in range(0, 100 * 97, 97)] + ["2001:db8::/64"]
+    results.add("lookup.query_by_cidr.101.seconds", median_seconds(5, query.query_by_cidr, "dest_ip", cidrs), "s")
+
+    for order in ("rank", "recent"):
+        latencies = [timed(query.search_text, term, order=order)[1]
+                     for term in ("python-requests", "資管處 誤報", "Suspicious domain", "api/v2", "隔離掃毒")]
+        results.add_latencies(f"lookup.search_text.{order}", latencies)
+
+
+def bench_note(results: Results, sample: pd.DataFrame, n: int, gateway):
+    import query
+    before = gateway.stats()["requests"]
+    latencies = []
+    for _, row in sample.head(n).iterrows():
+        row = row.copy()
+        row["note"] = ""
+        latencies.append(timed(query.find_and_generate_note_from_sql, row)[1])
+    results.add_latencies("note.find_and_generate_note_from_sql", latencies)
+    results.add("note.llm_calls_per_row", (gateway.stats()["requests"] - before) / n, "calls")
+
+
+def bench_dual_query(results: Results, sample: pd.DataFrame, n: int, gateway):
+    from rag_model import rag_core
+    from tracing import metrics, start_trace
+    questions = [f"列出來源 IP {ip} 最近的告警" for ip in sample["src_ip"].drop_duplicates()[:n]]
+
+    def run(question: str) -> float:
+        with start_trace("rag_chat", query=question):
+            return timed(rag_core.dual_query, question)[1]
+
+    run(questions[0])   # 載入 langchain 與反射 schema 不算在內
+    metrics.reset()
+    before = gateway.stats()["requests"]
+    cold = []
+    for question in questions:
+        rag_core.sql_plan_cache.clear()
+        cold.append(run(question))
+    results.add_latencies("dual_query.cold", cold)
+    results.add("dual_query.llm_calls_per_query", (gateway.stats()["requests"] - before) / n, "calls")
+    # 各階段只看冷的部分，每個階段（含 LLM 產生 SQL）都有執行到
+    for stage, summary in sorted(metrics.summary().items()):
+        results.add(f"dual_query.stage.{stage}.p50_ms", summary["p50"] * 1000, "ms")
+        results.add(f"dual_query.stage.{stage}.p95_ms", summary["p95"] * 1000, "ms")
+    # 熱：SQL 計畫快取都命中，不再呼叫 LLM 產生 SQL
+    results.add_latencies("dual_query.warm", [run(question) for question in questions])
+
+
+# ==== 比較 ====
+
+def compare(current: dict, baseline: dict, tolerance: float) -> int:
+    """印出兩份結果的比值，回傳變差超過 tolerance 的項目數"""
+    print(f"\n與 {baseline['meta'].get('commit')} 比較（容許 {tolerance:.0%}）")
+    ignored = ("output", "compare", "tolerance")
+    params = {k: v for k, v in current["meta"]["args"].items() if k not in ignored}
+    base_params = {k: v for k, v in baseline["meta"].get("args", {}).items() if k not in ignored}
+    if params != base_params:
+        print(f"⚠️ 兩次的參數不同，比較可能沒有意義：{base_params} vs {params}")
+    print(f"{'指標':<50}{'基準':>12}{'本次':>12}{'比值':>8}")
+    regressions = 0
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if "value" not in result or not base or "value" not in base or not base["value"]:
+            continue
+        ratio = result["value"] / base["value"]
+        worse = ratio > 1 + tolerance if result["better"] == "lower" else ratio < 1 - tolerance
+        regressions += worse
+        print(f"{name:<50}{base['value']:>12.4f}{result['value']:>12.4f}{ratio:>7.2f}x{'  ❌' if worse else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100000, help="SQLite 完整重建的筆數，可到 10000000")
+    parser.add_argument("--incremental-rows", type=int, default=0, help="增量匯入的筆數，預設為 rows 的 10%%")
+    parser.add_argument("--ingest-rows", type=int, default=2000, help="寫入 Chroma 的筆數（embedding 很慢，另外設定）")
+    parser.add_argument("--lookups", type=int, default=200, help="每個欄位 query_by_field 的查詢次數")
+    parser.add_argument("--note-rows", type=int, default=20, help="find_and_generate_note_from_sql 的列數")
+    parser.add_argument("--queries", type=int, default=10, help="dual_query 的問題數")
+    parser.add_argument("--latency", type=float, default=0.2, help="假伺服器首字前延遲（秒）")
+    parser.add_argument("--tokens-per-second", type=float, default=200, help="假伺服器生成速度，0 表示瞬間完成")
+    parser.add_argument("--reply-tokens", type=int, default=100, help="假摘要長度")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stages", default=",".join(STAGES), help="要跑的階段，逗號分隔")
+    parser.add_argument("--output", default="", help="結果 JSON，預設 benchmarks/results/<commit>.json")
+    parser.add_argument("--compare", default="", help="要比較的基準結果 JSON")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="容許變差的比例")
+    args = parser.parse_args()
+    stages = [stage for stage in args.stages.split(",") if stage]
+    extra_rows = args.incremental_rows or max(1, args.rows // 10)
+
+    token_latency = 1.0 / args.tokens_per_second if args.tokens_per_second > 0 else 0.0
+    server, base_url = start_fake_server(latency=args.latency, token_latency=token_latency,
+                                         reply_tokens=args.reply_tokens, sql_reply=SQL_REPLY)
+    tmp = tempfile.mkdtemp(prefix="soc_bench_")
+    # 必須在 import 專案模組之前設定：LLM 打假伺服器、不用也不寫入 LLM 快取、embedding 快取從空的開始、不寫 trace 檔
+    os.environ.update({
+        "OPENAI_BASE_URL": base_url,
+        "LLM_CACHE_DISABLED": "1",
+        "EMBED_CACHE_PATH": os.path.join(tmp, "embedding_cache.sqlite3"),
+        "TRACE_PATH": "",
+        "METRICS_PORT": "0",
+    })
+    import query
+    from llm_gateway import get_gateway
+    from rag_model import rag_core
+
+    db_file = os.path.join(tmp, "SOC.db")
+    query.SQLITE_PATH = rag_core.SQLITE_PATH = f"sqlite:///{db_file}"
+    rag_core.CHROMA_PATH = os.path.join(tmp, "chroma_db")
+
+    print(f"暫存目錄 {tmp}，假伺服器 {base_url}（延遲 {args.latency}s，{args.tokens_per_second} tokens/s）")
+    csv_file = os.path.join(tmp, "alerts.csv")
+    extra_csv = os.path.join(tmp, "alerts_extra.csv")
+    _, elapsed = timed(write_alerts_csv, csv_file, args.rows, seed=args.seed)
+    # 增量資料接在後面，時間與 row_id 都不重複
+    generate_realistic_alerts(extra_rows, seed=args.seed + args.rows, offset=args.rows).to_csv(extra_csv, index=False)
+    print(f"產生 {args.rows} + {extra_rows} 筆假資料：{elapsed:.1f}s")
+    # 查詢與產生筆記用的列取自已入庫的資料，才查得到相似事件
+    sample = pd.read_csv(csv_file, nrows=max(args.ingest_rows, args.lookups, 1000), dtype=str, keep_default_na=False)
+
+    results = Results()
+    gateway = get_gateway()
+    print("\n[build]")
+    bench_build(results, csv_file, extra_csv, db_file, args.rows, extra_rows)
+    if "ingest" in stages:
+        print("\n[ingest]")
+        bench_ingest(results, tmp, sample.head(args.ingest_rows))
+    if "lookup" in stages:
+        print("\n[lookup]")
+        bench_lookup(results, sample, args.lookups, args.seed)
+    if "note" in stages:
+        print("\n[note]")
+        bench_note(results, sample, args.note_rows, gateway)
+    if "dual_query" in stages:
+        print("\n[dual_query]")
+        bench_dual_query(results, sample, args.queries, gateway)
+    server.shutdown()
+    shutil.rmtree(tmp, ignore_errors=True)
+
+    info = git_info()
+    report = {
+        "meta": {
+            **info,
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+        },
+        "results": results.values,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"{info['commit']}{'-dirty' if info['dirty'] else ''}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n結果已寫入 {output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print(f"❌ {regressions} 項變差超過 {args.tolerance:.0%}")
+            sys.exit(1)
+        print("✅ 沒有超過容許範圍的退步")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+# synthetic.py
+# 產生符合 SOC_data 欄位的假告警資料，給 benchmark 使用（不含任何真實資料）
+# - generate_alerts：各欄位均勻分布，既有 benchmark 沿用，結果才能跟以前比較
+# - generate_realistic_alerts / iter_alerts：告警名稱、IP、網域依長尾（Zipf）分布，少數告警與主機佔大部分事件，
+#   payload 與 note 有內容，可分批產生到 1000 萬筆以上
+# - build_synthetic_db：分批產生假告警，以 xlsx_to_database 的 schema 與索引建立 SQLite
+
+import random
+import sqlite3
+from datetime import datetime, timedelta
+from typing import Callable, Iterator
+
+import numpy as np
+import pandas as pd
+
+from data_ingestion.xlsx_to_database import (
+    TABLE_NAME, create_indexes, create_soc_table, insert_dataframe, prepare_dataframe,
+)
+
+SOC_COLUMNS = ["time", "alert.signature", "src_ip", "src_port", "dest_ip", "dest_port", "domain", "payload", "note"]
+
+
+def generate_alerts(n: int, seed: int = 0, start: datetime = datetime(2025, 1, 1)) -> pd.DataFrame:
+    """產生 n 筆假告警，所有欄位都是字串，與 pd.read_excel(dtype=str) 讀進來的格式相同"""
+    rng = random.Random(seed)
+    domains = [f"host{i}.example{i % 50}.com" for i in range(2000)]
+    signatures = [f"Suspicious domain {d} has been detected!" for d in domains[:300]] + \
+                 [f"Suspicious ip 203.0.{i // 256}.{i % 256} has been detected!" for i in range(200)]
+    rows = []
+    for i in range(n):
+        t = start + timedelta(seconds=i * 30 + rng.randint(0, 29))
+        rows.append((
+            t.strftime("%Y-%m-%d %H:%M:%S"),
+            rng.choice(signatures),
+            f"192.168.{rng.randint(0, 255)}.{rng.randint(1, 254)}",
+            str(rng.randint(1024, 65535)),
+            f"10.{rng.randint(0, 15)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}",
+            rng.choice(["53", "80", "443", "8080", "22"]),
+            rng.choice(domains),
+            "",
+            rng.choice(["暫列觀察", "待觀察", "已確認為誤報", ""]),
+        ))
+    return pd.DataFrame(rows, columns=SOC_COLUMNS)
+
+
+# 長尾分布的基數與偏斜程度（Zipf 指數，越大越集中在少數值）
+REALISTIC_CARDINALITY = {"signature": 800, "src_ip": 5000, "dest_ip": 50000, "domain": 20000}
+REALISTIC_SKEW = 1.1
+
+_NOTE_TEMPLATES = [
+    "暫列觀察",
+    "待觀察---觸發告警{count}筆。{unit}同仁，觀看近期 query domain 為 {domain}，初步推測為工作需求。",
+    "已確認為誤報，{domain} 為內部服務網域。",
+    "已通知{unit}處理，來源主機 {src_ip} 已隔離掃毒。",
+    "{unit}同仁進行開發測試觸發，已關閉。",
+    "",
+]
+_UNITS = ["資管處", "智科院", "營運處", "研發中心", "財務處"]
+
+
+def _zipf_probabilities(n: int, skew: float = REALISTIC_SKEW) -> np.ndarray:
+    weights = 1.0 / np.arange(1, n + 1) ** skew
+    return weights / weights.sum()
+
+
+def _value_pools(seed: int = 0) -> dict:
+    """各欄位的候選值，固定 seed 讓每批資料共用同一組值"""
+    rng = np.random.default_rng(seed)
+    n_domain = REALISTIC_CARDINALITY["domain"]
+    domains = np.array([f"{'cdn' if i % 7 == 0 else 'host'}{i}.example{i % 97}.{('com', 'net', 'io', 'tw')[i % 4]}"
+                        for i in range(n_domain)], dtype=object)
+    n_sig = REALISTIC_CARDINALITY["signature"]
+    signature_domains = rng.choice(n_domain, n_sig, replace=False)
+    signatures = []
+    for i in range(n_sig):
+        if i % 3 == 2:
+            signatures.append(f"Suspicious ip 203.0.{i // 256}.{i % 256} has been detected!")
+        else:
+            signatures.append(f"Suspicious domain {domains[signature_domains[i]]} has been detected!")
+    src_ips = [f"192.168.{i // 254 % 256}.{i % 254 + 1}" for i in range(REALISTIC_CARDINALITY["src_ip"])]
+    # 約 2% 的目的位址是 IPv6
+    dest_ips = [f"2001:db8::{i:x}" if i % 50 == 49 else f"10.{i // 64516 % 256}.{i // 254 % 254}.{i % 254 + 1}"
+                for i in range(REALISTIC_CARDINALITY["dest_ip"])]
+    return {
+        "signature": np.array(signatures, dtype=object),
+        "signature_domain": signature_domains,
+        "domain": domains,
+        "src_ip": np.array(src_ips, dtype=object),
+        "dest_ip": np.array(dest_ips, dtype=object),
+        "p": {name: _zipf_probabilities(size) for name, size in REALISTIC_CARDINALITY.items()},
+    }
+
+
+_pools = None
+
+
+def generate_realistic_alerts(n: int, seed: int = 0, start: datetime = datetime(2025, 1, 1),
+                              offset: int = 0) -> pd.DataFrame:
+    """
+    產生 n 筆長尾分布的假告警（所有欄位都是字串）；offset 為前面已產生的筆數，
+    分批產生時時間會接續下去（平均每 30 秒一筆）
+    """
+    global _pools
+    if _pools is None:
+        _pools = _value_pools()
+    pools = _pools
+    rng = np.random.default_rng(seed)
+
+    seconds = (offset + np.arange(n)) * 30 + rng.integers(0, 30, n)
+    times = (np.datetime64(start, "s") + seconds.astype("timedelta64[s]")).astype(str)
+    sig_idx = rng.choice(len(pools["signature"]), n, p=pools["p"]["signature"])
+    # 網域類告警的 domain 就是告警裡的網域，其餘從網域分布抽
+    domain_idx = np.where(sig_idx % 3 == 2, rng.choice(len(pools["domain"]), n, p=pools["p"]["domain"]),
+                          pools["signature_domain"][sig_idx])
+    domains = pools["domain"][domain_idx]
+    src_ips = pools["src_ip"][rng.choice(len(pools["src_ip"]), n, p=pools["p"]["src_ip"])]
+    dest_ips = pools["dest_ip"][rng.choice(len(pools["dest_ip"]), n, p=pools["p"]["dest_ip"])]
+    dest_ports = rng.choice(["53", "80", "443", "8080", "22", "3389"], n, p=[0.55, 0.1, 0.25, 0.04, 0.03, 0.03])
+    src_ports = rng.integers(1024, 65536, n).astype(str)
+
+    payload_kind = rng.integers(0, 3, n)
+    payloads = [
+        f"......{domain}....." if kind == 0 else
+        f"GET /api/v{kind}/{i % 1000} HTTP/1.1 Host: {domain} User-Agent: python-requests/2.{i % 32}" if kind == 1 else
+        ""
+        for i, (domain, kind) in enumerate(zip(domains, payload_kind))
+    ]
+    note_idx = rng.integers(0, len(_NOTE_TEMPLATES), n)
+    notes = [
+        _NOTE_TEMPLATES[k].format(count=(i * 7) % 300 + 1, unit=_UNITS[i % len(_UNITS)], domain=domain, src_ip=src_ip)
+        for i, (k, domain, src_ip) in enumerate(zip(note_idx, domains, src_ips))
+    ]
+    return pd.DataFrame({
+        "time": np.char.replace(times.astype(str), "T", " "),
+        "alert.signature": pools["signature"][sig_idx],
+        "src_ip": src_ips,
+        "src_port": src_ports,
+        "dest_ip": dest_ips,
+        "dest_port": dest_ports,
+        "domain": domains,
+        "payload": payloads,
+        "note": notes,
+    }, columns=SOC_COLUMNS).astype(object)
+
+
+def iter_alerts(n: int, chunk_rows: int = 200000, seed: int = 0) -> Iterator[pd.DataFrame]:
+    """分批產生共 n 筆長尾分布的假告警，記憶體只放一批；同樣的 n / seed 每次產生的資料都相同"""
+    for offset in range(0, n, chunk_rows):
+        yield generate_realistic_alerts(min(chunk_rows, n - offset), seed=seed + offset, offset=offset)
+
+
+def write_alerts_csv(path: str, n: int, chunk_rows: int = 200000, seed: int = 0):
+    """分批寫出 n 筆假告警的 CSV（與匯出檔相同格式），10M 筆也不會一次載入記憶體"""
+    for i, df in enumerate(iter_alerts(n, chunk_rows, seed)):
+        df.to_csv(path, index=False, mode="w" if i == 0 else "a", header=i == 0)
+
+
+def build_synthetic_db(db_file: str, n: int, generator: Callable[..., pd.DataFrame] = generate_alerts,
+                       table_name: str = TABLE_NAME, chunk_rows: int = 200000):
+    """
+    以 generator(筆數, seed=起始列號) 每 chunk_rows 筆產生一批假告警，寫進 xlsx_to_database 的 schema 並建立索引
+    全文索引不在這裡建，需要的 benchmark 自己呼叫 create_fts_index（才能單獨計時）
+    """
+    conn = sqlite3.connect(db_file)
+    for offset in range(0, n, chunk_rows):
+        df = prepare_dataframe(generator(min(chunk_rows, n - offset), seed=offset))
+        if offset == 0:
+            create_soc_table(conn, table_name, list(df.columns))
+        insert_dataframe(conn, table_name, df)
+    create_indexes(conn, table_name)
+    conn.commit()
+    conn.close()
@@ -0,0 +1 @@
+# data_ingestion：匯入 SQLite（xlsx_to_database）與 Chroma（ingest）的命令列工具
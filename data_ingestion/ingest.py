@@ -1,57 +1,150 @@
 import pandas as pd
 import argparse
+import json
 import os
+import time
 from chromadb import PersistentClient
-from embedding import load_embedding_model, embed_texts
-from utils import dataframe_to_texts
+from embedding import EMBED_BATCH_SIZE, EMBED_WORKERS, EmbeddingEngine, embedding_model_id
+from embedding_cache import get_embedding_cache
+from utils import (
+    READ_BATCH_SIZE, compute_row_ids, dataframe_to_metadatas, dataframe_to_texts, drop_unnamed_columns,
+    iter_record_batches, parse_event_times,
+)
 
 CHROMA_DIR = "data/chroma_db"
+COLLECTION_NAME = "alerts"
+# 記錄已入庫的最新告警時間（epoch 秒），增量匯入時比它舊的資料直接略過
+STATE_FILE = os.path.join(CHROMA_DIR, "ingest_state.json")
+# collection.get 每次查詢的 id 數量
+ID_BATCH_SIZE = 1000
+# 每次 embedding + upsert 的筆數，同時受 Chroma 的 max batch size 限制；
+# 一次只有一個 chunk 的 embedding 在記憶體裡
+INGEST_CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", "2000"))
 
 def get_chroma_client():
     os.makedirs(CHROMA_DIR, exist_ok=True)
     return PersistentClient(path=CHROMA_DIR)
 
 def read_file(filepath: str) -> pd.DataFrame:
-    if filepath.endswith(".csv"):
-        return pd.read_csv(filepath)
-    elif filepath.endswith(".xlsx"):
-        return pd.read_excel(filepath)
-    else:
-        raise ValueError("❌ 不支援的檔案格式，請提供 .csv 或 .xlsx 檔案")
+    # 全部以文字讀入，row id 才會與 xlsx_to_database 算出來的一致；大檔請用 iter_record_batches
+    return pd.concat(list(iter_record_batches(filepath)), ignore_index=True)
+
+def load_watermark(collection_name: str = COLLECTION_NAME):
+    if not os.path.exists(STATE_FILE):
+        return None
+    with open(STATE_FILE, encoding="utf-8") as f:
+        return json.load(f).get(collection_name, {}).get("time_watermark")
+
+def save_watermark(watermark: int, collection_name: str = COLLECTION_NAME):
+    state = {}
+    if os.path.exists(STATE_FILE):
+        with open(STATE_FILE, encoding="utf-8") as f:
+            state = json.load(f)
+    state.setdefault(collection_name, {})["time_watermark"] = int(watermark)
+    with open(STATE_FILE, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
 
-def ingest_to_chroma(filepath: str):
-    df = read_file(filepath)
-    texts = dataframe_to_texts(df)
-    embedding_model = load_embedding_model()
-    embeddings = embed_texts(embedding_model, texts)
+def existing_ids(collection, ids: list) -> set:
+    found = set()
+    for start in range(0, len(ids), ID_BATCH_SIZE):
+        found.update(collection.get(ids=ids[start:start + ID_BATCH_SIZE], include=[])["ids"])
+    return found
 
+def get_write_batch_size(client, chunk_size: int = INGEST_CHUNK_SIZE) -> int:
+    # 舊版 chromadb 只有 max_batch_size 屬性
+    if hasattr(client, "get_max_batch_size"):
+        max_batch = client.get_max_batch_size()
+    else:
+        max_batch = getattr(client, "max_batch_size", chunk_size)
+    return max(1, min(chunk_size, max_batch))
+
+def ingest_to_chroma(filepath: str, incremental: bool = False,
+                     chunk_size: int = INGEST_CHUNK_SIZE, embed_batch_size: int = EMBED_BATCH_SIZE,
+                     read_batch_size: int = READ_BATCH_SIZE, embed_workers: int = EMBED_WORKERS):
+    """
+    以內容 hash 當 id 寫入 Chroma（upsert），重複匯入同一份資料不會覆蓋其他資料
+    incremental=True 時：時間早於 watermark 的列直接略過，其餘只 embedding 尚未存在的 id
+    檔案逐批讀取（read_batch_size），每批再切成 chunk 做 embedding 與寫入，不會把整個檔案載入記憶體
+    embed_workers > 1 時 embedding 分給多個行程
+    """
     client = get_chroma_client()
-    collection = client.get_or_create_collection(name="alerts")
-
-    for i, (text, vector) in enumerate(zip(texts, embeddings)):
-        metadata = {
-            k: str(v).strip() if pd.notna(v) else "nan"
-            for k, v in df.iloc[i].to_dict().items()
-            if k != "time"
-        }
-
-        print(f"Index {i} metadata note: {metadata.get('note')}")
-        collection.add(
-            documents=[text],
-            # SentenceTransformer 這樣的 embedding 模型，產生出來的 vector可能是：numpy.ndarray
-            # 但Chroma 的 collection.add() 方法要求的是：純 Python list 格式的向量
-            embeddings=[vector.tolist()],
-            metadatas=[metadata],
-            ids=[f"doc_{i}"]
-        )
+    collection = client.get_or_create_collection(name=COLLECTION_NAME)
+    engine = EmbeddingEngine(workers=embed_workers, batch_size=embed_batch_size)
+    # 重新匯入時內容沒變的列直接用快取的向量
+    embedding_cache = get_embedding_cache()
+    write_size = get_write_batch_size(client, chunk_size)
+    watermark = load_watermark() if incremental else None
+    max_epoch = None
+    total = written = 0
+
+    start_time = time.perf_counter()
+    for batch in iter_record_batches(filepath, read_batch_size):
+        df = drop_unnamed_columns(batch)
+        df["row_id"] = compute_row_ids(df)
+        df = df.drop_duplicates(subset="row_id").reset_index(drop=True)
+        _, epochs = parse_event_times(df["time"]) if "time" in df.columns else (None, pd.Series([None] * len(df)))
+        total += len(df)
+
+        if incremental:
+            if watermark is not None:
+                # 沒有時間的列無法判斷，一律交給 id 比對
+                keep = epochs.map(lambda e: e is None or e >= watermark)
+                df, epochs = df[keep].reset_index(drop=True), epochs[keep].reset_index(drop=True)
+            known = existing_ids(collection, df["row_id"].tolist())
+            keep = ~df["row_id"].isin(known)
+            df, epochs = df[keep].reset_index(drop=True), epochs[keep].reset_index(drop=True)
+        if df.empty:
+            continue
+
+        known_epochs = [e for e in epochs if e is not None]
+        if known_epochs:
+            max_epoch = max(known_epochs + ([max_epoch] if max_epoch is not None else []))
+
+        source = df.drop(columns=["row_id"])
+        ids = df["row_id"].tolist()
+        for start in range(0, len(ids), write_size):
+            end = start + write_size
+            chunk = source.iloc[start:end]
+            texts = dataframe_to_texts(chunk)
+            embeddings = embedding_cache.encode(embedding_model_id(engine.backend), texts, engine.encode)
+            collection.upsert(
+                documents=texts,
+                # SentenceTransformer 這樣的 embedding 模型，產生出來的 vector可能是：numpy.ndarray
+                # 但Chroma 的 collection.upsert() 方法要求的是：純 Python list 格式的向量
+                embeddings=embeddings.tolist(),
+                metadatas=dataframe_to_metadatas(chunk),
+                ids=ids[start:end],
+            )
+            written += len(chunk)
+            elapsed = time.perf_counter() - start_time
+            print(f"⏳ 已讀取 {total} 筆，已匯入 {written} 筆（{written / elapsed:.1f} rows/s）")
+
+    engine.close()
 
     # ⚠️ 不再需要 persist()，因為 PersistentClient 會自動儲存
     # client.persist()
 
-    print(f"✅ 成功匯入 {len(df)} 筆資料到 Chroma（檔案: {filepath}）")
+    if max_epoch is not None:
+        previous = load_watermark()
+        save_watermark(max([max_epoch] + ([previous] if previous is not None else [])))
+
+    elapsed = time.perf_counter() - start_time
+    print(f"🗃️ embedding 快取：{embedding_cache.stats()}")
+    if incremental:
+        print(f"🔎 增量匯入：檔案 {total} 筆，watermark={watermark}，新增 {written} 筆")
+    print(f"✅ 成功匯入 {written} 筆資料到 Chroma（檔案: {filepath}，{elapsed:.1f} 秒，"
+          f"{written / elapsed if elapsed else 0:.1f} rows/s）")
+    return written
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--file", required=True, help="要匯入的 CSV 或 Excel 檔案路徑 (.csv or .xlsx)")
+    parser.add_argument("--incremental", action="store_true", help="只 embedding 尚未入庫的新資料")
+    parser.add_argument("--chunk-size", type=int, default=INGEST_CHUNK_SIZE, help="每次 embedding + 寫入的筆數")
+    parser.add_argument("--embed-batch-size", type=int, default=EMBED_BATCH_SIZE, help="model.encode 的 batch size")
+    parser.add_argument("--embed-workers", type=int, default=EMBED_WORKERS, help="embedding 的行程數")
+    parser.add_argument("--read-batch-size", type=int, default=READ_BATCH_SIZE, help="每次從檔案讀取的筆數")
     args = parser.parse_args()
-    ingest_to_chroma(args.file)
\ No newline at end of file
+    ingest_to_chroma(args.file, incremental=args.incremental, chunk_size=args.chunk_size,
+                     embed_batch_size=args.embed_batch_size, read_batch_size=args.read_batch_size,
+                     embed_workers=args.embed_workers)
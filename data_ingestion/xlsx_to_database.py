@@ -1,38 +1,261 @@
 import pandas as pd
+import argparse
 import sqlite3
 import os
+import sys
+
+# 直接執行 python3 data_ingestion/xlsx_to_database.py 時，專案根目錄不在 sys.path 上，utils 會找不到
+if __package__ in (None, ""):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import (  # noqa: E402
+    FTS_COLUMNS, READ_BATCH_SIZE, ROLLUP_DIMENSIONS, ROLLUP_GRANULARITIES, compute_row_ids, drop_unnamed_columns,
+    fts_table_name, ip_to_key, iter_record_batches, parse_event_times, rollup_table_name,
+)
 
 EXCEL_FILE = "data_0721.xlsx"           # 你的 Excel 檔案名稱
 DB_FILE = "SOC.db"                # 要建立的 SQLite 檔案
 TABLE_NAME = "SOC_data"                # 資料表名稱
 
-def create_sqlite_from_excel_all_text(excel_file: str, db_file: str, table_name: str):
-    # 讀取 Excel
-    df = pd.read_excel(excel_file, dtype=str)  # 強制所有欄位轉為文字
-    df.fillna("", inplace=True)                # 將空值補成空字串
+# 有型別的欄位，其餘欄位一律 TEXT
+# - port 用 INTEGER affinity：單一 port 會存成整數，"53671, 60158" 這種多個 port 的值仍保留為文字，
+#   用字串 '53' 查詢時 SQLite 會自動轉型，所以 query.py 的等值查詢不用改
+# - time 存成 ISO 格式（可直接排序），原始字串保留在 time_raw，time_epoch 為 epoch 秒
+# - *_ip_num 是 16 bytes 可排序的 IP（IPv4 映射到 ::ffff:0:0/96），給範圍 / CIDR 查詢用
+COLUMN_TYPES = {
+    "src_port": "INTEGER",
+    "dest_port": "INTEGER",
+    "time_epoch": "INTEGER",
+    "src_ip_num": "BLOB",
+    "dest_ip_num": "BLOB",
+}
 
-    # 刪除舊的資料庫（如果有）
-    if os.path.exists(db_file):
-        os.remove(db_file)
+# 單欄索引，以及 query.query_similar_records 的多欄位過濾用的複合索引
+INDEXES = {
+    "idx_soc_alert_signature": ["alert.signature"],
+    "idx_soc_src_ip": ["src_ip"],
+    "idx_soc_dest_ip": ["dest_ip"],
+    "idx_soc_src_port": ["src_port"],
+    "idx_soc_dest_port": ["dest_port"],
+    "idx_soc_domain": ["domain"],
+    "idx_soc_time": ["time"],
+    "idx_soc_time_epoch": ["time_epoch"],
+    "idx_soc_similar": ["src_ip", "dest_ip", "dest_port", "domain"],
+    "idx_soc_dest_similar": ["dest_ip", "dest_port", "domain"],
+    # query.query_by_cidr 的網段範圍查詢
+    "idx_soc_src_ip_num": ["src_ip_num"],
+    "idx_soc_dest_ip_num": ["dest_ip_num"],
+}
+
+INSERT_BATCH_SIZE = 10000
+
+# 彙總表的時間區間：time 已是 ISO 格式，取前 N 個字元再補齊
+ROLLUP_BUCKETS = {
+    "hourly": "substr(\"time\", 1, 13) || ':00:00'",
+    "daily": "substr(\"time\", 1, 10)",
+}
+
+
+def prepare_dataframe(df: pd.DataFrame) -> pd.DataFrame:
+    """丟掉 Excel 多出來的 Unnamed 欄位，補上內容 hash 的 row_id 與解析後的時間、port 與 IP 欄位"""
+    df = drop_unnamed_columns(df).fillna("")
+    # row_id 只依原始欄位計算，必須在加入衍生欄位之前
+    df.insert(0, "row_id", compute_row_ids(df))
+
+    if "time" in df.columns:
+        df["time_raw"] = df["time"]
+        iso, epoch = parse_event_times(df["time"])
+        df["time"] = iso.where(iso.notna(), df["time_raw"])
+        df["time_epoch"] = epoch
+    for col in ("src_port", "dest_port"):
+        if col in df.columns:
+            ports = df[col].astype(str).str.strip()
+            df[col] = ports.where(ports != "", None)
+    for col in ("src_ip", "dest_ip"):
+        if col in df.columns:
+            df[f"{col}_num"] = df[col].map(ip_to_key)
+    return df
+
+
+def create_soc_table(conn: sqlite3.Connection, table_name: str, columns: list):
+    """建立資料表；已存在時補上缺少的欄位。row_id 唯一索引讓重複的資料自動略過"""
+    column_defs = [f'"{col}" {COLUMN_TYPES.get(col, "TEXT")}' for col in columns]
+    conn.execute(f'CREATE TABLE IF NOT EXISTS "{table_name}" ({", ".join(column_defs)});')
+
+    existing = {row[1] for row in conn.execute(f'PRAGMA table_info("{table_name}")')}
+    for col in columns:
+        if col not in existing:
+            conn.execute(f'ALTER TABLE "{table_name}" ADD COLUMN "{col}" {COLUMN_TYPES.get(col, "TEXT")};')
+            if col == "row_id":
+                print(f"⚠️ `{table_name}` 是舊版資料表，既有資料沒有 row_id，無法與新資料去重，建議重新完整建立一次")
+    conn.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS "idx_soc_row_id" ON "{table_name}" ("row_id");')
 
-    # 連接 SQLite 並建立資料表
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
 
-    # 建立 CREATE TABLE 語句（全部欄位 TEXT）
-    columns = [f'"{col}" TEXT' for col in df.columns]
-    create_sql = f'CREATE TABLE "{table_name}" ({", ".join(columns)});'
-    cursor.execute(create_sql)
+def insert_dataframe(conn: sqlite3.Connection, table_name: str, df: pd.DataFrame) -> int:
+    """寫入資料，row_id 已存在的列會被略過，回傳實際新增筆數"""
+    column_names = ", ".join(f'"{col}"' for col in df.columns)
+    placeholders = ", ".join("?" for _ in df.columns)
+    insert_sql = f'INSERT OR IGNORE INTO "{table_name}" ({column_names}) VALUES ({placeholders});'
+    rows = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+    # 用 rowcount 而不是 total_changes：全文索引 trigger 寫入的筆數不能算進去
+    inserted = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= INSERT_BATCH_SIZE:
+            inserted += conn.executemany(insert_sql, batch).rowcount
+            batch = []
+    if batch:
+        inserted += conn.executemany(insert_sql, batch).rowcount
+    return inserted
 
-    # 插入資料
-    insert_sql = f'INSERT INTO "{table_name}" VALUES ({", ".join(["?" for _ in df.columns])});'
-    for row in df.itertuples(index=False):
-        cursor.execute(insert_sql, tuple(row))
 
+def create_indexes(conn: sqlite3.Connection, table_name: str):
+    existing = {row[1] for row in conn.execute(f'PRAGMA table_info("{table_name}")')}
+    for index_name, columns in INDEXES.items():
+        if not all(col in existing for col in columns):
+            continue
+        column_list = ", ".join(f'"{col}"' for col in columns)
+        conn.execute(f'CREATE INDEX IF NOT EXISTS "{index_name}" ON "{table_name}" ({column_list});')
+    # 更新統計資訊，讓 query planner 選對索引
+    conn.execute("ANALYZE;")
+
+
+def create_fts_index(conn: sqlite3.Connection, table_name: str, rebuild: bool = False):
+    """
+    payload / note / alert.signature 的 FTS5 全文索引（external content，不重複存一份文字）
+    第一次建立時從資料表整批重建索引，之後由 trigger 跟著 INSERT / UPDATE / DELETE 同步；
+    rebuild=True 強制重建（例如 VACUUM 之後 rowid 可能改變）
+    """
+    fts = fts_table_name(table_name)
+    existing = {row[1] for row in conn.execute(f'PRAGMA table_info("{table_name}")')}
+    columns = [col for col in FTS_COLUMNS if col in existing]
+    if not columns:
+        return
+    created = conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (fts,)).fetchone() is None
+    if created:
+        column_list = ", ".join(f'"{col}"' for col in columns)
+        new_values = ", ".join(f'new."{col}"' for col in columns)
+        old_values = ", ".join(f'old."{col}"' for col in columns)
+        conn.execute(f'CREATE VIRTUAL TABLE "{fts}" USING fts5({column_list}, '
+                     f"content='{table_name}', content_rowid='rowid', tokenize='trigram');")
+        conn.execute(f'CREATE TRIGGER "{fts}_ai" AFTER INSERT ON "{table_name}" BEGIN '
+                     f'INSERT INTO "{fts}"(rowid, {column_list}) VALUES (new.rowid, {new_values}); END;')
+        conn.execute(f'CREATE TRIGGER "{fts}_ad" AFTER DELETE ON "{table_name}" BEGIN '
+                     f'INSERT INTO "{fts}"("{fts}", rowid, {column_list}) VALUES (\'delete\', old.rowid, {old_values}); END;')
+        conn.execute(f'CREATE TRIGGER "{fts}_au" AFTER UPDATE ON "{table_name}" BEGIN '
+                     f'INSERT INTO "{fts}"("{fts}", rowid, {column_list}) VALUES (\'delete\', old.rowid, {old_values}); '
+                     f'INSERT INTO "{fts}"(rowid, {column_list}) VALUES (new.rowid, {new_values}); END;')
+    if created or rebuild:
+        conn.execute(f'INSERT INTO "{fts}"("{fts}") VALUES (\'rebuild\');')
+        conn.execute(f'INSERT INTO "{fts}"("{fts}") VALUES (\'optimize\');')
+
+
+def _ensure_rollup_table(conn: sqlite3.Connection, rollup: str) -> bool:
+    """建立彙總表，回傳是否為新建立"""
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (rollup,)).fetchone() is not None:
+        return False
+    conn.execute(f'''CREATE TABLE "{rollup}" (
+        dimension TEXT NOT NULL,
+        value TEXT NOT NULL,
+        bucket TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        first_seen TEXT NOT NULL,
+        last_seen TEXT NOT NULL,
+        PRIMARY KEY (dimension, bucket, value)
+    );''')
+    conn.execute(f'CREATE INDEX "idx_{rollup}_value" ON "{rollup}" (dimension, value);')
+    return True
+
+
+def update_rollups(conn: sqlite3.Connection, table_name: str, since_rowid: int = 0):
+    """
+    把 rowid > since_rowid 的新資料累加到每小時 / 每天的彙總表（事件數、首次與最後出現時間）
+    彙總表不存在時會建立，並從整張資料表重新計算；時間無法解析的列不列入
+    """
+    existing = {row[1] for row in conn.execute(f'PRAGMA table_info("{table_name}")')}
+    if "time_epoch" not in existing:
+        return
+    dimensions = [col for col in ROLLUP_DIMENSIONS if col in existing]
+    created = [_ensure_rollup_table(conn, rollup_table_name(table_name, g)) for g in ROLLUP_GRANULARITIES]
+    if any(created):
+        since_rowid = 0
+        for granularity in ROLLUP_GRANULARITIES:
+            conn.execute(f'DELETE FROM "{rollup_table_name(table_name, granularity)}";')
+
+    # 新資料的這幾欄先複製到暫存表，之後每個維度 / 粒度的 GROUP BY 都掃這張窄表，不用重複讀 payload、note 等大欄位
+    column_list = ", ".join(f'"{col}"' for col in ["time"] + dimensions)
+    conn.execute("DROP TABLE IF EXISTS temp.rollup_source;")
+    conn.execute(f'CREATE TEMP TABLE rollup_source AS SELECT {column_list} FROM "{table_name}" '
+                 f'WHERE rowid > ? AND time_epoch IS NOT NULL;', (since_rowid,))
+    for granularity in ROLLUP_GRANULARITIES:
+        rollup = rollup_table_name(table_name, granularity)
+        bucket = ROLLUP_BUCKETS[granularity]
+        for dimension in dimensions:
+            # GROUP BY 順序與主鍵相同，寫入時幾乎都是依序附加在 B-tree 尾端
+            # WHERE true 是 SQLite 的規定：INSERT ... SELECT 接 ON CONFLICT 時需要 WHERE 來消除語法歧義
+            conn.execute(f'''
+                INSERT INTO "{rollup}" (dimension, bucket, value, count, first_seen, last_seen)
+                SELECT ?, {bucket}, "{dimension}", COUNT(*), MIN("time"), MAX("time")
+                FROM temp.rollup_source
+                WHERE true AND "{dimension}" IS NOT NULL AND "{dimension}" != ''
+                GROUP BY 2, 3
+                ON CONFLICT (dimension, bucket, value) DO UPDATE SET
+                    count = count + excluded.count,
+                    first_seen = min(first_seen, excluded.first_seen),
+                    last_seen = max(last_seen, excluded.last_seen);
+            ''', (dimension,))
+    conn.execute("DROP TABLE temp.rollup_source;")
+
+
+def create_sqlite_from_excel(excel_file: str, db_file: str, table_name: str, incremental: bool = False,
+                             batch_size: int = READ_BATCH_SIZE, rebuild_fts: bool = False):
+    """
+    incremental=False：刪掉舊資料庫後完整重建
+    incremental=True：保留既有資料，只新增 row_id 還不存在的列
+    檔案（.xlsx 或 .csv）逐批讀取、逐批寫入，記憶體用量只跟 batch_size 有關
+    """
+    # 刪除舊的資料庫（如果有）
+    if not incremental and os.path.exists(db_file):
+        os.remove(db_file)
+
+    # 連接 SQLite 並建立資料表、寫入資料，最後才建索引（比邊寫邊維護索引快）
+    # 全文索引也一樣：完整重建時最後整批建立；增量匯入時已有的全文索引由 trigger 同步
+    conn = sqlite3.connect(db_file)
+    total = inserted = 0
+    table_ready = False
+    # 本次新增的列 rowid 都比這個大，彙總表只累加這些列
+    has_table = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                             (table_name,)).fetchone()
+    last_rowid = conn.execute(f'SELECT COALESCE(MAX(rowid), 0) FROM "{table_name}"').fetchone()[0] if has_table else 0
+    # 先全部以文字讀入，再由 prepare_dataframe 轉型
+    for batch in iter_record_batches(excel_file, batch_size):
+        df = prepare_dataframe(batch)
+        if not table_ready:
+            create_soc_table(conn, table_name, list(df.columns))
+            table_ready = True
+        total += len(df)
+        inserted += insert_dataframe(conn, table_name, df)
+    if table_ready:
+        create_indexes(conn, table_name)
+        create_fts_index(conn, table_name, rebuild=rebuild_fts)
+        update_rollups(conn, table_name, since_rowid=last_rowid)
     conn.commit()
     conn.close()
 
-    print(f"✅ 成功將 `{excel_file}` 寫入 `{db_file}`，表格 `{table_name}`，所有欄位皆為 TEXT")
+    mode = "增量" if incremental else "完整重建"
+    print(f"✅ {mode}：`{excel_file}` 共 {total} 筆，新增 {inserted} 筆到 `{db_file}` 表格 `{table_name}`，"
+          f"略過 {total - inserted} 筆重複資料")
+    return inserted
 
 if __name__ == "__main__":
-    create_sqlite_from_excel_all_text(EXCEL_FILE, DB_FILE, TABLE_NAME)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--file", default=EXCEL_FILE, help="要匯入的 Excel 或 CSV 檔案")
+    parser.add_argument("--db", default=DB_FILE, help="SQLite 檔案")
+    parser.add_argument("--table", default=TABLE_NAME, help="資料表名稱")
+    parser.add_argument("--incremental", action="store_true", help="保留既有資料，只新增尚未入庫的列")
+    parser.add_argument("--batch-size", type=int, default=READ_BATCH_SIZE, help="每批讀取與寫入的筆數")
+    parser.add_argument("--rebuild-fts", action="store_true", help="重建全文索引")
+    args = parser.parse_args()
+    create_sqlite_from_excel(args.file, args.db, args.table, incremental=args.incremental, batch_size=args.batch_size,
+                             rebuild_fts=args.rebuild_fts)
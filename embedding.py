@@ -1,19 +1,148 @@
 # embedding.py
 
+import atexit
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 from sentence_transformers import SentenceTransformer
 
 # ✅ 改成更強的多語言嵌入模型
 MODEL_NAME = "all-mpnet-base-v2"
 
-_embedding_model = None
+# model.encode 每次送進模型的句數
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+
+# ==== 推論後端 ====
+# - torch : PyTorch fp32（原本的做法）
+# - onnx  : ONNX Runtime，需要 pip install "optimum[onnxruntime]"；EMBED_ONNX_FILE 可指定模型 repo 裡
+#           其他 ONNX 檔（例如已量化的 onnx/model_qint8_avx2.onnx）
+# - int8  : PyTorch 動態量化，Linear 層權重改成 int8，記憶體較小，不需要額外套件
+# 向量會有些微差異，換後端前先跑 benchmarks/check_embedding_backends.py 確認相似度
+EMBED_BACKENDS = ("torch", "onnx", "int8")
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch")
+EMBED_ONNX_FILE = os.getenv("EMBED_ONNX_FILE", "")
+
+_embedding_models = {}
+
+def _build_model(backend: str):
+    if backend == "onnx":
+        model_kwargs = {"file_name": EMBED_ONNX_FILE} if EMBED_ONNX_FILE else None
+        return SentenceTransformer(MODEL_NAME, backend="onnx", model_kwargs=model_kwargs)
+    model = SentenceTransformer(MODEL_NAME)
+    if backend == "int8":
+        import torch
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+def load_embedding_model(backend: str = None):
+    backend = backend or EMBED_BACKEND
+    if backend not in EMBED_BACKENDS:
+        raise ValueError(f"不支援的 EMBED_BACKEND：{backend}，可用 {', '.join(EMBED_BACKENDS)}")
+    if backend not in _embedding_models:
+        print(f"=== 載入嵌入模型：{MODEL_NAME}（{backend}）====")
+        _embedding_models[backend] = _build_model(backend)
+    return _embedding_models[backend]
+
+def embedding_model_id(backend: str = None) -> str:
+    """embedding 快取用的模型識別；不同後端的向量略有差異，不能共用快取"""
+    backend = backend or EMBED_BACKEND
+    return MODEL_NAME if backend == "torch" else f"{MODEL_NAME}:{backend}"
+
+def embed_texts(model, texts, batch_size: int = EMBED_BATCH_SIZE):
+    return model.encode(texts, batch_size=batch_size, convert_to_tensor=False, show_progress_bar=False)
+
+
+
+# ==== 多行程 embedding ====
+# ingest 主機只有 CPU、核心很多，單一行程的 encode 吃不滿：
+# - 每個 worker 行程各自載入一份模型，並限制自己的執行緒數，避免互搶核心
+# - 先依文字長度排序再切片，同一片的長度相近、padding 最少，最後再還原成原本的順序
+# - 筆數太少時直接在本行程 encode，省掉行程間傳資料的成本
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "1"))
+# 每個 worker 的執行緒數，0 表示 CPU 核心數平均分給所有 worker
+EMBED_THREADS_PER_WORKER = int(os.getenv("EMBED_THREADS_PER_WORKER", "0"))
+# 少於這個筆數不分給 worker
+EMBED_MIN_PARALLEL = int(os.getenv("EMBED_MIN_PARALLEL", "256"))
+
+
+def _init_worker(threads: int, backend: str):
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    import torch
+    torch.set_num_threads(threads)
+    load_embedding_model(backend)
+
+
+def _encode_shard(texts, batch_size: int, backend: str):
+    return np.asarray(embed_texts(load_embedding_model(backend), texts, batch_size=batch_size), dtype=np.float32)
+
+
+class EmbeddingEngine:
+    def __init__(self, workers: int = EMBED_WORKERS, batch_size: int = EMBED_BATCH_SIZE,
+                 threads_per_worker: int = EMBED_THREADS_PER_WORKER, min_parallel: int = EMBED_MIN_PARALLEL,
+                 model=None, backend: str = None):
+        # 指定 model 時只能在本行程 encode（worker 只會載入 MODEL_NAME）
+        self.workers = 1 if model is not None else max(1, workers)
+        self.backend = backend or EMBED_BACKEND
+        self.batch_size = batch_size
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // self.workers)
+        self.min_parallel = min_parallel
+        self.model = model
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # 用 spawn：fork 會把父行程已初始化的 torch 執行緒池一起帶過去
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.threads_per_worker, self.backend),
+                )
+            return self._pool
+
+    def encode(self, texts) -> np.ndarray:
+        """回傳 float32 矩陣，列順序與 texts 相同"""
+        texts = list(texts)
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        order = np.argsort([len(text) for text in texts], kind="stable")
+        sorted_texts = [texts[i] for i in order]
+
+        if self.workers == 1 or len(texts) < self.min_parallel:
+            model = self.model or load_embedding_model(self.backend)
+            vectors = np.asarray(embed_texts(model, sorted_texts, batch_size=self.batch_size), dtype=np.float32)
+        else:
+            # 每個 worker 分到幾片，讓長短文字都能平均分散
+            shard_size = max(self.batch_size, -(-len(texts) // (self.workers * 4)))
+            shards = [sorted_texts[i:i + shard_size] for i in range(0, len(sorted_texts), shard_size)]
+            pool = self._get_pool()
+            vectors = np.concatenate(list(pool.map(
+                _encode_shard, shards, [self.batch_size] * len(shards), [self.backend] * len(shards)
+            )))
+
+        result = np.empty_like(vectors)
+        result[order] = vectors
+        return result
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
 
-def load_embedding_model():
-    global _embedding_model
-    if _embedding_model is None:
-        print(f"=== 載入嵌入模型：{MODEL_NAME} ====")
-        _embedding_model = SentenceTransformer(MODEL_NAME)
-    return _embedding_model
+_engine = None
 
-def embed_texts(model, texts):
-    return model.encode(texts, convert_to_tensor=False, show_progress_bar=False)
 
+def get_embedding_engine() -> EmbeddingEngine:
+    global _engine
+    if _engine is None:
+        _engine = EmbeddingEngine()
+        atexit.register(_engine.close)
+    return _engine
@@ -0,0 +1,226 @@
+# embedding_cache.py
+# embedding 向量的本機快取：以 (模型名稱, sha256(文字)) 當 key，向量以 float32 / float16 bytes 存在 SQLite
+# - 上面再加一層行程內 LRU，重複的聊天問題不用查檔
+# - key 含模型名稱（與推論後端），換 MODEL_NAME 後舊模型的向量不會被拿出來用
+# - 超過筆數或容量上限時依最後存取時間（LRU）淘汰；設定 EMBED_CACHE_DISABLED=1 可整個略過快取
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, List, Optional
+
+import numpy as np
+
+from tracing import record_cache
+
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "data/embedding_cache.sqlite3")
+EMBED_CACHE_DTYPE = os.getenv("EMBED_CACHE_DTYPE", "float32")          # float32 或 float16（省一半空間）
+EMBED_CACHE_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "2000000"))
+# 1024 維 float32 一筆約 4KB，預設 1GB 大約 25 萬筆；筆數與容量任一個超過就淘汰
+EMBED_CACHE_MAX_BYTES = int(os.getenv("EMBED_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+EMBED_CACHE_MEMORY_ENTRIES = int(os.getenv("EMBED_CACHE_MEMORY_ENTRIES", "10000"))
+EMBED_CACHE_DISABLED = os.getenv("EMBED_CACHE_DISABLED", "0") == "1"
+
+# 每寫入幾筆檢查一次筆數與容量上限
+_EVICT_EVERY = 5000
+# SQLite 單一查詢的參數數量有上限，IN 查詢要分批
+_LOOKUP_CHUNK = 500
+# LRU 只需要粗略的存取時間：last_access 超過這麼多秒才更新，命中時大多不用寫入、不用搶寫入鎖
+_TOUCH_INTERVAL = 60
+
+
+def text_key(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, path: str = EMBED_CACHE_PATH, dtype: str = EMBED_CACHE_DTYPE,
+                 max_entries: int = EMBED_CACHE_MAX_ENTRIES, max_bytes: int = EMBED_CACHE_MAX_BYTES,
+                 memory_entries: int = EMBED_CACHE_MEMORY_ENTRIES,
+                 enabled: bool = not EMBED_CACHE_DISABLED):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.memory_entries = memory_entries
+        self.enabled = enabled
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._writes = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        # 延後到第一次使用才開檔；Streamlit 會跨 thread 使用，所以關掉 check_same_thread 並自己加鎖
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS embedding_cache (
+                    model TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    dtype TEXT NOT NULL,
+                    dim INTEGER NOT NULL,
+                    vector BLOB NOT NULL,
+                    last_access REAL NOT NULL,
+                    PRIMARY KEY (model, key)
+                )
+            """)
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_embedding_cache_last_access ON embedding_cache(last_access)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def _remember(self, memory_key: tuple, vector: np.ndarray):
+        self._memory[memory_key] = vector
+        self._memory.move_to_end(memory_key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get_many(self, model: str, keys: List[str]) -> List[Optional[np.ndarray]]:
+        """依序回傳每個 key 的 float32 向量，沒有的為 None"""
+        results = [None] * len(keys)
+        with self._lock:
+            pending = {}
+            for i, key in enumerate(keys):
+                vector = self._memory.get((model, key))
+                if vector is not None:
+                    self._memory.move_to_end((model, key))
+                    results[i] = vector
+                    self.memory_hits += 1
+                else:
+                    pending.setdefault(key, []).append(i)
+
+            if pending:
+                conn = self._connect()
+                found = []
+                pending_keys = list(pending)
+                for start in range(0, len(pending_keys), _LOOKUP_CHUNK):
+                    chunk = pending_keys[start:start + _LOOKUP_CHUNK]
+                    found.extend(conn.execute(
+                        f"SELECT key, dtype, vector, last_access FROM embedding_cache WHERE model = ? "
+                        f"AND key IN ({', '.join('?' for _ in chunk)})",
+                        [model, *chunk],
+                    ).fetchall())
+                now = time.time()
+                stale = []
+                for key, dtype, blob, last_access in found:
+                    vector = np.frombuffer(blob, dtype=dtype).astype(np.float32)
+                    self._remember((model, key), vector)
+                    for i in pending.pop(key):
+                        results[i] = vector
+                        self.disk_hits += 1
+                    if now - last_access > _TOUCH_INTERVAL:
+                        stale.append((now, model, key))
+                if stale:
+                    conn.executemany("UPDATE embedding_cache SET last_access = ? WHERE model = ? AND key = ?", stale)
+                    conn.commit()
+                self.misses += sum(len(indexes) for indexes in pending.values())
+        return results
+
+    def set_many(self, model: str, keys: List[str], vectors: np.ndarray):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            conn = self._connect()
+            now = time.time()
+            conn.executemany(
+                "INSERT OR REPLACE INTO embedding_cache (model, key, dtype, dim, vector, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(model, key, self.dtype.name, len(vector), vector.astype(self.dtype).tobytes(), now)
+                 for key, vector in zip(keys, vectors)],
+            )
+            conn.commit()
+            for key, vector in zip(keys, vectors):
+                self._remember((model, key), vector)
+            self._writes += len(keys)
+            if self._writes >= _EVICT_EVERY:
+                self._writes = 0
+                self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection):
+        count, total = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM embedding_cache"
+        ).fetchone()
+        if count > self.max_entries or total > self.max_bytes:
+            # 由新到舊累計筆數與容量，超過任一個上限之後的（較舊的）全部刪掉
+            cur = conn.execute(
+                "DELETE FROM embedding_cache WHERE rowid IN ("
+                "SELECT rowid FROM ("
+                "SELECT rowid, ROW_NUMBER() OVER w AS kept, SUM(LENGTH(vector)) OVER w AS kept_bytes "
+                "FROM embedding_cache WINDOW w AS (ORDER BY last_access DESC, rowid DESC)"
+                ") WHERE kept > ? OR kept_bytes > ?)",
+                (self.max_entries, self.max_bytes),
+            )
+            self.evictions += cur.rowcount
+            conn.commit()
+
+    def encode(self, model: str, texts: List[str], encode_fn: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """只把快取裡沒有的文字交給 encode_fn，回傳與 texts 同順序的 float32 矩陣"""
+        texts = list(texts)
+        if not self.enabled:
+            return np.asarray(encode_fn(texts), dtype=np.float32)
+        keys = [text_key(text) for text in texts]
+        cached = self.get_many(model, keys)
+        misses = sum(vector is None for vector in cached)
+        record_cache("embedding", True, len(cached) - misses)
+        record_cache("embedding", False, misses)
+
+        missing = {}
+        for text, key, vector in zip(texts, keys, cached):
+            if vector is None and key not in missing:
+                missing[key] = text
+        if missing:
+            new_vectors = np.asarray(encode_fn(list(missing.values())), dtype=np.float32)
+            self.set_many(model, list(missing), new_vectors)
+            by_key = dict(zip(missing, new_vectors))
+            cached = [vector if vector is not None else by_key[key] for key, vector in zip(keys, cached)]
+        if not cached:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.vstack(cached)
+
+    def clear(self):
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM embedding_cache")
+            conn.commit()
+            self._memory.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            count, total = self._connect().execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM embedding_cache"
+            ).fetchone()
+            memory_bytes = sum(vector.nbytes for vector in self._memory.values())
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": count,
+            "bytes": total,
+            "memory_entries": len(self._memory),
+            "memory_bytes": memory_bytes,
+        }
+
+
+_embedding_cache = None
+
+def get_embedding_cache() -> EmbeddingCache:
+    global _embedding_cache
+    if _embedding_cache is None:
+        _embedding_cache = EmbeddingCache()
+    return _embedding_cache
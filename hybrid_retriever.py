@@ -0,0 +1,185 @@
+# hybrid_retriever.py
+# 產生筆記用的相似事件檢索：SQL 精確比對與 Chroma 向量搜尋同時進行，合併後依加權分數排序
+# - SQL：與 query.query_similar_records 相同，src_ip / dest_ip / dest_port / domain 全部相等，所有列批次查詢
+# - 向量：上傳的每一列轉成文字，一次 embedding、一次 collection.query 查完所有列；
+#   同一組查詢向量也用來補算只有 SQL 找到的候選的 cosine
+# - 分數 = HYBRID_FIELD_WEIGHT × 欄位相符比例 + HYBRID_COSINE_WEIGHT × cosine similarity
+# 新的 IP 在 SQL 查不到時，仍可以靠向量找到告警名稱、網域相近的歷史事件
+
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from query import query_similar_records_bulk
+from utils import dataframe_to_texts, row_to_text
+
+HYBRID_FIELDS = ["src_ip", "dest_ip", "dest_port", "domain"]
+HYBRID_FIELD_WEIGHT = float(os.getenv("HYBRID_FIELD_WEIGHT", "0.6"))
+HYBRID_COSINE_WEIGHT = float(os.getenv("HYBRID_COSINE_WEIGHT", "0.4"))
+# 每列各取幾筆候選再合併
+HYBRID_SQL_K = int(os.getenv("HYBRID_SQL_K", "10"))
+HYBRID_ANN_K = int(os.getenv("HYBRID_ANN_K", "10"))
+ALERTS_COLLECTION = "alerts"
+
+# xlsx_to_database 加上的衍生欄位，不算在事件內容裡
+_DERIVED_COLUMNS = {"row_id", "time_raw", "time_epoch", "src_ip_num", "dest_ip_num"}
+# 上傳檔的 note 是空的（正要產生），不放進查詢文字
+_QUERY_EXCLUDED_COLUMNS = {"note", "row_id"}
+# 上傳檔以文字讀入，空值會變成 "nan"（舊的讀法是 "None"），比對與組查詢文字時都當成空白
+_BLANK_TEXTS = {"nan", "none"}
+
+_collection = None
+# 開啟失敗也記住，之後不再重試、不再重複印警告（匯入資料後需重新啟動）
+_collection_failed = False
+
+
+def get_alerts_collection():
+    """ingest.py 建立的 alerts collection；沒有安裝 chromadb 或還沒匯入時回傳 None"""
+    global _collection, _collection_failed
+    if _collection is None and not _collection_failed:
+        try:
+            from utils import get_chroma_client
+            _collection = get_chroma_client().get_collection(name=ALERTS_COLLECTION)
+        except Exception as e:
+            print(f"⚠️ 無法開啟 Chroma collection `{ALERTS_COLLECTION}`，只使用 SQL 比對：{e}")
+            _collection_failed = True
+    return _collection
+
+
+def _get_embedding():
+    from rag_model.rag_core import get_embedding
+    return get_embedding()
+
+
+def _clean(value) -> str:
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return ""
+    text = str(value).strip()
+    return "" if text.lower() in _BLANK_TEXTS else text
+
+
+def field_match_score(row: pd.Series, record: dict) -> float:
+    """row 有值的比對欄位中，record 相同的比例"""
+    fields = [field for field in HYBRID_FIELDS if _clean(row.get(field))]
+    if not fields:
+        return 0.0
+    return sum(_clean(row.get(field)) == _clean(record.get(field)) for field in fields) / len(fields)
+
+
+def record_key(record: dict) -> str:
+    """SQL 與 Chroma 的記錄都用 row_id（內容 hash）對應；舊資料庫沒有 row_id 時以欄位內容代替"""
+    if record.get("row_id"):
+        return record["row_id"]
+    raw = "\x1f".join(f"{k}={_clean(record.get(k))}" for k in HYBRID_FIELDS + ["alert.signature", "note"])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+
+def record_text(record: dict) -> str:
+    """與 ingest.py 存進 Chroma 的文件格式相同"""
+    return row_to_text(pd.Series({k: v for k, v in record.items()
+                                  if k not in _DERIVED_COLUMNS and not isinstance(v, bytes)}))
+
+
+def query_texts(df: pd.DataFrame) -> List[str]:
+    """與 Chroma 文件相同的格式：空值先換回 NaN，才會輸出成 payload: 而不是 payload: nan"""
+    values = df.drop(columns=[col for col in df.columns if col in _QUERY_EXCLUDED_COLUMNS])
+    for col in values.columns:
+        if values[col].dtype == "object":
+            values[col] = values[col].mask(values[col].astype(str).str.strip().str.lower().isin(_BLANK_TEXTS))
+    return dataframe_to_texts(values)
+
+
+def sql_candidates(df: pd.DataFrame, k: int = HYBRID_SQL_K) -> List[List[dict]]:
+    return query_similar_records_bulk(df, top_k=k)
+
+
+def _ann_search(texts: List[str], k: int) -> Tuple[List[List[tuple]], Optional[np.ndarray]]:
+    """ann_candidates 的本體，另外回傳正規化後的查詢向量（沒有 collection 時為 None）"""
+    collection = get_alerts_collection()
+    if collection is None or not texts:
+        return [[] for _ in texts], None
+    vectors = np.asarray(_get_embedding().embed_documents(texts), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    result = collection.query(query_embeddings=vectors.tolist(), n_results=k, include=["metadatas", "distances"])
+    candidates = []
+    for ids, metadatas, distances in zip(result["ids"], result["metadatas"], result["distances"]):
+        # 模型輸出已正規化，Chroma 預設的 squared L2 距離 d = 2 - 2cos
+        candidates.append([
+            ({**metadata, "row_id": row_id}, 1 - distance / 2)
+            for row_id, metadata, distance in zip(ids, metadatas, distances)
+        ])
+    return candidates, vectors
+
+
+def ann_candidates(texts: List[str], k: int = HYBRID_ANN_K) -> List[List[tuple]]:
+    """所有查詢文字一次 embedding、一次 collection.query，回傳每列的 [(記錄, cosine), ...]"""
+    return _ann_search(texts, k)[0]
+
+
+def _cosine_for_records(query_vectors: np.ndarray, pending: list) -> dict:
+    """只有 SQL 找到的候選沒有 cosine，批次補算；pending 為 [(列號, key, 記錄)]"""
+    if not pending:
+        return {}
+    vectors = np.asarray(_get_embedding().embed_documents([record_text(r) for _, _, r in pending]), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return {
+        (i, key): float(vectors[j] @ query_vectors[i])
+        for j, (i, key, _) in enumerate(pending)
+    }
+
+
+def hybrid_similar_records(df: pd.DataFrame, top_k: int = 3, sql_k: int = HYBRID_SQL_K,
+                           ann_k: int = HYBRID_ANN_K) -> List[List[dict]]:
+    """
+    對 df 的每一列回傳依分數排序的前 top_k 筆相似事件
+    每筆記錄多了 _score / _field_score / _cosine / _source（sql、ann 或 sql+ann）
+    """
+    df = df.reset_index(drop=True)
+    texts = query_texts(df)
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        sql_future = pool.submit(sql_candidates, df, sql_k)
+        ann_future = pool.submit(_ann_search, texts, ann_k)
+        sql_results, (ann_results, query_vectors) = sql_future.result(), ann_future.result()
+
+    merged = []
+    for i, row in df.iterrows():
+        candidates = {}
+        for record, cosine in ann_results[i]:
+            candidates[record_key(record)] = {"record": record, "cosine": cosine, "sources": {"ann"}}
+        for record in sql_results[i]:
+            key = record_key(record)
+            if key in candidates:
+                # SQL 的記錄欄位比較完整（含 time），以它為主
+                candidates[key]["record"] = record
+                candidates[key]["sources"].add("sql")
+            else:
+                candidates[key] = {"record": record, "cosine": None, "sources": {"sql"}}
+        merged.append(candidates)
+
+    # 只有 SQL 找到的候選，用同一個模型補算 cosine
+    pending = [(i, key, c["record"]) for i, candidates in enumerate(merged)
+               for key, c in candidates.items() if c["cosine"] is None]
+    if pending and query_vectors is not None:
+        for (i, key), cosine in _cosine_for_records(query_vectors, pending).items():
+            merged[i][key]["cosine"] = cosine
+
+    results = []
+    for i, row in df.iterrows():
+        scored = []
+        for c in merged[i].values():
+            field_score = field_match_score(row, c["record"])
+            cosine = c["cosine"] if c["cosine"] is not None else 0.0
+            scored.append({
+                **c["record"],
+                "_score": HYBRID_FIELD_WEIGHT * field_score + HYBRID_COSINE_WEIGHT * cosine,
+                "_field_score": field_score,
+                "_cosine": c["cosine"],
+                "_source": "+".join(sorted(c["sources"], reverse=True)),
+            })
+        scored.sort(key=lambda r: -r["_score"])
+        results.append(scored[:top_k])
+    return results
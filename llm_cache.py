@@ -0,0 +1,159 @@
+# llm_cache.py
+# LLM 回覆的本機快取：以 hash(model, messages, temperature, max_tokens) 當 key，存在 SQLite
+# - TTL 過期自動失效，超過筆數或容量上限時依最後存取時間（LRU）淘汰
+# - temperature <= 0.1 的 prompt 預設快取，其餘要呼叫端明確 opt-in（cache=True）或設定 LLM_CACHE_ALL=1
+# - 設定 LLM_CACHE_DISABLED=1 可整個略過快取
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "data/llm_cache.sqlite3")
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))       # 秒
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "20000"))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+LLM_CACHE_DISABLED = os.getenv("LLM_CACHE_DISABLED", "0") == "1"
+LLM_CACHE_ALL = os.getenv("LLM_CACHE_ALL", "0") == "1"
+
+# temperature 小於等於這個值視為決定性的 prompt，預設快取
+DETERMINISTIC_TEMPERATURE = 0.1
+# 每寫入幾筆檢查一次容量上限，避免每次寫入都掃整張表
+_EVICT_EVERY = 50
+# LRU 只需要粗略的存取時間：last_access 超過這麼多秒才更新，命中時大多不用寫入、不用搶寫入鎖
+_TOUCH_INTERVAL = 60
+
+
+class LLMCache:
+    def __init__(self, path: str = LLM_CACHE_PATH, ttl: float = LLM_CACHE_TTL,
+                 max_entries: int = LLM_CACHE_MAX_ENTRIES, max_bytes: int = LLM_CACHE_MAX_BYTES,
+                 enabled: bool = not LLM_CACHE_DISABLED):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        # 延後到第一次使用才開檔；Streamlit 與 thread pool 會跨 thread 使用，所以關掉 check_same_thread 並自己加鎖
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache(last_access)")
+            self._conn.commit()
+        return self._conn
+
+    @staticmethod
+    def make_key(model: str, messages: list, temperature: float, max_tokens: Optional[int]) -> str:
+        raw = json.dumps(
+            {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens},
+            ensure_ascii=False, sort_keys=True,
+        )
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT value, created_at, last_access FROM llm_cache WHERE key = ?",
+                               (key,)).fetchone()
+            now = time.time()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                    conn.commit()
+                self.misses += 1
+                return None
+            if now - row[2] > _TOUCH_INTERVAL:
+                conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+                conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def set(self, key: str, value: str):
+        with self._lock:
+            conn = self._connect()
+            now = time.time()
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value.encode("utf-8")), now, now),
+            )
+            conn.commit()
+            self._writes += 1
+            if self._writes % _EVICT_EVERY == 0:
+                self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection):
+        # 先清過期的，再依 last_access 由舊到新刪到筆數與容量都在上限內
+        cur = conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.ttl,))
+        self.evictions += cur.rowcount
+        count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+        if count > self.max_entries or total > self.max_bytes:
+            removed = 0
+            for key, size in conn.execute("SELECT key, size FROM llm_cache ORDER BY last_access").fetchall():
+                if count - removed <= self.max_entries and total <= self.max_bytes:
+                    break
+                conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                removed += 1
+                total -= size
+            self.evictions += removed
+        conn.commit()
+
+    def clear(self):
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM llm_cache")
+            conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            count, total = self._connect().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": count,
+            "bytes": total,
+        }
+
+
+_llm_cache = None
+
+def get_llm_cache() -> LLMCache:
+    global _llm_cache
+    if _llm_cache is None:
+        _llm_cache = LLMCache()
+    return _llm_cache
+
+
+def should_cache(temperature: float, cache: Optional[bool] = None) -> bool:
+    """cache=None 時依 temperature 自動判斷；True/False 則由呼叫端強制決定"""
+    if cache is not None:
+        return cache
+    return LLM_CACHE_ALL or temperature <= DETERMINISTIC_TEMPERATURE
+
@@ -0,0 +1,297 @@
+# llm_gateway.py
+# 所有 LLM 呼叫的統一出口：
+# - 共用一個有連線池的 httpx client（OpenAI SDK 本身的重試關掉，由這裡統一處理）
+# - requests/min 與 tokens/min 兩個 token bucket 限流
+# - 遇到 429 / 5xx / 連線錯誤時指數退避重試（有 Retry-After 就照它）
+# - 相同 prompt 同時在途時只送一次，其餘呼叫等同一個結果（request coalescing）
+# - 搭配 llm_cache 的本機快取
+# - 每次呼叫記成 tracing 的 "llm" span（模型、token 數、費用、是否命中快取）
+# 設定全部來自環境變數，見 README「效能相關設定」
+
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Iterable, Iterator, Optional
+
+import httpx
+import openai
+from openai import OpenAI
+
+from llm_cache import LLMCache, get_llm_cache, should_cache
+from tracing import annotate, current_span, metrics, record_cache, record_llm_call, span
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "KEY")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o")
+# 多筆事件比較原本就用 gpt-4，保留可以獨立設定
+LLM_COMPARISON_MODEL = os.getenv("LLM_COMPARISON_MODEL", "gpt-4")
+LLM_RPM = int(os.getenv("LLM_RPM", "500"))            # 0 表示不限制
+LLM_TPM = int(os.getenv("LLM_TPM", "300000"))         # 0 表示不限制
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "5"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "1.0"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "30"))
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "20"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+# 串流時請伺服器在最後一個 chunk 附上 token 用量（stream_options.include_usage），不支援的地端服務可設 0
+LLM_STREAM_USAGE = os.getenv("LLM_STREAM_USAGE", "1") == "1"
+
+# 這些錯誤值得重試：429、5xx、連線中斷與逾時
+_RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.InternalServerError,
+    openai.APIConnectionError,   # APITimeoutError 是它的子類別
+)
+
+
+class TokenBucket:
+    """每分鐘補充 rate_per_min 個額度的 token bucket，acquire 額度不足時阻塞等待"""
+
+    def __init__(self, rate_per_min: float, capacity: Optional[float] = None):
+        self.rate = rate_per_min / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_min
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount: float = 1.0):
+        # 單次需求超過容量時只要求滿桶，避免永遠等不到
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def adjust(self, delta: float):
+        """用實際用量修正預估值，delta 為正代表多用了（可以欠額度）"""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens - delta)
+
+
+def _estimate_tokens(messages: list, max_tokens: Optional[int]) -> int:
+    # 中英混合大約 2 個字元 1 個 token，只用來限流，不需要精準
+    chars = 0
+    for message in messages:
+        content = message.get("content", "")
+        if isinstance(content, list):
+            content = "".join(part.get("text", "") for part in content if isinstance(part, dict))
+        chars += len(content or "")
+    return chars // 2 + (max_tokens or 0)
+
+
+def _usage_tokens(usage, messages: list, content: str):
+    """回傳 (prompt_tokens, completion_tokens, 是否為估計值)；伺服器沒回 usage 時用字元數估計"""
+    if usage is not None and usage.total_tokens:
+        return usage.prompt_tokens or 0, usage.completion_tokens or 0, False
+    return _estimate_tokens(messages, None), len(content) // 2, True
+
+
+class LLMGateway:
+    def __init__(self, api_key: str = OPENAI_API_KEY, base_url: Optional[str] = OPENAI_BASE_URL,
+                 model: str = LLM_MODEL, rpm: int = LLM_RPM, tpm: int = LLM_TPM,
+                 max_retries: int = LLM_MAX_RETRIES, backoff_base: float = LLM_BACKOFF_BASE,
+                 backoff_max: float = LLM_BACKOFF_MAX, pool_size: int = LLM_POOL_SIZE,
+                 timeout: float = LLM_TIMEOUT, cache: Optional[LLMCache] = None):
+        self.model = model
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.http_client = httpx.Client(
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=timeout,
+        )
+        self.client = OpenAI(api_key=api_key, base_url=base_url, http_client=self.http_client,
+                             max_retries=0, timeout=timeout)
+        self.request_bucket = TokenBucket(rpm) if rpm > 0 else None
+        self.token_bucket = TokenBucket(tpm) if tpm > 0 else None
+        self.cache = cache or get_llm_cache()
+
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.counters = {"requests": 0, "retries": 0, "failures": 0, "coalesced": 0, "cache_hits": 0}
+
+    def _count(self, name: str, amount: int = 1):
+        with self._stats_lock:
+            self.counters[name] += amount
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        retry_after = None
+        response = getattr(error, "response", None)
+        if response is not None:
+            try:
+                retry_after = float(response.headers.get("retry-after"))
+            except (TypeError, ValueError):
+                retry_after = None
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        delay = self.backoff_base * (2 ** attempt)
+        return min(delay, self.backoff_max) * random.uniform(0.5, 1.0)
+
+    def create(self, **kwargs):
+        """限流 + 重試後呼叫 chat.completions.create，回傳原始 response"""
+        estimated = _estimate_tokens(kwargs.get("messages", []), kwargs.get("max_tokens"))
+        for attempt in range(self.max_retries + 1):
+            if self.request_bucket:
+                self.request_bucket.acquire(1)
+            if self.token_bucket:
+                self.token_bucket.acquire(estimated)
+            self._count("requests")
+            try:
+                response = self.client.chat.completions.create(**kwargs)
+            except _RETRYABLE_ERRORS as e:
+                if attempt >= self.max_retries:
+                    self._count("failures")
+                    raise
+                delay = self._backoff(attempt, e)
+                self._count("retries")
+                current = current_span()
+                if current is not None:
+                    current.set(retries=attempt + 1)
+                print(f"⚠️ LLM 呼叫失敗（{type(e).__name__}），{delay:.1f}s 後第 {attempt + 1} 次重試")
+                time.sleep(delay)
+                continue
+
+            usage = getattr(response, "usage", None)
+            if self.token_bucket and usage is not None and usage.total_tokens:
+                self.token_bucket.adjust(usage.total_tokens - estimated)
+            return response
+
+    def chat(self, messages: list, model: Optional[str] = None, temperature: float = 0.7,
+             max_tokens: Optional[int] = None, cache: Optional[bool] = None, **kwargs) -> str:
+        """送出對話並回傳文字內容；會經過快取、coalescing、限流與重試"""
+        model = model or self.model
+        with span("llm", model=model) as current:
+            key = LLMCache.make_key(model, messages, temperature, max_tokens)
+            use_cache = self.cache.enabled and should_cache(temperature, cache)
+
+            if use_cache:
+                cached = self.cache.get(key)
+                record_cache("llm", cached is not None)
+                if cached is not None:
+                    self._count("cache_hits")
+                    record_llm_call(current, model, cached=True)
+                    return cached
+
+            # 相同 prompt 已經在途：等它的結果就好
+            with self._inflight_lock:
+                future = self._inflight.get(key)
+                leader = future is None
+                if leader:
+                    future = Future()
+                    self._inflight[key] = future
+            if not leader:
+                self._count("coalesced")
+                current.set(coalesced=True)
+                return future.result()
+
+            try:
+                if max_tokens is not None:
+                    kwargs["max_tokens"] = max_tokens
+                response = self.create(model=model, messages=messages, temperature=temperature, **kwargs)
+                content = response.choices[0].message.content or ""
+                prompt_tokens, completion_tokens, estimated = _usage_tokens(
+                    getattr(response, "usage", None), messages, content)
+                record_llm_call(current, model, prompt_tokens, completion_tokens, estimated=estimated)
+                if use_cache:
+                    self.cache.set(key, content)
+                future.set_result(content)
+                return content
+            except Exception as e:
+                future.set_exception(e)
+                raise
+            finally:
+                with self._inflight_lock:
+                    self._inflight.pop(key, None)
+
+    def chat_stream(self, messages: list, model: Optional[str] = None, temperature: float = 0.7,
+                    max_tokens: Optional[int] = None, cache: Optional[bool] = None, **kwargs) -> Iterator[str]:
+        """串流版 chat，逐段 yield 文字；快取命中時一次 yield 全文。重試只發生在第一個 chunk 之前"""
+        model = model or self.model
+        with span("llm", model=model, stream=True) as current:
+            key = LLMCache.make_key(model, messages, temperature, max_tokens)
+            use_cache = self.cache.enabled and should_cache(temperature, cache)
+
+            if use_cache:
+                cached = self.cache.get(key)
+                record_cache("llm", cached is not None)
+                if cached is not None:
+                    self._count("cache_hits")
+                    record_llm_call(current, model, cached=True)
+                    yield cached
+                    return
+
+            if max_tokens is not None:
+                kwargs["max_tokens"] = max_tokens
+            if LLM_STREAM_USAGE:
+                kwargs.setdefault("stream_options", {"include_usage": True})
+            stream = self.create(model=model, messages=messages, temperature=temperature, stream=True, **kwargs)
+            parts = []
+            usage = None
+            for chunk in stream:
+                # include_usage 時最後一個 chunk 沒有 choices，只有 usage
+                usage = getattr(chunk, "usage", None) or usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    parts.append(delta)
+                    yield delta
+
+            content = "".join(parts)
+            prompt_tokens, completion_tokens, estimated = _usage_tokens(usage, messages, content)
+            record_llm_call(current, model, prompt_tokens, completion_tokens, estimated=estimated)
+            if use_cache:
+                self.cache.set(key, content)
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return dict(self.counters)
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+def get_gateway() -> LLMGateway:
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                _gateway = LLMGateway()
+    return _gateway
+
+
+# ==== 首字延遲（time-to-first-token）量測 ====
+_ttft_hooks = []
+last_ttft = {}
+
+def register_ttft_hook(hook: Callable[[str, float], None]):
+    """註冊 TTFT 回呼，參數為 (label, 秒數)"""
+    _ttft_hooks.append(hook)
+
+def measure_ttft(chunks: Iterable, label: str, start: Optional[float] = None) -> Iterator:
+    """包住任何串流，第一個 chunk 出來時記錄耗時並通知所有 hook；start 可帶入更早的起點（例如使用者送出問題的時間）"""
+    start = time.perf_counter() if start is None else start
+    first = True
+    for chunk in chunks:
+        if first:
+            first = False
+            elapsed = time.perf_counter() - start
+            last_ttft[label] = elapsed
+            print(f"⏱️ TTFT[{label}]：{elapsed:.2f}s")
+            metrics.observe(f"ttft_{label}", elapsed)
+            annotate(ttft_ms=round(elapsed * 1000, 2))
+            for hook in _ttft_hooks:
+                hook(label, elapsed)
+        yield chunk
@@ -1,15 +1,10 @@
 import os
-from openai import OpenAI
-from typing import Optional
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+from llm_gateway import get_gateway
 
 
-
-# 從環境變數中取得 API 金鑰（請先設定 OPENAI_API_KEY）
-api_key = "KEY"
-
-# 初始化 OpenAI 客戶端
-client = OpenAI(api_key=api_key)
-
 # 產生新note
 def generate_note_from_example(example_note: str, alert_description: str) -> str:
     system_prompt = (
@@ -28,8 +23,7 @@ def generate_note_from_example(example_note: str, alert_description: str) -> str
 請產出新note，並且幫我進行重點整理：
 """
 
-    response = client.chat.completions.create(
-        model="gpt-4o",
+    content = get_gateway().chat(
         messages=[
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt}
@@ -38,11 +32,31 @@ def generate_note_from_example(example_note: str, alert_description: str) -> str
         max_tokens=300
     )
 
-    return response.choices[0].message.content.strip()
+    return content.strip()
+
+# 大綱固定格式，單筆與批次共用
+OUTLINE_FORMAT = """#### 事件背景
+- 告警名稱: 
+- 來源 IP: 
+- 目的 IP: 
+- 相關網域: 
+
+#### 事件大綱
+- 負責人員或單位: 
+- 事件概述: 
+- 檢查結果: 
+- 結論: 
+"""
+
+OUTLINE_SYSTEM_PROMPT = "你是一位資安分析師，請閱讀以下事件資訊，產生一段詳細大綱，包含事件背景與調查結果重點。"
+
+# 批次大綱：一次 prompt 放幾筆事件、同時送出幾個批次
+OUTLINE_BATCH_SIZE = int(os.getenv("OUTLINE_BATCH_SIZE", "5"))
+OUTLINE_MAX_WORKERS = int(os.getenv("OUTLINE_MAX_WORKERS", "4"))
 
 # 產生相似事件大綱
 def generate_event_outline(metadata_text: str) -> str:
-    system_prompt = "你是一位資安分析師，請閱讀以下事件資訊，產生一段詳細大綱，包含事件背景與調查結果重點。"
+    system_prompt = OUTLINE_SYSTEM_PROMPT
 
     user_prompt = f"""
 以下為一筆事件的詳細資訊，請根據提供的欄位與原始註解，幫我撰寫一段結構清楚的大綱說明。
@@ -61,30 +75,108 @@ def generate_event_outline(metadata_text: str) -> str:
 
 請依下列格式產出結果（直接開始填內容，不要加註解）：
 
-#### 事件背景
-- 告警名稱: 
-- 來源 IP: 
-- 目的 IP: 
-- 相關網域: 
-
-#### 事件大綱
-- 負責人員或單位: 
-- 事件概述: 
-- 檢查結果: 
-- 結論: 
-"""
+{OUTLINE_FORMAT}"""
 
-    response = client.chat.completions.create(
-        model="gpt-4o",
+    # 同一筆事件在每次 Streamlit rerun 都會重算，大綱允許重用，明確 opt-in 快取
+    content = get_gateway().chat(
         messages=[
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt}
         ],
         temperature=0.5,
-        max_tokens=500
+        max_tokens=500,
+        cache=True
     )
 
-    return response.choices[0].message.content.strip()
+    return content.strip()
 
+# 批次回覆中每筆大綱的分隔標記，例如：===== 事件 3 =====
+_OUTLINE_MARKER = re.compile(r"^=+\s*事件\s*(\d+)\s*=+\s*$", re.MULTILINE)
+
+def _build_outline_batch_prompt(metadata_texts: List[str]) -> str:
+    blocks = "\n\n".join(
+        f"【事件 {i}】\n{text}" for i, text in enumerate(metadata_texts, 1)
+    )
+    return f"""
+以下共有 {len(metadata_texts)} 筆事件的詳細資訊，請針對「每一筆」事件分別撰寫一段結構清楚的大綱說明。
 
+注意：
+- 每筆事件的大綱前面必須單獨一行加上分隔標記「===== 事件 N =====」，N 為事件編號
+- 事件編號從 1 到 {len(metadata_texts)}，每筆都要有，順序不可更動，也不要合併
+- **僅產出以下格式的內容，其他補充說明請省略**
+- 各段標題與條列項請**保持一致**，不要更動文字或順序
+- 若原始欄位中某些值為空，也請保留欄位但標示為「無」
+
+---
+
+{blocks}
+
+---
 
+每筆事件請依下列格式產出結果（直接開始填內容，不要加註解）：
+
+===== 事件 N =====
+{OUTLINE_FORMAT}"""
+
+def _split_outline_batch(text: str, expected: int) -> Optional[List[str]]:
+    """把批次回覆依分隔標記拆回每筆大綱，編號不完整或重複時回傳 None"""
+    markers = list(_OUTLINE_MARKER.finditer(text))
+    if len(markers) != expected:
+        return None
+
+    outlines = {}
+    for pos, marker in enumerate(markers):
+        number = int(marker.group(1))
+        end = markers[pos + 1].start() if pos + 1 < len(markers) else len(text)
+        body = text[marker.end():end].strip()
+        if number in outlines or not body:
+            return None
+        outlines[number] = body
+
+    if sorted(outlines) != list(range(1, expected + 1)):
+        return None
+    return [outlines[i] for i in range(1, expected + 1)]
+
+def _generate_outline_batch(metadata_texts: List[str]) -> List[str]:
+    """一個批次一次 LLM 呼叫；回覆無法解析時退回逐筆產生"""
+    if len(metadata_texts) == 1:
+        return [generate_event_outline(metadata_texts[0])]
+
+    try:
+        content = get_gateway().chat(
+            messages=[
+                {"role": "system", "content": OUTLINE_SYSTEM_PROMPT},
+                {"role": "user", "content": _build_outline_batch_prompt(metadata_texts)}
+            ],
+            temperature=0.5,
+            max_tokens=min(500 * len(metadata_texts), 4000),
+            cache=True
+        )
+        outlines = _split_outline_batch(content, len(metadata_texts))
+    except Exception as e:
+        print(f"⚠️ 批次大綱產生失敗，改為逐筆產生：{e}")
+        return [generate_event_outline(text) for text in metadata_texts]
+
+    if outlines is None:
+        print(f"⚠️ 批次大綱無法解析，改為逐筆產生 {len(metadata_texts)} 筆")
+        outlines = [generate_event_outline(text) for text in metadata_texts]
+    return outlines
+
+# 批次產生多筆事件大綱，回傳順序與輸入相同
+def generate_event_outlines(metadata_texts: List[str],
+                            batch_size: int = OUTLINE_BATCH_SIZE,
+                            max_workers: int = OUTLINE_MAX_WORKERS) -> List[str]:
+    # 相同事件內容只產生一次
+    unique_texts = list(dict.fromkeys(metadata_texts))
+    if not unique_texts:
+        return []
+
+    batch_size = max(batch_size, 1)
+    batches = [unique_texts[i:i + batch_size] for i in range(0, len(unique_texts), batch_size)]
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(batches)))) as pool:
+        batch_results = list(pool.map(_generate_outline_batch, batches))
+
+    outline_by_text = {}
+    for batch, outlines in zip(batches, batch_results):
+        outline_by_text.update(zip(batch, outlines))
+    return [outline_by_text[text] for text in metadata_texts]
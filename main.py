@@ -1,30 +1,176 @@
 import streamlit as st
 import pandas as pd
 from query import (find_and_generate_note_from_sql, 
-                   query_by_alert_signature, 
-                   query_by_domain, 
-                   query_by_src_ip,
-                   query_by_dest_ip,
-                   query_by_dest_port,
-                   query_by_src_port,
-                   query_by_payload,
-                   query_by_note,
+                   query_by_cidr,
+                   query_by_field_values,
                    format_event_metadata)                  
-from llm_utils import generate_event_outline, generate_outline_from_table
-from rag_model.call_api import call_gpt_api
+from llm_utils import generate_event_outlines
+from hybrid_retriever import hybrid_similar_records
+from note_pipeline import (
+    annotated_file_bytes, create_job, is_job_running, job_id_for, read_status, read_upload, submit_job,
+)
+from rag_model.call_api import call_gpt_api_stream
 from rag_model.need_retrieval import need_retrieval
 from io import BytesIO
 #from new_rag import *
-from rag_model.rag_core import dual_query
+from rag_model.rag_core import dual_query_stream
+from llm_gateway import measure_ttft
+from tracing import annotate, metrics, start_metrics_server, start_trace
+from utils import ip_subnet
+import hashlib
+import time
 
 st.set_page_config(page_title="SOC_record_query_agent", layout="wide")
+# Prometheus /metrics，整個行程只會開一次（見 tracing.py）
+start_metrics_server()
+
+# ==== rerun 快取 ====
+# Streamlit 每次互動都會從頭執行 main.py：
+# - 上傳檔以內容 hash 快取解析結果（st.cache_data 每次回傳複本，後面改 df 不會影響快取）
+# - 欄位查詢結果與事件大綱存在 session_state，只有按下查詢按鈕才會重新查 SQL / 呼叫 LLM
+# - embedding 模型、Chroma、SQL 連線、LLM client 是模組層級的 lazy singleton，rerun 不會重新 import，所以不用再包一層
+@st.cache_data(show_spinner="讀取檔案中...", max_entries=8)
+def parse_uploaded_file(file_hash: str, name: str, _data: bytes):
+    # 前端要顯示整張表，所以還是合成一個 DataFrame；讀取方式與入庫程式相同（逐批、全部以文字讀入）
+    return read_upload(BytesIO(_data), name=name)
+
+
+LOOKUP_FIELDS = ("alert_sig", "domain", "src_ip", "dest_ip", "dest_port", "src_port", "payload")
+
 
 def load_uploaded_file(file):
-    if file.name.endswith(".csv"):
-        return pd.read_csv(file)
-    elif file.name.endswith(".xlsx"):
-        return pd.read_excel(file)
-    return None
+    if not file.name.endswith((".csv", ".xlsx")):
+        return None
+    data = file.getvalue()
+    file_hash = hashlib.sha256(data).hexdigest()
+    if st.session_state.get("upload_hash") != file_hash:
+        # 換了檔案，上一個檔案的查詢結果與大綱都不適用
+        for field_key in LOOKUP_FIELDS:
+            for suffix in ("_results", "_outlines", "_triggered"):
+                st.session_state.pop(f"{field_key}{suffix}", None)
+        st.session_state["upload_hash"] = file_hash
+        st.session_state["note_job_id"] = job_id_for(data)
+    return parse_uploaded_file(file_hash, file.name, data)
+
+
+def run_field_lookup(df: pd.DataFrame, field_key: str, column: str):
+    """整欄的值去重後批次查詢，再依值分回每一列，結果存進 session_state；舊的事件大綱同時失效"""
+    st.session_state[f"{field_key}_triggered"] = True
+    st.session_state[f"{field_key}_results"] = {}
+    st.session_state.pop(f"{field_key}_outlines", None)
+    if column not in df.columns:
+        return
+    records_by_value = query_by_field_values(column, df[column])
+    for idx, raw in df[column].items():
+        value = str(raw).strip()
+        if value not in records_by_value:
+            continue
+        st.session_state[f"{field_key}_results"][idx] = {
+            field_key: value,
+            "metadata": records_by_value[value],
+        }
+
+
+def run_subnet_lookup(df: pd.DataFrame, field_key: str, column: str, ipv4_prefix: int):
+    """同網段查詢：每列的 IP 換成所在網段（IPv4 /ipv4_prefix、IPv6 /64），所有網段一次查詢後再依網段分回每一列"""
+    st.session_state[f"{field_key}_triggered"] = True
+    st.session_state[f"{field_key}_results"] = {}
+    st.session_state.pop(f"{field_key}_outlines", None)
+    if column not in df.columns:
+        return
+    subnets = df[column].map(lambda ip: ip_subnet(ip, ipv4_prefix))
+    records_by_subnet = {subnet: [] for subnet in subnets.dropna().unique()}
+    try:
+        records = query_by_cidr(column, list(records_by_subnet))
+    except ValueError as e:
+        # 舊版資料庫沒有 *_ip_num 欄位
+        st.error(str(e))
+        return
+    for record in records:
+        subnet = ip_subnet(record[column], ipv4_prefix)
+        if subnet in records_by_subnet:
+            records_by_subnet[subnet].append(record)
+    for idx, subnet in subnets.items():
+        if subnet is None:
+            continue
+        st.session_state[f"{field_key}_results"][idx] = {
+            field_key: subnet,
+            "metadata": records_by_subnet[subnet],
+        }
+
+
+def render_lookup_results(field_key: str, title: str, label: str):
+    """顯示某個欄位的查詢結果，整個面板的事件大綱一次批次產生"""
+    if not (st.session_state.get(f"{field_key}_triggered") and st.session_state.get(f"{field_key}_results")):
+        return
+
+    results = st.session_state[f"{field_key}_results"]
+    metadata_texts = [
+        format_event_metadata(meta)
+        for result in results.values()
+        for meta in result["metadata"]
+    ]
+    # 大綱只在查詢後第一次顯示時產生，之後的 rerun 直接沿用
+    if f"{field_key}_outlines" not in st.session_state:
+        st.session_state[f"{field_key}_outlines"] = generate_event_outlines(metadata_texts)
+    outlines = iter(st.session_state[f"{field_key}_outlines"])
+    metadata_texts = iter(metadata_texts)
+
+    st.markdown("---")
+    st.markdown(f"### {title} 查詢結果")
+    for idx, result in results.items():
+        value = result[field_key]
+        all_metadata = result["metadata"]
+        with st.expander(f"第 {idx+1} 筆事件{label}: {value}"):
+            if not all_metadata:
+                st.warning("查無相符的事件")
+                continue
+            st.markdown(f"共找到 {len(all_metadata)} 筆事件：")
+            for i in range(len(all_metadata)):
+                st.markdown(f"---\n#### 第 {i+1} 筆事件摘要")
+                st.code(next(metadata_texts), language="text")
+                st.markdown(next(outlines))
+
+
+@st.cache_data(max_entries=2)
+def read_job_output(path: str, finished_at: float) -> bytes:
+    # finished_at 當作快取 key 的一部分，重做失敗的列產生新檔後會重新讀
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def is_job_active(status: dict) -> bool:
+    return status["state"] == "queued" or is_job_running(status)
+
+
+def render_note_job(job_id: str):
+    """背景工作的狀態；只有排隊或執行中才交給 render_note_job_progress 定時重畫"""
+    status = read_status(job_id)
+    st.markdown("#### 背景筆記工作")
+    done = status.get("done", 0)
+    if status["state"] in ("done", "done_with_errors"):
+        if status["state"] == "done":
+            st.success(f"已完成 {done} 列")
+        else:
+            st.warning(f"已完成 {done} 列，失敗 {status.get('failed', 0)} 列，再按一次「背景產生筆記」會重做失敗的列")
+        ext = status["output"].rsplit(".", 1)[-1]
+        st.download_button("下載背景工作結果", data=read_job_output(status["output"], status.get("finished_at")),
+                           file_name=f"generated_notes.{ext}")
+    elif is_job_active(status):
+        render_note_job_progress(job_id)
+    else:
+        st.error(f"工作中斷：{status.get('error') or '背景行程已結束'}，再按一次「背景產生筆記」會從中斷處繼續")
+
+
+@st.fragment(run_every=3)
+def render_note_job_progress(job_id: str):
+    """進度條每 3 秒只重畫這個區塊；工作結束就整頁 rerun 一次改顯示結果，之後不再定時重畫"""
+    status = read_status(job_id)
+    if not is_job_active(status):
+        st.rerun()
+    total, done = status.get("total"), status.get("done", 0)
+    st.progress(done / total if total else 0.0,
+                text=f"{done}/{total} 列完成，失敗 {status.get('failed', 0)} 列" if total else "準備中...")
 
 
 st.title("SOC 安全事件問答 AI")
@@ -33,27 +179,9 @@ uploaded_file = st.file_uploader("請上傳 SOC 事件檔案（CSV 或 Excel）"
 
 # === 多筆事件根據欄位過濾一鍵生成備註區塊 ===
 if uploaded_file:
-    # 初始化 session_state 查詢結果與觸發旗標
-    if "domain_results" not in st.session_state:
-        st.session_state["domain_results"] = {}
-    if "src_ip_results" not in st.session_state:
-        st.session_state["src_ip_results"] = {}
-    if "alert_sig_results" not in st.session_state:
-        st.session_state["alert_sig_results"] = {}
-
-    if "alert_sig_triggered" not in st.session_state:
-        st.session_state["alert_sig_triggered"] = False
-    if "domain_triggered" not in st.session_state:
-        st.session_state["domain_triggered"] = False
-    if "src_ip_triggered" not in st.session_state:
-        st.session_state["src_ip_triggered"] = False
-
+    # 查詢結果、觸發旗標與事件大綱都放在 session_state（見 run_field_lookup / render_lookup_results）
     df = load_uploaded_file(uploaded_file)
 
-    for col in df.columns:
-        if df[col].dtype == "object":
-            df[col] = df[col].astype(str)
-
     st.subheader("上傳事件預覽")
     st.dataframe(df)
 
@@ -61,9 +189,11 @@ if uploaded_file:
 
     if st.button("產生筆記"):
         st.subheader("生成結果")
-        for idx, row in df.iterrows():
+        # 所有列一次做 SQL 比對 + 向量搜尋，新的 IP 也能找到相似的歷史筆記
+        similar_records = hybrid_similar_records(df)
+        for (idx, row), matched_rows in zip(df.iterrows(), similar_records):
             with st.expander(f"第 {idx+1} 筆資料"):
-                result = find_and_generate_note_from_sql(row)
+                result = find_and_generate_note_from_sql(row, matched_rows=matched_rows)
                 df.at[idx, "note"] = result
 
                 st.markdown("#### 生成的 Note")
@@ -75,264 +205,82 @@ if uploaded_file:
         st.subheader("下載含筆記的檔案")
         file_type = uploaded_file.name.split(".")[-1].lower()
         if file_type == "csv":
-            csv = df.to_csv(index=False).encode("utf-8-sig")
-            st.download_button("下載 CSV", data=csv, file_name="generated_notes.csv", mime="text/csv")
+            st.download_button("下載 CSV", data=annotated_file_bytes(df, "csv"),
+                               file_name="generated_notes.csv", mime="text/csv")
         else:
-            output = BytesIO()
-            with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-                df.to_excel(writer, index=False, sheet_name="Results")
-                workbook = writer.book
-                worksheet = writer.sheets["Results"]
-                center_format = workbook.add_format({"align": "center", "valign": "vcenter"})
-                wrap_format = workbook.add_format({"text_wrap": True, "valign": "top", "align": "center"})
-                for col_idx, col_name in enumerate(df.columns):
-                    if col_name == "note":
-                        worksheet.set_column(col_idx, col_idx, 50, wrap_format)
-                    else:
-                        worksheet.set_column(col_idx, col_idx, 20, center_format)
-                for row_num in range(1, len(df) + 1):
-                    worksheet.set_row(row_num, 80)
             st.download_button(
                 "下載 Excel",
-                data=output.getvalue(),
+                data=annotated_file_bytes(df, "xlsx"),
                 file_name="generated_notes.xlsx",
                 mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
             )
 
+    # 大檔交給背景工作（note_pipeline.py），關掉分頁也會繼續跑，重新上傳同一個檔案就能看到進度
+    note_job_id = st.session_state["note_job_id"]
+    if st.button("背景產生筆記（適合大量資料）"):
+        note_job_id = create_job(uploaded_file.getvalue(), uploaded_file.name)
+        submit_job(note_job_id)
+    if read_status(note_job_id):
+        render_note_job(note_job_id)
+
     # 查詢按鈕區
     st.markdown("### 選擇要使用哪個欄位進行過往紀錄查詢")
+    subnet_col, prefix_col = st.columns([2, 1])
+    with subnet_col:
+        subnet_mode = st.checkbox("src_ip / dest_ip 查詢同網段的事件", key="subnet_mode")
+    with prefix_col:
+        subnet_prefix = st.number_input("IPv4 網段長度", min_value=8, max_value=32, value=24, step=1,
+                                        key="subnet_prefix", disabled=not subnet_mode)
     col1, col2, col3, col4, col5, col6, col7  = st.columns(7)
 
     with col1:
         if st.button("alert_signature"):
-            st.session_state["alert_sig_triggered"] = True
-            st.session_state["alert_sig_results"] = {}
-            for idx, row in df.iterrows():
-                alert_sig = row.get("alert.signature", "").strip()
-                if not alert_sig:
-                    continue
-                all_metadata = query_by_alert_signature(alert_sig)
-                st.session_state["alert_sig_results"][idx] = {
-                    "alert_sig": alert_sig,
-                    "metadata": all_metadata,
-                }
+            run_field_lookup(df, "alert_sig", "alert.signature")
             st.success("alert_signature 查詢完成")
 
     with col2:
         if st.button("domain"):
-            st.session_state["domain_triggered"] = True
-            st.session_state["domain_results"] = {}
-            for idx, row in df.iterrows():
-                domain = row.get("domain", "").strip()
-                if not domain:
-                    continue
-                all_metadata = query_by_domain(domain)
-                st.session_state["domain_results"][idx] = {
-                    "domain": domain,
-                    "metadata": all_metadata,
-                }
+            run_field_lookup(df, "domain", "domain")
             st.success("Domain 查詢完成")
 
     with col3:
         if st.button("src_ip"):
-            st.session_state["src_ip_triggered"] = True
-            st.session_state["src_ip_results"] = {}
-            for idx, row in df.iterrows():
-                src_ip = row.get("src_ip", "").strip()
-                if not src_ip:
-                    continue
-                all_metadata = query_by_src_ip(src_ip)
-                st.session_state["src_ip_results"][idx] = {
-                    "src_ip": src_ip,
-                    "metadata": all_metadata,
-                }
+            if subnet_mode:
+                run_subnet_lookup(df, "src_ip", "src_ip", int(subnet_prefix))
+            else:
+                run_field_lookup(df, "src_ip", "src_ip")
             st.success("src_ip 查詢完成")
 
     with col4:
         if st.button("dest_ip"):
-            st.session_state["dest_ip_triggered"] = True
-            st.session_state["dest_ip_results"] = {}
-            for idx, row in df.iterrows():
-                dest_ip = row.get("dest_ip", "").strip()
-                if not dest_ip:
-                    continue
-                all_metadata = query_by_dest_ip(dest_ip)
-                st.session_state["dest_ip_results"][idx] = {
-                    "dest_ip": dest_ip,
-                    "metadata": all_metadata,
-                }
+            if subnet_mode:
+                run_subnet_lookup(df, "dest_ip", "dest_ip", int(subnet_prefix))
+            else:
+                run_field_lookup(df, "dest_ip", "dest_ip")
             st.success("dest_ip 查詢完成")
 
     with col5:
         if st.button("dest_port"):
-            st.session_state["dest_port_triggered"] = True
-            st.session_state["dest_port_results"] = {}
-            for idx, row in df.iterrows():
-                dest_port = row.get("dest_port", "").strip()
-                if not dest_port:
-                    continue
-                all_metadata = query_by_dest_port(dest_port)
-                st.session_state["dest_port_results"][idx] = {
-                    "dest_port": dest_port,
-                    "metadata": all_metadata,
-                }
+            run_field_lookup(df, "dest_port", "dest_port")
             st.success("dest_port 查詢完成")
 
     with col6:
         if st.button("src_port"):
-            st.session_state["src_port_triggered"] = True
-            st.session_state["src_port_results"] = {}
-            for idx, row in df.iterrows():
-                src_port = row.get("src_port", "").strip()
-                if not src_port:
-                    continue
-                all_metadata = query_by_src_port(src_port)
-                st.session_state["src_port_results"][idx] = {
-                    "src_port": src_port,
-                    "metadata": all_metadata,
-                }
+            run_field_lookup(df, "src_port", "src_port")
             st.success("src_port 查詢完成")
     with col7:
         if st.button("payload"):
-            st.session_state["payload_triggered"] = True
-            st.session_state["payload_results"] = {}
-            for idx, row in df.iterrows():
-                payload = row.get("payload", "").strip()
-                if not payload:
-                    continue
-                all_metadata = query_by_payload(payload)
-                st.session_state["payload_results"][idx] = {
-                    "payload": payload,
-                    "metadata": all_metadata,
-                }
+            run_field_lookup(df, "payload", "payload")
             st.success("payload 查詢完成")
 
     # 顯示查詢結果
-    
-
-    if st.session_state.get("alert_sig_triggered") and st.session_state.get("alert_sig_results"):
-        st.markdown("---")
-        st.markdown("### Alert Signature 查詢結果")
-        for idx, result in st.session_state["alert_sig_results"].items():
-            alert_sig = result["alert_sig"]
-            all_metadata = result["metadata"]
-            with st.expander(f"第 {idx+1} 筆事件: {alert_sig}"):
-                if not all_metadata:
-                    st.warning("查無相符的事件")
-                    continue
-                st.markdown(f"共找到 {len(all_metadata)} 筆事件：")
-                for i, meta in enumerate(all_metadata):
-                    metadata_text = format_event_metadata(meta)
-                    outline = generate_event_outline(metadata_text)
-                    st.markdown(f"---\n#### 第 {i+1} 筆事件摘要")
-                    st.code(metadata_text, language="text")
-                    st.markdown(outline)
-
-    if st.session_state.get("domain_triggered") and st.session_state.get("domain_results"):
-        st.markdown("---")
-        st.markdown("### Domain 查詢結果")
-        for idx, result in st.session_state["domain_results"].items():
-            domain = result["domain"]
-            all_metadata = result["metadata"]
-            with st.expander(f"第 {idx+1} 筆事件 Domain: {domain}"):
-                if not all_metadata:
-                    st.warning("查無相符的事件")
-                    continue
-                st.markdown(f"共找到 {len(all_metadata)} 筆事件：")
-                for i, meta in enumerate(all_metadata):
-                    metadata_text = format_event_metadata(meta)
-                    outline = generate_event_outline(metadata_text)
-                    st.markdown(f"---\n#### 第 {i+1} 筆事件摘要")
-                    st.code(metadata_text, language="text")
-                    st.markdown(outline)
-
-    if st.session_state.get("src_ip_triggered") and st.session_state.get("src_ip_results"):
-        st.markdown("---")
-        st.markdown("### Source IP 查詢結果")
-        for idx, result in st.session_state["src_ip_results"].items():
-            src_ip = result["src_ip"]
-            all_metadata = result["metadata"]
-            with st.expander(f"第 {idx+1} 筆事件 Source IP: {src_ip}"):
-                if not all_metadata:
-                    st.warning("查無相符的事件")
-                    continue
-                st.markdown(f"共找到 {len(all_metadata)} 筆事件：")
-                for i, meta in enumerate(all_metadata):
-                    metadata_text = format_event_metadata(meta)
-                    outline = generate_event_outline(metadata_text)
-                    st.markdown(f"---\n#### 第 {i+1} 筆事件摘要")
-                    st.code(metadata_text, language="text")
-                    st.markdown(outline)
-    
-    if st.session_state.get("dest_ip_triggered") and st.session_state.get("dest_ip_results"):
-        st.markdown("---")
-        st.markdown("### Destination IP 查詢結果")
-        for idx, result in st.session_state["dest_ip_results"].items():
-            dest_ip = result["dest_ip"]
-            all_metadata = result["metadata"]
-            with st.expander(f"第 {idx+1} 筆事件 Destination IP: {dest_ip}"):
-                if not all_metadata:
-                    st.warning("查無相符的事件")
-                    continue
-                st.markdown(f"共找到 {len(all_metadata)} 筆事件：")
-                for i, meta in enumerate(all_metadata):
-                    metadata_text = format_event_metadata(meta)
-                    outline = generate_event_outline(metadata_text)
-                    st.markdown(f"---\n#### 第 {i+1} 筆事件摘要")
-                    st.code(metadata_text, language="text")
-                    st.markdown(outline)
-    if st.session_state.get("dest_port_triggered") and st.session_state.get("dest_port_results"):
-        st.markdown("---")
-        st.markdown("### Destination Port 查詢結果")
-        for idx, result in st.session_state["dest_port_results"].items():
-            dest_port = result["dest_port"]
-            all_metadata = result["metadata"]
-            with st.expander(f"第 {idx+1} 筆事件 Destination Port: {dest_port}"):
-                if not all_metadata:
-                    st.warning("查無相符的事件")
-                    continue
-                st.markdown(f"共找到 {len(all_metadata)} 筆事件：")
-                for i, meta in enumerate(all_metadata):
-                    metadata_text = format_event_metadata(meta)
-                    outline = generate_event_outline(metadata_text)
-                    st.markdown(f"---\n#### 第 {i+1} 筆事件摘要")
-                    st.code(metadata_text, language="text")
-                    st.markdown(outline)
-    if st.session_state.get("src_port_triggered") and st.session_state.get("src_port_results"):
-        st.markdown("---")
-        st.markdown("### Source Port 查詢結果")
-        for idx, result in st.session_state["src_port_results"].items():
-            src_port = result["src_port"]
-            all_metadata = result["metadata"]
-            with st.expander(f"第 {idx+1} 筆事件 Source Port: {src_port}"):
-                if not all_metadata:
-                    st.warning("查無相符的事件")
-                    continue
-                st.markdown(f"共找到 {len(all_metadata)} 筆事件：")
-                for i, meta in enumerate(all_metadata):
-                    metadata_text = format_event_metadata(meta)
-                    outline = generate_event_outline(metadata_text)
-                    st.markdown(f"---\n#### 第 {i+1} 筆事件摘要")
-                    st.code(metadata_text, language="text")
-                    st.markdown(outline)
-
-    if st.session_state.get("payload_triggered") and st.session_state.get("payload_results"): 
-        st.markdown("---")
-        st.markdown("### Payload 查詢結果")
-        for idx, result in st.session_state["payload_results"].items():
-            payload = result["payload"]
-            all_metadata = result["metadata"]
-            with st.expander(f"第 {idx+1} 筆事件 Payload: {payload}"):
-                if not all_metadata:
-                    st.warning("查無相符的事件")
-                    continue
-                st.markdown(f"共找到 {len(all_metadata)} 筆事件：")
-                for i, meta in enumerate(all_metadata):
-                    metadata_text = format_event_metadata(meta)
-                    outline = generate_event_outline(metadata_text)
-                    st.markdown(f"---\n#### 第 {i+1} 筆事件摘要")
-                    st.code(metadata_text, language="text")
-                    st.markdown(outline)
+    render_lookup_results("alert_sig", "Alert Signature", "")
+    render_lookup_results("domain", "Domain", " Domain")
+    render_lookup_results("src_ip", "Source IP", " Source IP")
+    render_lookup_results("dest_ip", "Destination IP", " Destination IP")
+    render_lookup_results("dest_port", "Destination Port", " Destination Port")
+    render_lookup_results("src_port", "Source Port", " Source Port")
+    render_lookup_results("payload", "Payload", " Payload")
 # === 多筆事件，根據欄位過濾，一鍵生成備註區塊 ===
 
 
@@ -345,46 +293,89 @@ if "rag_chat_history" not in st.session_state:
     st.session_state["rag_chat_history"] = []
 
 
+def render_chat_message(role: str, content: str, placeholder=None):
+    label = " 使用者" if role == "user" else " AI回覆"
+    target = placeholder if placeholder is not None else st
+    target.markdown(f"**{label}**：\n\n{content}", unsafe_allow_html=True)
 
-def handle_user_query():
-    query = st.session_state["rag_user_input"].strip()
-    if not query:
-        return
-
-    # 加入使用者問題到對話紀錄
-    st.session_state["rag_chat_history"].append({"role": "user", "content": query})
 
+def stream_assistant_reply(query: str):
+    """依是否需要檢索選擇串流來源，yield (slot, text)；slot 用來讓多筆摘要依序排列"""
     # 🔍 判斷是否需要查資料
     if need_retrieval(query):
         print("🔍 需要資料檢索，開始提取實體與 smart_query")
-
-        # 从 rag.py 调用 dual_query 函数进行查询，并得到摘要结果
-        assistant_reply = dual_query(query)
-        
-        if not assistant_reply:
-            assistant_reply = "❌ 查無相似事件，請嘗試其他問題。"
+        yield from dual_query_stream(query)
     else:
         print("💬 不需資料檢索，走一般 GPT 問答")
+        annotate(path="general_chat")
         system_prompt = "你是一位資安分析師，根據上下文回答使用者的問題，如果不是IT、資安的問題、網路等資訊議題，請回答你不知道。"
         messages = [{"role": "system", "content": system_prompt}]
-        messages.extend(st.session_state["rag_chat_history"][-6:])
+        messages.extend(st.session_state["rag_chat_history"][-7:-1])
         messages.append({"role": "user", "content": query})
 
-        # 调用 GPT API 获取回复（根据实际需要，你可能需要自定义该函数）
-        response = call_gpt_api(messages)
-        assistant_reply = response.content.strip()
+        for delta in call_gpt_api_stream(messages):
+            yield 0, delta
+
+
+def handle_user_query():
+    query = st.session_state["rag_user_input"].strip()
+    if not query:
+        return
+    start = time.perf_counter()
+
+    # 加入使用者問題到對話紀錄
+    st.session_state["rag_chat_history"].append({"role": "user", "content": query})
+    with st.chat_message("user"):
+        render_chat_message("user", query)
+
+    # 邊收邊畫：每收到一段就依 slot 順序重畫整則回覆；整段過程記成一份 trace，給下方的除錯面板
+    parts = {}
+    assistant_reply = ""
+    with st.chat_message("assistant"), start_trace("rag_chat", query=query) as trace:
+        placeholder = st.empty()
+        render_chat_message("assistant", "⏳ 查詢中...", placeholder)
+        for slot, text in measure_ttft(stream_assistant_reply(query), "rag_chat", start=start):
+            parts[slot] = parts.get(slot, "") + text
+            assistant_reply = "\n\n---\n\n".join(parts[k].strip() for k in sorted(parts))
+            render_chat_message("assistant", assistant_reply, placeholder)
+
+        if not assistant_reply:
+            assistant_reply = "❌ 查無相似事件，請嘗試其他問題。"
+            render_chat_message("assistant", assistant_reply, placeholder)
+    st.session_state["last_trace"] = trace.to_dict()
 
     # 加入 AI 回覆到對話歷史
     st.session_state["rag_chat_history"].append({"role": "assistant", "content": assistant_reply})
     st.session_state["rag_user_input"] = ""  # 清空用户输入框
 
 
+def render_trace_panel(trace: dict):
+    """上一個回答每個階段的耗時、LLM token 與費用、SQL 筆數、快取命中，以及各階段最近的 p50 / p95 / p99"""
+    with st.expander(f"🛠️ 除錯：上一個回答的追蹤（{trace['duration_ms'] / 1000:.2f}s）"):
+        llm = trace["llm"]
+        col_total, col_calls, col_tokens, col_cost = st.columns(4)
+        col_total.metric("總耗時", f"{trace['duration_ms'] / 1000:.2f}s")
+        col_calls.metric("LLM 呼叫", f"{llm['calls']}（快取 {llm['cache_hits']}）")
+        col_tokens.metric("Tokens（輸入 / 輸出）", f"{llm['prompt_tokens']} / {llm['completion_tokens']}")
+        col_cost.metric("費用估算", f"${llm['cost_usd']:.4f}")
+        st.caption(f"trace_id {trace['trace_id']}｜" + "，".join(f"{k}: {v}" for k, v in trace["attrs"].items()))
+        st.dataframe(pd.DataFrame([{
+            "階段": "\u3000" * span["depth"] + span["name"],
+            "開始 (ms)": span["start_ms"],
+            "耗時 (ms)": span["duration_ms"],
+            "屬性": ", ".join(f"{k}={v}" for k, v in span["attrs"].items()),
+            "錯誤": span["error"] or "",
+        } for span in trace["spans"]]), hide_index=True, use_container_width=True)
+
+        st.markdown("##### 各階段最近的耗時（秒）")
+        st.dataframe(pd.DataFrame([
+            {"階段": stage, "次數": stats["count"], "p50": stats["p50"], "p95": stats["p95"], "p99": stats["p99"]}
+            for stage, stats in sorted(metrics.summary().items())
+        ]), hide_index=True, use_container_width=True)
+
 
 # ✅ 使用 chat_input 固定在畫面底部
 user_input = st.chat_input("請輸入你的問題")
-if user_input:
-    st.session_state["rag_user_input"] = user_input
-    handle_user_query()
 
 col_reset, _ = st.columns([1, 5])
 with col_reset:
@@ -392,11 +383,16 @@ with col_reset:
         st.session_state["rag_chat_history"] = []
         # 不用改 rag_user_input，清空輸入框會自動處理
 
-if st.session_state["rag_chat_history"]:
+if st.session_state["rag_chat_history"] or user_input:
     st.markdown("### 🧠 對話紀錄")
     for i, msg in enumerate(st.session_state["rag_chat_history"]):
-        role = " 使用者" if msg["role"] == "user" else " AI回覆"
         with st.chat_message(msg["role"]):
-            st.markdown(f"**{role}**：\n\n{msg['content']}", unsafe_allow_html=True)
+            render_chat_message(msg["role"], msg["content"])
 
+# 新問題在歷史紀錄之後即時串流顯示，下一次 rerun 起就會出現在歷史紀錄中
+if user_input:
+    st.session_state["rag_user_input"] = user_input
+    handle_user_query()
 
+if st.session_state.get("last_trace"):
+    render_trace_panel(st.session_state["last_trace"])
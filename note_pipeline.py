@@ -0,0 +1,358 @@
+# note_pipeline.py
+# 上傳檔批次產生筆記（不需要開著瀏覽器）：
+# - 每個工作一個資料夾 data/note_jobs/<job_id>/，job_id 是檔案內容 hash，同一個檔案再送一次會接著做
+# - 每 NOTE_CHUNK_ROWS 列一批：SQL + 向量一次查完（hybrid_similar_records），LLM 最多 NOTE_MAX_WORKERS 個同時呼叫
+# - 每列完成就寫一行到 checkpoint.jsonl，中斷後重跑只做還沒完成的列；進度寫在 status.json，可以隨時查
+# - 全部完成後輸出含 note 欄位的 CSV / XLSX
+# 用法:
+#   python3 note_pipeline.py --file upload.xlsx [--output notes.xlsx]   前景執行（中斷後再執行同一個指令即可續跑）
+#   python3 note_pipeline.py --file upload.xlsx --background           丟到背景行程，印出 job_id
+#   python3 note_pipeline.py --status <job_id>                         查進度
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from io import BytesIO
+from typing import Optional
+
+import pandas as pd
+
+from utils import iter_record_batches
+
+NOTE_JOBS_DIR = os.getenv("NOTE_JOBS_DIR", "data/note_jobs")
+NOTE_MAX_WORKERS = int(os.getenv("NOTE_MAX_WORKERS", "8"))
+# 每批做一次相似事件檢索，也是進度更新的粒度
+NOTE_CHUNK_ROWS = int(os.getenv("NOTE_CHUNK_ROWS", "100"))
+
+CHECKPOINT_FILE = "checkpoint.jsonl"
+STATUS_FILE = "status.json"
+LOG_FILE = "log.txt"
+# submit_job 啟動背景行程期間持有的鎖，內容是持有者的 pid
+SUBMIT_LOCK_FILE = "submit.lock"
+
+
+def job_dir(job_id: str) -> str:
+    return os.path.join(NOTE_JOBS_DIR, job_id)
+
+
+def _input_path(job_id: str) -> Optional[str]:
+    directory = job_dir(job_id)
+    for ext in ("csv", "xlsx"):
+        path = os.path.join(directory, f"input.{ext}")
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def read_upload(source, name: str = None) -> pd.DataFrame:
+    """與前端相同的讀法：逐批讀入、全部以文字處理"""
+    df = pd.concat(list(iter_record_batches(source, name=name)), ignore_index=True)
+    for col in df.columns:
+        if df[col].dtype == "object":
+            df[col] = df[col].astype(str)
+    return df
+
+
+def annotated_file_bytes(df: pd.DataFrame, file_type: str) -> bytes:
+    """含 note 欄位的下載檔；xlsx 的 note 欄加寬並自動換行"""
+    if file_type == "csv":
+        return df.to_csv(index=False).encode("utf-8-sig")
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
+        df.to_excel(writer, index=False, sheet_name="Results")
+        workbook = writer.book
+        worksheet = writer.sheets["Results"]
+        center_format = workbook.add_format({"align": "center", "valign": "vcenter"})
+        wrap_format = workbook.add_format({"text_wrap": True, "valign": "top", "align": "center"})
+        for col_idx, col_name in enumerate(df.columns):
+            if col_name == "note":
+                worksheet.set_column(col_idx, col_idx, 50, wrap_format)
+            else:
+                worksheet.set_column(col_idx, col_idx, 20, center_format)
+        for row_num in range(1, len(df) + 1):
+            worksheet.set_row(row_num, 80)
+    return output.getvalue()
+
+
+# ==== 工作狀態 ====
+
+def read_status(job_id: str) -> Optional[dict]:
+    path = os.path.join(job_dir(job_id), STATUS_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_status(job_id: str, status: dict):
+    # 先寫暫存檔再 rename，查進度的一方不會讀到寫一半的 JSON
+    path = os.path.join(job_dir(job_id), STATUS_FILE)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(status, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+# 這個行程用 submit_job 啟動的背景行程 {pid: Popen}；poll() 會回收已結束的子行程，否則被 kill 後會變成殭屍行程，
+# os.kill(pid, 0) 仍然成功，工作就一直顯示執行中
+_processes = {}
+
+
+def _is_zombie(pid: int) -> bool:
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            # 格式為 "pid (comm) state ..."，comm 可能含空白，從最後一個右括號後面取
+            return f.read().rsplit(")", 1)[1].split()[0] == "Z"
+    except (OSError, IndexError):
+        return False
+
+
+def _pid_alive(pid) -> bool:
+    if not pid:
+        return False
+    process = _processes.get(pid)
+    if process is not None:
+        if process.poll() is None:
+            return True
+        _processes.pop(pid, None)
+        return False
+    try:
+        os.kill(pid, 0)
+    except (OSError, ValueError):
+        return False
+    return not _is_zombie(pid)
+
+
+def is_job_running(status: Optional[dict]) -> bool:
+    return bool(status) and status.get("state") == "running" and _pid_alive(status.get("pid"))
+
+
+def load_checkpoint(job_id: str) -> dict:
+    """{列號: note}；只收成功的列，失敗的列續跑時會重做。行程中斷時最後一行可能不完整，直接略過"""
+    path = os.path.join(job_dir(job_id), CHECKPOINT_FILE)
+    notes = {}
+    if not os.path.exists(path):
+        return notes
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if "error" in entry:
+                notes.pop(entry["index"], None)
+            else:
+                notes[entry["index"]] = entry["note"]
+    return notes
+
+
+def job_id_for(data: bytes) -> str:
+    """工作 id 是檔案內容 hash，前端不用先建立工作就能查同一個檔案的進度"""
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+def create_job(data: bytes, name: str) -> str:
+    """把上傳檔存進工作資料夾，回傳 job_id；同一個檔案重複送出會拿到同一個 job_id"""
+    ext = name.rsplit(".", 1)[-1].lower()
+    if ext not in ("csv", "xlsx"):
+        raise ValueError(f"不支援的檔案格式：{name}")
+    job_id = job_id_for(data)
+    directory = job_dir(job_id)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"input.{ext}")
+    if not os.path.exists(path):
+        with open(path, "wb") as f:
+            f.write(data)
+    if read_status(job_id) is None:
+        _write_status(job_id, {"job_id": job_id, "name": name, "state": "queued",
+                               "total": None, "done": 0, "failed": 0, "updated_at": time.time()})
+    return job_id
+
+
+# ==== 執行 ====
+
+def _generate_note(row: pd.Series, matched_rows: list) -> str:
+    from query import find_and_generate_note_from_sql
+    return find_and_generate_note_from_sql(row, matched_rows=matched_rows)
+
+
+def run_job(job_id: str, max_workers: int = NOTE_MAX_WORKERS, chunk_rows: int = NOTE_CHUNK_ROWS) -> dict:
+    """執行（或續跑）一個工作，回傳最後的狀態"""
+    # 檢索會載入 embedding 模型與 Chroma，只有真的跑工作時才 import
+    from hybrid_retriever import hybrid_similar_records
+
+    input_path = _input_path(job_id)
+    if input_path is None:
+        raise FileNotFoundError(f"找不到工作 {job_id} 的輸入檔")
+    status = read_status(job_id) or {"job_id": job_id, "name": os.path.basename(input_path)}
+
+    df = read_upload(input_path)
+    df["note"] = ""
+    notes = load_checkpoint(job_id)
+    pending = [i for i in range(len(df)) if i not in notes]
+
+    started = time.time()
+    status.update({"state": "running", "pid": os.getpid(), "total": len(df), "done": len(notes),
+                   "failed": 0, "started_at": started, "updated_at": started, "error": None})
+    _write_status(job_id, status)
+    print(f"📝 工作 {job_id}：共 {len(df)} 列，已完成 {len(notes)} 列，剩 {len(pending)} 列")
+
+    lock = threading.Lock()
+    checkpoint = open(os.path.join(job_dir(job_id), CHECKPOINT_FILE), "a", encoding="utf-8")
+
+    def record(index: int, note: str = None, error: str = None):
+        entry = {"index": index, "error": error} if error is not None else {"index": index, "note": note}
+        with lock:
+            checkpoint.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            checkpoint.flush()
+            if error is None:
+                notes[index] = note
+                status["done"] += 1
+            else:
+                status["failed"] += 1
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+            for start in range(0, len(pending), max(1, chunk_rows)):
+                indexes = pending[start:start + chunk_rows]
+                chunk = df.iloc[indexes]
+                similar_records = hybrid_similar_records(chunk)
+                futures = {
+                    pool.submit(_generate_note, row, matched_rows): index
+                    for (_, row), matched_rows, index in zip(chunk.iterrows(), similar_records, indexes)
+                }
+                for future in as_completed(futures):
+                    try:
+                        record(futures[future], note=future.result())
+                    except Exception as e:
+                        print(f"⚠️ 第 {futures[future] + 1} 列產生筆記失敗：{e}")
+                        record(futures[future], error=str(e))
+                status["updated_at"] = time.time()
+                _write_status(job_id, status)
+                print(f"📝 {status['done']}/{len(df)} 列完成，失敗 {status['failed']} 列")
+    except BaseException as e:
+        status.update({"state": "failed", "error": repr(e), "updated_at": time.time()})
+        _write_status(job_id, status)
+        raise
+    finally:
+        checkpoint.close()
+
+    for index, note in notes.items():
+        df.at[index, "note"] = note
+    ext = input_path.rsplit(".", 1)[-1]
+    output_path = os.path.join(job_dir(job_id), f"output.{ext}")
+    with open(output_path, "wb") as f:
+        f.write(annotated_file_bytes(df, ext))
+
+    finished = time.time()
+    # 有失敗的列時不算完成，再送出一次會只重做失敗的列
+    state = "done_with_errors" if status["failed"] else "done"
+    status.update({"state": state, "output": output_path, "finished_at": finished, "updated_at": finished})
+    _write_status(job_id, status)
+    print(f"✅ 工作 {job_id} 完成（{finished - started:.1f}s），失敗 {status['failed']} 列，輸出：{output_path}")
+    return status
+
+
+def _acquire_submit_lock(job_id: str) -> Optional[int]:
+    """
+    以 O_CREAT | O_EXCL 建立鎖檔，同時只有一個請求能啟動同一個工作；拿不到回傳 None
+    持有者的行程已經不在（例如啟動到一半被 kill）時，鎖檔視為過期，刪掉再搶一次
+    """
+    path = os.path.join(job_dir(job_id), SUBMIT_LOCK_FILE)
+    for _ in range(2):
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                with open(path, "r") as f:
+                    owner = int(f.read().strip() or 0)
+                age = time.time() - os.path.getmtime(path)
+            except (OSError, ValueError):
+                owner, age = 0, 0.0
+            # 剛建立、還沒寫入 pid 的鎖檔也算有人持有，超過 10 秒仍是空的才當成過期
+            if _pid_alive(owner) or (owner == 0 and age < 10):
+                return None
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            continue
+        os.write(fd, str(os.getpid()).encode())
+        return fd
+    return None
+
+
+def _release_submit_lock(job_id: str, fd: int):
+    os.close(fd)
+    os.remove(os.path.join(job_dir(job_id), SUBMIT_LOCK_FILE))
+
+
+def submit_job(job_id: str, max_workers: int = NOTE_MAX_WORKERS, chunk_rows: int = NOTE_CHUNK_ROWS) -> dict:
+    """
+    用獨立的背景行程執行工作：Streamlit 重新整理或關掉分頁都不會中斷
+    已在執行中或全部成功則不重複啟動；中斷或有失敗列（done_with_errors）的工作會接著做
+    檢查狀態到寫入 pid 之間持有鎖檔，兩個分頁同時按下也只會啟動一個行程
+    """
+    lock = _acquire_submit_lock(job_id)
+    if lock is None:
+        # 另一個請求正在啟動這個工作
+        return read_status(job_id)
+    try:
+        status = read_status(job_id)
+        if is_job_running(status) or (status and status.get("state") == "done"):
+            return status
+        log = open(os.path.join(job_dir(job_id), LOG_FILE), "a", encoding="utf-8")
+        process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--job", job_id,
+             "--workers", str(max_workers), "--chunk-rows", str(chunk_rows)],
+            stdout=log, stderr=subprocess.STDOUT, start_new_session=True,
+        )
+        log.close()
+        _processes[process.pid] = process
+        status.update({"state": "running", "pid": process.pid, "updated_at": time.time()})
+        _write_status(job_id, status)
+        return status
+    finally:
+        _release_submit_lock(job_id, lock)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="上傳檔批次產生筆記")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--file", help="要產生筆記的 CSV 或 Excel 檔案路徑 (.csv or .xlsx)")
+    group.add_argument("--job", help="執行（續跑）既有的工作")
+    group.add_argument("--status", help="查詢工作進度")
+    parser.add_argument("--output", help="結果另存一份到這個路徑")
+    parser.add_argument("--background", action="store_true", help="丟到背景行程執行")
+    parser.add_argument("--workers", type=int, default=NOTE_MAX_WORKERS, help="同時呼叫 LLM 的數量")
+    parser.add_argument("--chunk-rows", type=int, default=NOTE_CHUNK_ROWS, help="每批檢索的列數")
+    args = parser.parse_args()
+
+    if args.status:
+        print(json.dumps(read_status(args.status), ensure_ascii=False, indent=2))
+        return
+
+    job_id = args.job
+    if args.file:
+        with open(args.file, "rb") as f:
+            job_id = create_job(f.read(), os.path.basename(args.file))
+    if args.background:
+        submit_job(job_id, max_workers=args.workers, chunk_rows=args.chunk_rows)
+        print(f"已送出背景工作 {job_id}，查進度：python3 note_pipeline.py --status {job_id}")
+        return
+
+    status = run_job(job_id, max_workers=args.workers, chunk_rows=args.chunk_rows)
+    if args.output:
+        shutil.copyfile(status["output"], args.output)
+        print(f"📄 已另存：{args.output}")
+
+
+if __name__ == "__main__":
+    main()
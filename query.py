@@ -1,18 +1,38 @@
+import threading
 import pandas as pd
-from sqlalchemy import create_engine, MetaData, Table, select, and_
+from sqlalchemy import create_engine, MetaData, Table, select, and_, text
 from llm_utils import generate_note_from_example
+from utils import FTS_COLUMNS, FTS_MIN_TERM_LENGTH, cidr_bounds, fts_table_name
 
 # SQLite 位置，根據你的實際檔案路徑
 SQLITE_PATH = "sqlite:///SOC.db"
 TABLE_NAME = "SOC_data"  # 你的資料表名稱
 
-# 建立連線
-engine = create_engine(SQLITE_PATH)
-metadata = MetaData()
-alerts_table = Table(TABLE_NAME, metadata, autoload_with=engine)
+# 連線與資料表反射延到第一次查詢才做，import query 不會碰資料庫
+_engine = None
+_alerts_table = None
+_init_lock = threading.Lock()
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        with _init_lock:
+            if _engine is None:
+                _engine = create_engine(SQLITE_PATH)
+    return _engine
+
+def get_alerts_table() -> Table:
+    global _alerts_table
+    if _alerts_table is None:
+        engine = get_engine()
+        with _init_lock:
+            if _alerts_table is None:
+                _alerts_table = Table(TABLE_NAME, MetaData(), autoload_with=engine)
+    return _alerts_table
 
 def build_sql_filter(row: pd.Series, fields: list):
     """從 DataFrame Row 建立 SQL 條件"""
+    alerts_table = get_alerts_table()
     conditions = []
     for field in fields:
         value = row.get(field)
@@ -25,18 +45,66 @@ def query_similar_records(row: pd.Series, top_k: int = 3):
     filter_fields = ["src_ip", "dest_ip", "dest_port", "domain"]
     condition = build_sql_filter(row, filter_fields)
 
-    stmt = select(alerts_table)
+    stmt = select(get_alerts_table())
     if condition is not None:
         stmt = stmt.where(condition)
     stmt = stmt.limit(top_k)
 
-    with engine.connect() as conn:
+    with get_engine().connect() as conn:
         result = conn.execute(stmt)
         return [dict(r._mapping) for r in result]
 
-def find_and_generate_note_from_sql(row: pd.Series, top_k=3):
-    """查詢相符筆記並生成摘要"""
-    matched_rows = query_similar_records(row, top_k=top_k)
+SIMILAR_FIELDS = ["src_ip", "dest_ip", "dest_port", "domain"]
+
+def query_similar_records_bulk(df: pd.DataFrame, top_k: int = 3) -> list:
+    """
+    批次版 query_similar_records：回傳與 df 每一列的結果（list of list），比對條件與單筆版相同
+    有值的欄位組合相同的列一起查：相異的值組合放進 VALUES，JOIN 走 idx_soc_similar 索引，
+    每 BULK_CHUNK_SIZE 個參數一次查詢，每組值用 ROW_NUMBER() 只留前 top_k 筆
+    """
+    alerts_table = get_alerts_table()
+    groups = {}
+    for position, (_, row) in enumerate(df.iterrows()):
+        pairs = [(field, str(row.get(field)).strip()) for field in SIMILAR_FIELDS
+                 if pd.notna(row.get(field)) and str(row.get(field)).strip().lower() != "nan"]
+        fields = tuple(field for field, _ in pairs)
+        groups.setdefault(fields, {}).setdefault(tuple(value for _, value in pairs), []).append(position)
+
+    results = [[] for _ in range(len(df))]
+    with get_engine().connect() as conn:
+        for fields, positions_by_key in groups.items():
+            if not fields:
+                # 沒有任何比對欄位時與單筆版相同：不加條件取前 top_k 筆
+                records = [dict(r._mapping) for r in conn.execute(select(alerts_table).limit(top_k))]
+                for positions in positions_by_key.values():
+                    for position in positions:
+                        results[position] = list(records)
+                continue
+            keys = list(positions_by_key)
+            step = max(1, BULK_CHUNK_SIZE // (len(fields) + 1))
+            for start in range(0, len(keys), step):
+                chunk = keys[start:start + step]
+                values = ", ".join("(" + ", ".join("?" for _ in range(len(fields) + 1)) + ")" for _ in chunk)
+                key_columns = ", ".join(f"k{i}" for i in range(len(fields)))
+                join = " AND ".join(f's."{field}" = keys.k{i}' for i, field in enumerate(fields))
+                # CROSS JOIN 固定以值組合為外層迴圈，每組值走一次索引
+                sql = (f'WITH keys(_key, {key_columns}) AS (VALUES {values}) '
+                       f'SELECT * FROM (SELECT s.*, keys._key AS _key, '
+                       f'ROW_NUMBER() OVER (PARTITION BY keys._key ORDER BY s.rowid) AS _rn '
+                       f'FROM keys CROSS JOIN "{TABLE_NAME}" s WHERE {join}) WHERE _rn <= ?')
+                params = [v for index, key in enumerate(chunk) for v in (index, *key)] + [top_k]
+                for r in conn.exec_driver_sql(sql, tuple(params)):
+                    record = dict(r._mapping)
+                    key = chunk[record.pop("_key")]
+                    record.pop("_rn")
+                    for position in positions_by_key[key]:
+                        results[position].append(record)
+    return results
+
+def find_and_generate_note_from_sql(row: pd.Series, top_k=3, matched_rows=None):
+    """查詢相符筆記並生成摘要；matched_rows 可傳入 hybrid_retriever 已排序好的相似事件"""
+    if matched_rows is None:
+        matched_rows = query_similar_records(row, top_k=top_k)
     query_text = row.to_string()
 
     for match in matched_rows:
@@ -47,14 +115,89 @@ def find_and_generate_note_from_sql(row: pd.Series, top_k=3):
 
 def query_by_field(field_name: str, value: str):
     """通用欄位查詢：支援 src_ip、domain、dest_ip 等"""
+    alerts_table = get_alerts_table()
     if not hasattr(alerts_table.c, field_name):
         raise ValueError(f"欄位 {field_name} 不存在於 SOC_data 資料表中。")
 
     stmt = select(alerts_table).where(alerts_table.c[field_name] == value)
-    with engine.connect() as conn:
+    with get_engine().connect() as conn:
         result = conn.execute(stmt)
         return [dict(r._mapping) for r in result]
 
+# 一次查 IN (...) 的值數量；SQLite 單一查詢的參數數量有上限
+BULK_CHUNK_SIZE = 500
+
+def query_by_field_values(field_name: str, values) -> dict:
+    """
+    批次版 query_by_field：傳入整欄的值，去重後每 BULK_CHUNK_SIZE 個值跑一次 IN (...) 查詢
+    回傳 {值: [相符的記錄, ...]}，查無資料的值對應空 list
+    """
+    alerts_table = get_alerts_table()
+    if not hasattr(alerts_table.c, field_name):
+        raise ValueError(f"欄位 {field_name} 不存在於 SOC_data 資料表中。")
+
+    unique_values = list(dict.fromkeys(
+        str(v).strip() for v in values
+        if pd.notna(v) and str(v).strip() and str(v).strip().lower() != "nan"
+    ))
+    results = {value: [] for value in unique_values}
+    # port 欄位是 INTEGER，'053' 查到的記錄值會是 53，要對應回使用者給的值
+    aliases = {}
+    for value in unique_values:
+        aliases.setdefault(value, []).append(value)
+        if value.isdigit() and str(int(value)) != value:
+            aliases.setdefault(str(int(value)), []).append(value)
+
+    column = alerts_table.c[field_name]
+    with get_engine().connect() as conn:
+        for start in range(0, len(unique_values), BULK_CHUNK_SIZE):
+            chunk = unique_values[start:start + BULK_CHUNK_SIZE]
+            for r in conn.execute(select(alerts_table).where(column.in_(chunk))):
+                record = dict(r._mapping)
+                for key in aliases.get(str(record[field_name]).strip(), []):
+                    results[key].append(record)
+    return results
+
+# 可做網段查詢的欄位，對應 xlsx_to_database 存的 16 bytes 可排序 IP
+CIDR_FIELDS = {"src_ip": "src_ip_num", "dest_ip": "dest_ip_num"}
+
+def merge_cidr_ranges(cidr_list) -> list:
+    """多個 CIDR 轉成排序好、互不重疊的 [(起, 迄)] key 範圍，重疊或相鄰的網段合併成一段"""
+    ranges = sorted(cidr_bounds(cidr) for cidr in cidr_list if str(cidr).strip())
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [(start.to_bytes(16, "big"), end.to_bytes(16, "big")) for start, end in merged]
+
+def query_by_cidr(field_name: str, cidr_list) -> list:
+    """
+    查詢 src_ip / dest_ip 落在任一 CIDR（可混用 IPv4 / IPv6，也可以是單一 IP）的事件
+    網段先合併成不重疊的範圍，每 BULK_CHUNK_SIZE 個範圍一次查詢，每個範圍都是 *_ip_num 索引上的 range scan
+    """
+    if field_name not in CIDR_FIELDS:
+        raise ValueError(f"只有 {list(CIDR_FIELDS)} 可以用網段查詢。")
+    alerts_table = get_alerts_table()
+    column = CIDR_FIELDS[field_name]
+    if not hasattr(alerts_table.c, column):
+        raise ValueError(f"SOC_data 資料表沒有 {column} 欄位，請重新執行 xlsx_to_database.py。")
+
+    ranges = merge_cidr_ranges(cidr_list)
+    records = []
+    with get_engine().connect() as conn:
+        for start in range(0, len(ranges), BULK_CHUNK_SIZE):
+            chunk = ranges[start:start + BULK_CHUNK_SIZE]
+            # CROSS JOIN 固定以範圍表為外層迴圈，每個範圍走一次索引
+            # 參數很多，用 exec_driver_sql 的 ? 佔位符，省掉 SQLAlchemy 解析具名參數的成本
+            sql = (f'WITH ranges(lo, hi) AS (VALUES {", ".join("(?, ?)" for _ in chunk)}) '
+                   f'SELECT s.* FROM ranges CROSS JOIN "{TABLE_NAME}" s '
+                   f'WHERE s."{column}" BETWEEN ranges.lo AND ranges.hi')
+            result = conn.exec_driver_sql(sql, tuple(bound for pair in chunk for bound in pair))
+            records.extend(dict(r._mapping) for r in result)
+    return records
+
 # 例用函式：查詢相同 alert.signature 的事件
 def query_by_alert_signature(signature: str):
     return query_by_field("alert.signature", signature)
@@ -80,6 +223,64 @@ def query_by_payload(note: str):
 def query_by_note(note: str):
     return query_by_field("note", note)
 
+def _fts_phrase(term: str) -> str:
+    # 每個關鍵字包成 FTS5 phrase，裡面的 - : * ( 等符號不會被當成查詢語法
+    return '"' + term.replace('"', '""') + '"'
+
+def _like_pattern(term: str) -> str:
+    return "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+def search_text(query: str, fields=None, limit: int = 20, order: str = "rank") -> list:
+    """
+    在 payload / note / alert.signature 做部分字串搜尋（取代 LIKE '%...%' 全表掃描）
+    - query 以空白切成多個關鍵字，每個都要出現在 fields 其中一欄（AND），不分大小寫
+    - order="rank"：有全文索引時依 bm25 相關度排序，記錄多一個 _rank（越小越相關）；
+      相符的列很多時要全部算分數，只要最新幾筆可用 order="recent"（依寫入順序新到舊，找到 limit 筆就停）
+    - 少於 3 個字元的關鍵字 trigram 索引查不到，改在索引結果上用 LIKE 過濾；資料庫沒有全文索引時整個退回 LIKE
+    """
+    if order not in ("rank", "recent"):
+        raise ValueError(f"order 只能是 rank 或 recent：{order}")
+    fields = list(fields or FTS_COLUMNS)
+    unknown = [field for field in fields if field not in FTS_COLUMNS]
+    if unknown:
+        raise ValueError(f"欄位 {unknown} 沒有全文索引，可搜尋的欄位：{FTS_COLUMNS}")
+    terms = list(dict.fromkeys(str(query).split()))
+    if not terms:
+        return []
+
+    fts = fts_table_name(TABLE_NAME)
+    with get_engine().connect() as conn:
+        has_fts = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = :name"), {"name": fts}).first()
+        if has_fts:
+            match_terms = [term for term in terms if len(term) >= FTS_MIN_TERM_LENGTH]
+        else:
+            print(f"⚠️ 找不到全文索引 `{fts}`，改用 LIKE 全表掃描，請重新執行 xlsx_to_database.py")
+            match_terms = []
+        like_terms = [term for term in terms if term not in match_terms]
+
+        params = {"limit": limit}
+        like_conditions = []
+        for i, term in enumerate(like_terms):
+            params[f"like{i}"] = _like_pattern(term)
+            like_conditions.append("(" + " OR ".join(
+                f"s.\"{field}\" LIKE :like{i} ESCAPE '\\'" for field in fields) + ")")
+        where = f"WHERE {' AND '.join(like_conditions)} " if like_conditions else ""
+
+        if match_terms:
+            params["match"] = "{" + " ".join(f'"{field}"' for field in fields) + "} : (" + \
+                              " ".join(_fts_phrase(term) for term in match_terms) + ")"
+            rank, order_by = ("rank", "_rank") if order == "rank" else ("NULL", "rowid DESC")
+            # 沒有額外 LIKE 條件時，排序與 LIMIT 都在全文索引內完成
+            inner_limit = "" if like_conditions else "LIMIT :limit"
+            sql = (f'SELECT s.*, m._rank FROM '
+                   f'(SELECT rowid, {rank} AS _rank FROM "{fts}" WHERE "{fts}" MATCH :match '
+                   f'ORDER BY {order_by} {inner_limit}) m '
+                   f'JOIN "{TABLE_NAME}" s ON s.rowid = m.rowid {where}ORDER BY m.{order_by} LIMIT :limit')
+        else:
+            order_by = "ORDER BY s.rowid DESC " if order == "recent" else ""
+            sql = f'SELECT s.*, NULL AS _rank FROM "{TABLE_NAME}" s {where}{order_by}LIMIT :limit'
+        return [dict(r._mapping) for r in conn.execute(text(sql), params)]
+
 
 def format_event_metadata(meta: dict) -> str:
     parts = [
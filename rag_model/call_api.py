@@ -1,14 +1,21 @@
-from openai import OpenAI
-api_key = "KEY"
+from openai.types.chat import ChatCompletionMessage
+from llm_gateway import get_gateway
 
-# 初始化 OpenAI 客戶端
-client = OpenAI(api_key=api_key)
+# 所有 LLM 呼叫都走 llm_gateway（連線池、限流、重試、快取），要改地端模型請設定 OPENAI_BASE_URL / LLM_MODEL
+def call_gpt_api(messages, cache=None):
+    content = get_gateway().chat(
+        messages=messages,
+        temperature=0.7,
+        max_tokens=800,
+        cache=cache,
+    )
+    return ChatCompletionMessage(role="assistant", content=content)
 
-def call_gpt_api(messages):
-    response = client.chat.completions.create(
-        model="gpt-4o",
+# 串流版：逐段 yield 回覆文字
+def call_gpt_api_stream(messages, cache=None):
+    yield from get_gateway().chat_stream(
         messages=messages,
         temperature=0.7,
         max_tokens=800,
+        cache=cache,
     )
-    return response.choices[0].message
@@ -1,15 +1,24 @@
 from typing import List
-from embedding import load_embedding_model, embed_texts
+from embedding import EmbeddingEngine, embedding_model_id, get_embedding_engine, load_embedding_model, embed_texts
+from embedding_cache import get_embedding_cache
 
 class MyEmbedding:
     def __init__(self, model=None):
         self.model = model or load_embedding_model()
+        # 大量文件走多行程 engine；自訂 model 時只在本行程 encode
+        self.engine = get_embedding_engine() if model is None else EmbeddingEngine(model=model)
+        # 快取以模型名稱（含後端）當 key，自訂 model 無法對應到名稱，所以不使用快取
+        self.cache = get_embedding_cache() if model is None else None
+
+    def _encode(self, texts: List[str], encode_fn):
+        if self.cache is None:
+            return encode_fn(texts)
+        return self.cache.encode(embedding_model_id(), texts, encode_fn)
 
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        vectors = embed_texts(self.model, texts)
-        return [vec.tolist() if hasattr(vec, 'tolist') else list(vec) for vec in vectors]
+        return self._encode(texts, self.engine.encode).tolist()
 
     def embed_query(self, text: str) -> List[float]:
-        vectors = embed_texts(self.model, [text])
+        vectors = self._encode([text], lambda texts: embed_texts(self.model, texts))
         vec = vectors[0]
-        return vec.tolist() if hasattr(vec, 'tolist') else list(vec)
\ No newline at end of file
+        return vec.tolist() if hasattr(vec, 'tolist') else list(vec)
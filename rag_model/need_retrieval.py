@@ -1,6 +1,171 @@
+import ipaddress
+import re
+import sqlite3
+import numpy as np
 from rag_model.call_api import call_gpt_api
+from tracing import span
+
+# ==== 本地快速判斷 ====
+# 大部分問題不需要打 LLM 就能判斷：
+# 1. 問題裡有 IP / port / domain，或出現資料庫裡已知的 alert.signature → 一定要查
+# 2. 否則用 MyEmbedding 跟下面的標註範例做最近鄰投票
+# 3. 兩者都沒把握時才呼叫 LLM
+SOC_DB_PATH = "SOC.db"
+TABLE_NAME = "SOC_data"
+KNN_K = 5
+# 最近鄰最高相似度與投票比例都超過門檻才採用，否則交給 LLM
+KNN_MIN_SIMILARITY = 0.45
+KNN_MIN_AGREEMENT = 0.8
+
+# 中文字在 Unicode 模式下也算 \w，加 re.ASCII 讓「是10.0.0.1的」這種寫法也能切出邊界
+IPV4_RE = re.compile(r"\b(?:\d{1,3}\.){3}\d{1,3}(?:/\d{1,2})?\b", re.ASCII)
+# IPv6 候選字串，還要通過 _is_ipv6 檢查，避免 10:30:00 這種時間被當成 IP
+IPV6_RE = re.compile(r"(?<![\w:])(?:[0-9a-fA-F]{0,4}:){2,7}[0-9a-fA-F]{0,4}(?![\w:])", re.ASCII)
+CLOCK_RE = re.compile(r"\d{1,2}:\d{2}(?::\d{2})?")
+PORT_RE = re.compile(r"(?:port|埠|通訊埠)\s*[:：]?\s*\d{1,5}", re.IGNORECASE)
+# 只認常見的頂級網域，且要小寫（記錄裡的網域都是小寫），node.js、ASP.NET 這類技術名詞不會被當成網域
+DOMAIN_TLDS = (
+    "com", "net", "org", "edu", "gov", "mil", "int", "io", "info", "biz", "xyz", "top", "online", "site",
+    "club", "cc", "me", "co", "in", "tw", "cn", "hk", "jp", "kr", "ru", "uk", "de", "fr", "us", "app", "dev",
+    "cloud", "link", "live", "shop", "store", "tk", "pw", "su", "ws", "ai",
+)
+DOMAIN_RE = re.compile(rf"\b(?:[a-zA-Z0-9-]+\.)+(?:{'|'.join(DOMAIN_TLDS)})\b(?!\.\w)", re.ASCII)
+FIELD_RE = re.compile(r"alert\.signature|src_ip|dest_ip|src_port|dest_port|payload|來源\s*ip|目的\s*ip", re.IGNORECASE)
+
+# 最近鄰用的標註範例（True = 需要查資料）
+LABELLED_EXAMPLES = [
+    ("幫我查詢有關某某某的所有資料", True),
+    ("幫我列出時間最近的5筆資料", True),
+    ("列出最近十筆告警", True),
+    ("最近一週有哪些告警事件", True),
+    ("哪個告警觸發最多次", True),
+    ("有沒有跟區塊鏈相關的事件紀錄", True),
+    ("之前有處理過類似的 DNS 告警嗎", True),
+    ("資管處的同仁觸發過哪些告警", True),
+    ("找出備註寫暫列觀察的事件", True),
+    ("上個月有幾筆可疑網域的告警", True),
+    ("show me the latest alerts", True),
+    ("list all events with suspicious domain", True),
+    ("what is a SQL injection attack", False),
+    ("什麼是 DDoS 攻擊", False),
+    ("請解釋一下防火牆的運作原理", False),
+    ("如何設定 VPN", False),
+    ("SIEM 跟 SOC 有什麼差別", False),
+    ("零信任架構是什麼", False),
+    ("怎麼預防釣魚郵件", False),
+    ("你好", False),
+    ("謝謝你的幫忙", False),
+    ("how does TLS handshake work", False),
+    ("勒索軟體的常見感染途徑有哪些", False),
+    ("今天天氣如何", False),
+]
+
+_signatures = None
+_example_matrix = None
+_embedding = None
+
+
+def _load_signatures() -> list:
+    """資料庫裡所有 alert.signature（小寫），第一次使用時載入"""
+    global _signatures
+    if _signatures is None:
+        try:
+            with sqlite3.connect(SOC_DB_PATH) as conn:
+                rows = conn.execute(
+                    f'SELECT DISTINCT "alert.signature" FROM "{TABLE_NAME}" WHERE "alert.signature" != \'\' LIMIT 5000'
+                ).fetchall()
+            _signatures = [r[0].strip().lower() for r in rows if r[0] and r[0].strip()]
+        except sqlite3.Error as e:
+            print(f"⚠️ 無法載入 alert.signature：{e}")
+            _signatures = []
+    return _signatures
+
+
+def _get_embedding():
+    global _embedding
+    if _embedding is None:
+        from rag_model.embedding_utils import MyEmbedding
+        _embedding = MyEmbedding()
+    return _embedding
+
+
+def _get_example_matrix() -> np.ndarray:
+    global _example_matrix
+    if _example_matrix is None:
+        vectors = np.asarray(_get_embedding().embed_documents([text for text, _ in LABELLED_EXAMPLES]), dtype=np.float32)
+        _example_matrix = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    return _example_matrix
+
+
+def _is_ipv6(candidate: str) -> bool:
+    """要是合法的 IPv6，而且看得出是 IP：含 ::、含 a-f 字母，或完整 8 段"""
+    if CLOCK_RE.fullmatch(candidate):
+        return False
+    try:
+        ipaddress.IPv6Address(candidate)
+    except ValueError:
+        return False
+    return "::" in candidate or bool(re.search(r"[a-fA-F]", candidate)) or candidate.count(":") == 7
+
+
+def rule_route(user_input: str):
+    """規則判斷：有實體或已知告警名稱就回傳 (True, 信心)，沒有命中回傳 None"""
+    text = user_input.lower()
+    if any(sig in text for sig in _load_signatures()):
+        return True, 0.99
+    has_ipv6 = any(_is_ipv6(match.group(0)) for match in IPV6_RE.finditer(user_input))
+    if IPV4_RE.search(user_input) or has_ipv6 or PORT_RE.search(user_input):
+        return True, 0.95
+    if FIELD_RE.search(user_input):
+        return True, 0.9
+    if DOMAIN_RE.search(user_input):
+        return True, 0.85
+    return None
+
+
+def knn_route(user_input: str):
+    """跟標註範例做 cosine 最近鄰投票，回傳 (判斷, 信心)"""
+    query = np.asarray(_get_embedding().embed_query(user_input), dtype=np.float32)
+    query = query / np.linalg.norm(query)
+    similarities = _get_example_matrix() @ query
+    top = np.argsort(-similarities)[:KNN_K]
+
+    weights = np.clip(similarities[top], 0, None)
+    yes_weight = sum(w for i, w in zip(top, weights) if LABELLED_EXAMPLES[i][1])
+    total = weights.sum()
+    if total <= 0:
+        return False, 0.0
+    agreement = max(yes_weight, total - yes_weight) / total
+    # 最近的範例都不夠像時，信心打折
+    confidence = agreement if similarities[top[0]] >= KNN_MIN_SIMILARITY else agreement * 0.5
+    return yes_weight * 2 >= total, float(confidence)
+
+
+def route_query(user_input: str) -> dict:
+    """回傳 {"need": bool, "confidence": float, "source": "rule" | "knn" | "llm"}"""
+    decision = rule_route(user_input)
+    if decision is not None:
+        return {"need": decision[0], "confidence": decision[1], "source": "rule"}
+
+    try:
+        need, confidence = knn_route(user_input)
+        if confidence >= KNN_MIN_AGREEMENT:
+            return {"need": need, "confidence": confidence, "source": "knn"}
+    except Exception as e:
+        print(f"⚠️ 本地最近鄰判斷失敗，改用 LLM：{e}")
+
+    return {"need": llm_need_retrieval(user_input), "confidence": 1.0, "source": "llm"}
+
 
 def need_retrieval(user_input: str) -> bool:
+    with span("need_retrieval") as current:
+        decision = route_query(user_input)
+        current.set(**decision)
+    print(f"🧭 檢索判斷：{decision}")
+    return decision["need"]
+
+
+def llm_need_retrieval(user_input: str) -> bool:
     system_prompt = """
 你是一個助理，負責判斷使用者的問題是否需要從資料庫中檢索過往相似或相同事件資料。
 相似事件資料通常包含以下欄位：來源 IP、目的 IP、Alert signature、domain、payload、note、告警等。
@@ -23,4 +188,4 @@ def need_retrieval(user_input: str) -> bool:
     ]
     response = call_gpt_api(messages)
     answer = response.content.strip().lower()
-    return answer.startswith("是") or answer.startswith("yes")
\ No newline at end of file
+    return answer.startswith("是") or answer.startswith("yes")
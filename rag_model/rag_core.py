@@ -1,38 +1,96 @@
 import os
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import List
-from sqlalchemy import inspect  
-from openai import OpenAI
-from langchain_community.utilities.sql_database import SQLDatabase
-from langchain.chains import create_sql_query_chain
-from langchain_chroma import Chroma
-from langchain.chat_models import ChatOpenAI
-from rag_model.embedding_utils import MyEmbedding
-from langchain.chains.llm import LLMChain
-from langchain_core.prompts import PromptTemplate
+from sqlalchemy import text
+from llm_gateway import get_gateway, LLM_COMPARISON_MODEL
+from rag_model.sql_plan_cache import SQLPlanCache
+from rag_model.sql_executor import create_read_only_engine, run_select
+from tracing import annotate, record_cache, span, wrap
+from utils import FTS_COLUMNS, FTS_MIN_TERM_LENGTH, ROLLUP_GRANULARITIES, fts_table_name, rollup_table_name
 
 # ==== 設定 ====
 CHROMA_PATH = os.path.abspath("data2")
 SQLITE_PATH = "sqlite:///SOC.db"
-### 如果要公開要記得把key 放到環境變數
-OPENAI_API_KEY = "KEY"
+TABLE_NAME = "SOC_data"
 TOP_K = 4
+# 每筆摘要的最大併發數與單次呼叫 timeout（秒）
+SUMMARY_MAX_WORKERS = int(os.getenv("SUMMARY_MAX_WORKERS", "8"))
+SUMMARY_TIMEOUT = float(os.getenv("SUMMARY_TIMEOUT", "60"))
 
-# ==== 初始化 ====
-client = OpenAI(api_key=OPENAI_API_KEY)
-llm = ChatOpenAI(model_name="gpt-4o", temperature=0, openai_api_key=OPENAI_API_KEY)
-embedding = MyEmbedding()
-vectorstore = Chroma(persist_directory=CHROMA_PATH, embedding_function=embedding)
-sql_db = SQLDatabase.from_uri(SQLITE_PATH)
+# ==== 延遲初始化 ====
+# embedding 模型、Chroma、SQLDatabase 與 schema 都很重，import 時不建立，第一次用到才建立；
+# 建好後留在模組裡，Streamlit rerun 不會重新 import，所以整個行程只會建立一次。
+# langchain 相關套件也在這裡才 import，只上傳檔案的頁面不用付這些成本
+_embedding = None
+_vectorstore = None
+_sql_db = None
+_schema = None
+_schema_fingerprint = None
+_read_engine = None
+_init_lock = threading.RLock()
 
-# ==== 取得欄位名稱 ====
-def get_column_names(db: SQLDatabase, table_name: str) -> List[str]:
-    inspector = inspect(db._engine)
-    columns = inspector.get_columns(table_name)
-    return [col["name"] for col in columns]
+def get_embedding():
+    global _embedding
+    if _embedding is None:
+        with _init_lock:
+            if _embedding is None:
+                from rag_model.embedding_utils import MyEmbedding
+                _embedding = MyEmbedding()
+    return _embedding
+
+def get_vectorstore():
+    global _vectorstore
+    if _vectorstore is None:
+        with _init_lock:
+            if _vectorstore is None:
+                from langchain_chroma import Chroma
+                _vectorstore = Chroma(persist_directory=CHROMA_PATH, embedding_function=get_embedding())
+    return _vectorstore
+
+def get_read_engine():
+    """執行 LLM 產生的 SELECT 用的唯讀連線池"""
+    global _read_engine
+    if _read_engine is None:
+        with _init_lock:
+            if _read_engine is None:
+                _read_engine = create_read_only_engine(SQLITE_PATH)
+    return _read_engine
+
+def _table_names() -> list:
+    with get_read_engine().connect() as conn:
+        return [r[0] for r in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'"))]
+
+def _load_sql_db():
+    # SQLDatabase 建立時就反射好資料表，schema 變更時必須重建才看得到新欄位
+    # 全文索引（含 FTS5 自己的 *_fts_data、*_fts_idx 等 shadow table）的 CREATE TABLE 對 LLM 沒有幫助，
+    # 不反射，改用 FTS_SCHEMA_HINT 說明用法；彙總表照常反射，另外用 ROLLUP_SCHEMA_HINT 說明何時使用
+    global _sql_db, _schema
+    from langchain_community.utilities.sql_database import SQLDatabase
+    tables = _table_names()
+    fts_tables = [name for name in tables if name.startswith(fts_table_name(TABLE_NAME))]
+    _sql_db = SQLDatabase.from_uri(SQLITE_PATH, ignore_tables=fts_tables or None)
+    _schema = _sql_db.get_table_info()
+    if fts_tables:
+        _schema += FTS_SCHEMA_HINT
+    if all(table in tables for table in ROLLUP_TABLES):
+        _schema += ROLLUP_SCHEMA_HINT
+
+def get_sql_db():
+    if _sql_db is None:
+        with _init_lock:
+            if _sql_db is None:
+                _load_sql_db()
+    return _sql_db
+
+def get_schema() -> str:
+    """給 LLM 的資料表結構說明"""
+    get_sql_db()
+    return _schema
 
 # ==== SQL Prompt ====
-sql_prompt = PromptTemplate.from_template("""
+SQL_PROMPT_TEMPLATE = """
 你是一位資安資料庫分析師，請根據使用者問題產出 SQLite 查詢語法。
 ⚠️ 規則：
 1. 只能使用SELECT，不要使用其他語法。。
@@ -45,10 +103,58 @@ sql_prompt = PromptTemplate.from_template("""
 {schema}
 
 請產出查詢語法：
-""")
+"""
+
+# 資料庫有全文索引時附在 schema 後面
+_FTS_TABLE = fts_table_name(TABLE_NAME)
+FTS_SCHEMA_HINT = f"""
+
+/*
+全文索引：{_FTS_TABLE}（FTS5 trigram，rowid 對應 {TABLE_NAME}.rowid），欄位 {", ".join(f'"{col}"' for col in FTS_COLUMNS)}
+要在這些欄位找「包含」某段文字的資料時，請用全文索引，不要用 LIKE '%...%'（會掃描整張表）：
+SELECT * FROM {TABLE_NAME} WHERE rowid IN (SELECT rowid FROM {_FTS_TABLE} WHERE {_FTS_TABLE} MATCH '"關鍵字"') LIMIT 10;
+只搜尋某一欄：MATCH 'note : "關鍵字"'；關鍵字至少 {FTS_MIN_TERM_LENGTH} 個字元，更短的才用 LIKE
+*/"""
+
+# 資料庫有彙總表時附在 schema 後面
+ROLLUP_TABLES = [rollup_table_name(TABLE_NAME, granularity) for granularity in ROLLUP_GRANULARITIES]
+ROLLUP_SCHEMA_HINT = f"""
 
-schema = sql_db.get_table_info()
-sql_chain = LLMChain(llm=llm, prompt=sql_prompt)
+/*
+彙總表：{ROLLUP_TABLES[0]}（每小時）、{ROLLUP_TABLES[1]}（每天），匯入資料時預先算好
+- dimension 為 'alert.signature'、'src_ip'、'dest_ip'、'domain' 其中之一，value 為該欄位的值
+- bucket 為時間區間（每小時 'YYYY-MM-DD HH:00:00'、每天 'YYYY-MM-DD'），count 為事件數，first_seen / last_seen 為區間內最早 / 最晚的時間
+問題是計數、排名（最多、前 N 名）、趨勢、首次或最後出現時間時，請查彙總表並用 SUM(count) / MIN(first_seen) / MAX(last_seen)，
+不要對 {TABLE_NAME} 做 GROUP BY，例如「上週最常出現的告警」：
+SELECT value AS "alert.signature", SUM(count) AS count FROM {ROLLUP_TABLES[1]} WHERE dimension = 'alert.signature' AND bucket >= date('now', 'localtime', '-7 days') GROUP BY value ORDER BY count DESC LIMIT 10;
+*/"""
+
+sql_plan_cache = SQLPlanCache()
+
+# ==== 資料表結構指紋 ====
+def get_schema_fingerprint() -> str:
+    """sqlite_master 裡所有 DDL 串起來，很便宜，用來判斷 schema 是否變更"""
+    with get_read_engine().connect() as conn:
+        rows = conn.execute(text("SELECT sql FROM sqlite_master WHERE sql IS NOT NULL ORDER BY name")).fetchall()
+    return "\n".join(r[0] for r in rows)
+
+def refresh_schema_if_changed() -> str:
+    """schema 變更時重新產生給 LLM 的 schema 說明，回傳目前指紋"""
+    global _schema_fingerprint
+    fingerprint = get_schema_fingerprint()
+    with _init_lock:
+        if _sql_db is None or fingerprint != _schema_fingerprint:
+            _load_sql_db()
+            _schema_fingerprint = fingerprint
+    return fingerprint
+
+def generate_sql(user_query: str) -> str:
+    """NL-to-SQL：temperature=0，相同問題會命中 LLM 快取"""
+    prompt = SQL_PROMPT_TEMPLATE.format(question=user_query, schema=get_schema())
+    return get_gateway().chat(
+        messages=[{"role": "user", "content": prompt}],
+        temperature=0,
+    )
 
 # ==== 清理 SQL 查詢 ====
 def clean_sql_query(raw_sql: str) -> str:
@@ -62,23 +168,7 @@ def clean_sql_query(raw_sql: str) -> str:
     return raw_sql
 
 # ==== 產出摘要與異同比較 ====
-def summarize_rows(rows: List[tuple], columns: List[str], user_query: str):
-    summaries = []
-    for idx, row in enumerate(rows, 1):
-        metadata = dict(zip(columns, row)) if columns else {f"col{i}": v for i, v in enumerate(row)}
-        raw_info = "\n".join([f"- {k}: {v if v else '無資料'}" for k, v in metadata.items()])
-        user_prompt = f"""
-        【第 {idx} 筆事件摘要】
-
-        【使用者問題】
-        {user_query}
-
-        【事件資料】
-        {raw_info}
-
-        請產出結構化摘要，讓內容清晰易讀，不要加入其他說明。
-        """
-        system_prompt = """
+ROW_SUMMARY_SYSTEM_PROMPT = """
             你是一位資安分析師，請根據提供的事件資料產出清晰且結構化的摘要報告。  
             ⚠️ 規則：  
             1. 根據資料欄位名稱及其對應值動態生成摘要，不要硬套欄位名稱。  
@@ -103,25 +193,43 @@ def summarize_rows(rows: List[tuple], columns: List[str], user_query: str):
 
 
         """
+
+def summarize_row(idx: int, row: tuple, columns: List[str], user_query: str, timeout: float = SUMMARY_TIMEOUT) -> str:
+    """單筆事件摘要，失敗時回傳錯誤字串而不是丟例外"""
+    metadata = dict(zip(columns, row)) if columns else {f"col{i}": v for i, v in enumerate(row)}
+    # *_ip_num 這類 BLOB 欄位是給索引用的，不送進 prompt
+    metadata = {k: v for k, v in metadata.items() if not isinstance(v, bytes)}
+    raw_info = "\n".join([f"- {k}: {v if v else '無資料'}" for k, v in metadata.items()])
+    user_prompt = f"""
+        【第 {idx} 筆事件摘要】
+
+        【使用者問題】
+        {user_query}
+
+        【事件資料】
+        {raw_info}
+
+        請產出結構化摘要，讓內容清晰易讀，不要加入其他說明。
+        """
+    with span("summarize_row", index=idx) as current:
         try:
-            response = client.chat.completions.create(
-                model="gpt-4o",
+            content = get_gateway().chat(
                 messages=[
-                    {"role": "system", "content": [{"type": "text", "text": system_prompt}]},
+                    {"role": "system", "content": [{"type": "text", "text": ROW_SUMMARY_SYSTEM_PROMPT}]},
                     {"role": "user", "content": [{"type": "text", "text": user_prompt}]}
                 ],
                 temperature=0.1,
-                max_tokens=500
+                max_tokens=500,
+                timeout=timeout,
             )
-            summary = response.choices[0].message.content.strip()
-            summaries.append(summary)
+            return content.strip()
         except Exception as e:
-            summaries.append(f"❌ 第 {idx} 筆摘要失敗：{e}")
+            current.error = repr(e)
+            return f"❌ 第 {idx} 筆摘要失敗：{e}"
 
-    # 比較
-    if len(summaries) >= 2:
-        summary_text = "\n".join([f"第{i+1}筆：\n{s}" for i, s in enumerate(summaries)])
-        comparison_prompt = f"""
+def build_comparison_messages(summaries: List[str], user_query: str) -> list:
+    summary_text = "\n".join([f"第{i+1}筆：\n{s}" for i, s in enumerate(summaries)])
+    comparison_prompt = f"""
         【使用者問題】
         {user_query}
 
@@ -134,67 +242,129 @@ def summarize_rows(rows: List[tuple], columns: List[str], user_query: str):
          - 共同點
          - 不同點
         """
-        try:
-            response = client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": [{"type": "text", "text": "你是一位資安分析師，請針對多筆事件進行比較。"}]},
-                    {"role": "user", "content": [{"type": "text", "text": comparison_prompt}]}
-                ],
-                temperature=0.5,
-                max_tokens=800
-            )
-            result = response.choices[0].message.content.strip()
-            summaries.append(result)
-        except Exception as e:
-            summaries.append(f"❌ 事件比較失敗：{e}")
+    return [
+        {"role": "system", "content": [{"type": "text", "text": "你是一位資安分析師，請針對多筆事件進行比較。"}]},
+        {"role": "user", "content": [{"type": "text", "text": comparison_prompt}]}
+    ]
+
+def summarize_rows(rows: List[tuple], columns: List[str], user_query: str,
+                   max_workers: int = SUMMARY_MAX_WORKERS, timeout: float = SUMMARY_TIMEOUT):
+    # 每筆摘要互相獨立，用 thread pool 併發送出，最多同時 max_workers 個請求
+    # pool.map 會依照輸入順序回傳，所以摘要順序與 SQL 結果一致
+    tasks = list(enumerate(rows, 1))
+    with span("summarize_rows", rows=len(tasks)):
+        if max_workers <= 1 or len(tasks) <= 1:
+            summaries = [summarize_row(idx, row, columns, user_query, timeout) for idx, row in tasks]
+        else:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(tasks))) as pool:
+                summaries = list(pool.map(
+                    wrap(lambda task: summarize_row(task[0], task[1], columns, user_query, timeout)),
+                    tasks,
+                ))
+
+    # 比較
+    if len(summaries) >= 2:
+        with span("comparison", model=LLM_COMPARISON_MODEL) as current:
+            try:
+                result = get_gateway().chat(
+                    model=LLM_COMPARISON_MODEL,
+                    messages=build_comparison_messages(summaries, user_query),
+                    temperature=0.5,
+                    max_tokens=800
+                ).strip()
+                summaries.append(result)
+            except Exception as e:
+                current.error = repr(e)
+                summaries.append(f"❌ 事件比較失敗：{e}")
     return summaries
 
 # ==== 向量查詢 fallback ====
 def vector_fallback_search(query: str) -> List[str]:
-    docs = vectorstore.similarity_search(query, k=TOP_K)
+    annotate(path="vector_fallback")
+    with span("vector_fallback") as current:
+        docs = get_vectorstore().similarity_search(query, k=TOP_K)
+        current.set(docs=len(docs))
     return [doc.page_content for doc in docs]
 
 # ==== 主查詢流程 ====
-def dual_query(user_query: str):
-    print(f"\n🔧 使用者原始查詢語句：\n{user_query}\n")
+def get_sql_for_question(user_query: str) -> str:
+    """先查 SQL 查詢計畫快取，沒命中才請 LLM 產生並存回快取"""
+    with span("sql_generation") as current:
+        fingerprint = refresh_schema_if_changed()
+        sql_query = sql_plan_cache.get(user_query, fingerprint)
+        record_cache("sql_plan", sql_query is not None)
+        if sql_query is not None:
+            print(f"\n⚡ SQL 查詢計畫快取命中：\n{sql_query}\n（{sql_plan_cache.stats()}）\n")
+            current.set(sql=sql_query)
+            return sql_query
 
-    try:
-        raw_sql_result = sql_chain.invoke({"question": user_query, "schema": schema})
-        raw_sql_query = raw_sql_result["text"]
+        raw_sql_query = generate_sql(user_query)
         print(f"\n🧠 清理前的 SQL 查詢語法：\n{raw_sql_query}\n")
         sql_query = clean_sql_query(raw_sql_query)
         print(f"\n🧠 清理後的 SQL 查詢語法：\n{sql_query}\n") 
+        sql_plan_cache.put(user_query, fingerprint, sql_query)
+        current.set(sql=sql_query)
+        return sql_query
 
-        result = sql_db.run(sql_query)
-        print(f"\n📦 SQL 查詢結果原始輸出：\n{result}\n")
+def fetch_sql_rows(user_query: str):
+    """問題轉 SQL 並執行，回傳 (rows, columns, sql)；查無資料或 SQL 失敗時丟例外，讓呼叫端走向量 fallback"""
+    sql_query = get_sql_for_question(user_query)
 
-        if isinstance(result, str):
-            try:
-                result = eval(result)
-                print("📦 SQL 查詢結果已轉換為 list")
-            except Exception as e:
-                print("⚠️ SQL 查詢結果無法解析：", e)
-                raise ValueError("SQL 查詢無資料")
+    cols, result = run_select(get_read_engine(), sql_query)
+    if not result:
+        print("👉 查無資料")
+        raise ValueError("SQL 查詢無資料")
 
-        if not isinstance(result, list) or not all(isinstance(row, tuple) for row in result):
-            print("⚠️ SQL 查詢結果格式異常：", result)
-            raise ValueError("SQL 查詢無資料")
+    print(f"\n✅ 查詢成功，共取得 {len(result)} 筆資料。\n")
+    print("👉 欄位:", cols)
+    print("👉 第一筆資料:", result[0])
+    return result, cols, sql_query
 
-        print(f"\n✅ 查詢成功，共取得 {len(result)} 筆資料。\n")
+# ==== 統計結果直接顯示表格 ====
+_STRING_LITERAL_RE = re.compile(r"'(?:[^']|'')*'")
+_INNER_PARENS_RE = re.compile(r"\([^()]*\)")
+_AGGREGATE_RE = re.compile(r"\b(COUNT|SUM|AVG|MIN|MAX|TOTAL|GROUP_CONCAT)\s*\[\]|\bGROUP\s+BY\b", re.IGNORECASE)
 
-        # ✅ 使用 SQLAlchemy inspector 抓欄位名稱
-        table_names = re.findall(r"FROM\s+([^\s;]+)", sql_query, flags=re.IGNORECASE)
-        table_name = table_names[0] if table_names else None
-        cols = get_column_names(sql_db, table_name) if table_name else []
+def is_aggregate_query(sql: str) -> bool:
+    """
+    查彙總表，或最外層有 GROUP BY / 聚合函式的查詢：結果是統計數字而不是一筆筆事件，不需要逐筆摘要
+    子查詢裡的聚合（例如 WHERE time = (SELECT MAX(time) ...)）不算
+    """
+    if any(table in sql for table in ROLLUP_TABLES):
+        return True
+    outer = _STRING_LITERAL_RE.sub("''", sql)
+    # 由內往外把括號連同內容換成 []，只留下最外層的語法，例如 COUNT(*) -> COUNT[]
+    while True:
+        stripped = _INNER_PARENS_RE.sub("[]", outer)
+        if stripped == outer:
+            break
+        outer = stripped
+    return bool(_AGGREGATE_RE.search(outer))
 
-        # ✅ 輸出欄位與第一筆資料
-        if result:
-            print("👉 欄位:", cols)
-            print("👉 第一筆資料:", result[0])
-        else:
-            print("👉 查無資料")
+def format_result_table(rows: List[tuple], columns: List[str]) -> str:
+    """查詢結果轉成 markdown 表格；BLOB 欄位（*_ip_num）略過"""
+    keep = [i for i, _ in enumerate(columns) if not any(isinstance(row[i], bytes) for row in rows)]
 
+    def cell(value) -> str:
+        return "" if value is None else str(value).replace("|", "\\|").replace("\n", " ")
+
+    lines = [
+        "| " + " | ".join(cell(columns[i]) for i in keep) + " |",
+        "| " + " | ".join("---" for _ in keep) + " |",
+    ]
+    lines.extend("| " + " | ".join(cell(row[i]) for i in keep) + " |" for row in rows)
+    return f"共 {len(rows)} 筆統計結果：\n\n" + "\n".join(lines)
+
+def dual_query(user_query: str):
+    print(f"\n🔧 使用者原始查詢語句：\n{user_query}\n")
+
+    try:
+        result, cols, sql_query = fetch_sql_rows(user_query)
+        if is_aggregate_query(sql_query):
+            annotate(path="aggregate_table")
+            return format_result_table(result, cols)
+
+        annotate(path="summaries")
         summaries = summarize_rows(result, cols, user_query)
         if summaries:
             print("已完成大綱")
@@ -206,3 +376,54 @@ def dual_query(user_query: str):
         docs = vector_fallback_search(user_query)
         return docs if docs else ["❌ 查無結果"]
 
+# ==== 串流版主查詢流程 ====
+def dual_query_stream(user_query: str, max_workers: int = SUMMARY_MAX_WORKERS, timeout: float = SUMMARY_TIMEOUT):
+    """
+    dual_query 的 generator 版本，yield (slot, text)：
+    - slot 1..N 為第 N 筆事件摘要，哪一筆先完成就先 yield（整段）
+    - slot N+1 為多筆比較，最後以 token 串流逐段 yield
+    - slot 0 為向量 fallback 的結果，或統計查詢的結果表格（不呼叫 LLM）
+    呼叫端依 slot 排序後串接，就能得到與 dual_query 相同順序的內容
+    """
+    print(f"\n🔧 使用者原始查詢語句（串流）：\n{user_query}\n")
+
+    try:
+        result, cols, sql_query = fetch_sql_rows(user_query)
+    except Exception as e:
+        print(f"\n⚠️ SQL 查詢失敗：{e}\n")
+        docs = vector_fallback_search(user_query)
+        yield 0, "\n\n".join(docs) if docs else "❌ 查無結果"
+        return
+
+    if is_aggregate_query(sql_query):
+        annotate(path="aggregate_table")
+        yield 0, format_result_table(result, cols)
+        return
+
+    annotate(path="summaries")
+    summaries = [None] * len(result)
+    with span("summarize_rows", rows=len(result)):
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(result)))) as pool:
+            futures = {
+                pool.submit(wrap(summarize_row), idx, row, cols, user_query, timeout): idx
+                for idx, row in enumerate(result, 1)
+            }
+            for future in as_completed(futures):
+                idx = futures[future]
+                summaries[idx - 1] = future.result()
+                yield idx, summaries[idx - 1]
+
+    if len(summaries) >= 2:
+        slot = len(summaries) + 1
+        with span("comparison", model=LLM_COMPARISON_MODEL) as current:
+            try:
+                for delta in get_gateway().chat_stream(
+                    model=LLM_COMPARISON_MODEL,
+                    messages=build_comparison_messages(summaries, user_query),
+                    temperature=0.5,
+                    max_tokens=800
+                ):
+                    yield slot, delta
+            except Exception as e:
+                current.error = repr(e)
+                yield slot, f"❌ 事件比較失敗：{e}"
@@ -0,0 +1,74 @@
+import os
+import re
+from typing import Iterator, List, Tuple
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from tracing import record_sql_rows, span
+
+# ==== LLM 產生的 SELECT 直接在連線池上執行 ====
+# 取代 sql_db.run() 把結果轉成字串再 eval() 回來的做法：
+# - 回傳 cursor 實際的欄位名稱與有型別的 tuple，SELECT 只取部分欄位時欄位名稱也正確
+# - 分批 fetchmany，超過 SQL_MAX_ROWS 就停止讀取
+# - 連線設成 query_only，只允許 SELECT / WITH
+SQL_MAX_ROWS = int(os.getenv("SQL_MAX_ROWS", "100"))
+SQL_FETCH_CHUNK = int(os.getenv("SQL_FETCH_CHUNK", "100"))
+
+_READ_STATEMENT_RE = re.compile(r"^\s*(SELECT|WITH)\b", re.IGNORECASE)
+_WRITE_KEYWORD_RE = re.compile(
+    r"\b(INSERT|UPDATE|DELETE|DROP|ALTER|CREATE|ATTACH|DETACH|PRAGMA|VACUUM|REINDEX)\b", re.IGNORECASE
+)
+_STRING_LITERAL_RE = re.compile(r"'(?:[^']|'')*'")
+
+
+def create_read_only_engine(url: str) -> Engine:
+    """建立唯讀的 SQLite engine，每條新連線都會開啟 PRAGMA query_only"""
+    engine = create_engine(url, pool_pre_ping=True)
+
+    @event.listens_for(engine, "connect")
+    def _set_query_only(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA query_only = ON")
+        cursor.close()
+
+    return engine
+
+
+def ensure_select(sql: str) -> str:
+    """只接受單一 SELECT / WITH 查詢，回傳去掉結尾分號的 SQL"""
+    sql = sql.strip().rstrip(";").strip()
+    # 字串常值裡的內容（例如 LIKE '%delete%'）不算
+    stripped = _STRING_LITERAL_RE.sub("''", sql)
+    if not _READ_STATEMENT_RE.match(stripped) or _WRITE_KEYWORD_RE.search(stripped) or ";" in stripped:
+        raise ValueError(f"只允許單一 SELECT 查詢：{sql}")
+    return sql
+
+
+def iter_select(engine: Engine, sql: str, max_rows: int = SQL_MAX_ROWS,
+                chunk_size: int = SQL_FETCH_CHUNK) -> Iterator[Tuple[List[str], List[tuple]]]:
+    """分批執行 SELECT，每批 yield (欄位名稱, rows)，總筆數不超過 max_rows"""
+    sql = ensure_select(sql)
+    fetched = 0
+    with engine.connect() as conn:
+        # exec_driver_sql 直接交給 sqlite3，字串中的冒號不會被當成 bind 參數
+        result = conn.execution_options(stream_results=True).exec_driver_sql(sql)
+        columns = list(result.keys())
+        while fetched < max_rows:
+            rows = result.fetchmany(min(chunk_size, max_rows - fetched))
+            if not rows:
+                break
+            fetched += len(rows)
+            yield columns, [tuple(row) for row in rows]
+        result.close()
+
+
+def run_select(engine: Engine, sql: str, max_rows: int = SQL_MAX_ROWS,
+               chunk_size: int = SQL_FETCH_CHUNK) -> Tuple[List[str], List[tuple]]:
+    """執行 SELECT，回傳 (欄位名稱, rows)；超過 max_rows 的部分不會被讀取"""
+    columns, rows = [], []
+    with span("sql_execute", sql=sql) as current:
+        for columns, chunk in iter_select(engine, sql, max_rows, chunk_size):
+            rows.extend(chunk)
+        record_sql_rows(current, len(rows), truncated=len(rows) >= max_rows)
+    if len(rows) >= max_rows:
+        print(f"⚠️ 查詢結果已達上限 {max_rows} 筆，其餘資料不讀取")
+    return columns, rows
@@ -0,0 +1,152 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+# ==== NL-to-SQL 查詢計畫快取 ====
+# 只差在字面值的問題（例如 src_ip 10.0.0.1 vs 10.0.0.2）共用同一份 SQL 樣板：
+# 1. 把問題中的 IP / domain / 數字抽成參數，剩下的文字當 key
+# 2. 第一次由 LLM 產生 SQL，把參數值換成佔位符存成樣板；只換單引號字串裡的值與裸數字，
+#    "..." 識別字（欄位名稱）不會被換掉
+# 3. 之後 key 相同就直接把新參數值填回樣板，不用再呼叫 LLM
+# schema 指紋改變時整個快取失效
+
+SQL_PLAN_CACHE_SIZE = 256
+
+# 順序有意義：IP 要比數字先配對，domain 要比數字先配對
+_LITERAL_RE = re.compile(
+    r"(?P<ip>\b(?:\d{1,3}\.){3}\d{1,3}\b)"
+    r"|(?P<domain>\b(?:[a-zA-Z0-9-]+\.)+[a-zA-Z]{2,}\b)"
+    r"|(?P<num>\b\d+\b)",
+    re.ASCII,
+)
+# 長得像 domain 的欄位名稱，問題裡出現時是欄位不是參數
+COLUMN_IDENTIFIERS = {"alert.signature"}
+# SQL 的單引號字串、雙引號識別字、一般識別字與裸數字；只有字串內容與裸數字會被參數化
+_SQL_TOKEN_RE = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|[A-Za-z_][\w.$]*|\b\d+\b")
+_PLACEHOLDER = "\x00{}\x00"
+_PLACEHOLDER_RE = re.compile(r"\x00(\d+)\x00")
+
+
+def normalize_question(question: str) -> Tuple[str, List[Tuple[str, str]]]:
+    """回傳 (正規化後的問題, [(種類, 字面值), ...])"""
+    params = []
+
+    def replace(match):
+        kind = match.lastgroup
+        if kind == "domain" and match.group(0).lower() in COLUMN_IDENTIFIERS:
+            return match.group(0)
+        params.append((kind, match.group(0)))
+        return f"<{kind}{len(params) - 1}>"
+
+    normalized = _LITERAL_RE.sub(replace, question)
+    normalized = re.sub(r"\s+", " ", normalized).strip().lower()
+    return normalized, params
+
+
+def _literal_pattern(literal: str) -> str:
+    # 前後不能接著同類字元，避免 10.0.0.1 誤配到 10.0.0.12、5 誤配到 15
+    return rf"(?<![\w.-]){re.escape(literal)}(?![\w-]|\.\w)"
+
+
+def build_template(sql: str, params: List[Tuple[str, str]]) -> Optional[str]:
+    """
+    把 SQL 中的參數值換成佔位符；任何參數找不到、重複、數字出現多次，
+    或樣板填回原參數後與原 SQL 不同時，視為無法樣板化
+    """
+    if not params:
+        return sql
+    literals = [literal for _, literal in params]
+    if len(set(literals)) != len(literals):
+        return None
+
+    # 所有參數合成一個 pattern 一次取代，填進去的佔位符不會再被後面的參數配對到；長的先配對
+    order = sorted(range(len(params)), key=lambda i: -len(params[i][1]))
+    literal_re = re.compile("|".join(f"(?P<p{i}>{_literal_pattern(params[i][1])})" for i in order), re.ASCII)
+    counts = [0] * len(params)
+
+    def to_placeholder(match):
+        index = int(match.lastgroup[1:])
+        counts[index] += 1
+        return _PLACEHOLDER.format(index)
+
+    def replace_token(match):
+        token = match.group(0)
+        if token.startswith("'") or token[0].isdigit():
+            return literal_re.sub(to_placeholder, token)
+        return token
+
+    template = _SQL_TOKEN_RE.sub(replace_token, sql)
+    for (kind, _), count in zip(params, counts):
+        if count == 0 or (kind == "num" and count > 1):
+            return None
+    if bind_template(template, params) != sql:
+        return None
+    return template
+
+
+def bind_template(template: str, params: List[Tuple[str, str]]) -> str:
+    # 一次取代，填進去的值不會再被當成佔位符
+    return _PLACEHOLDER_RE.sub(lambda match: params[int(match.group(1))][1].replace("'", "''"), template)
+
+
+class SQLPlanCache:
+    def __init__(self, max_size: int = SQL_PLAN_CACHE_SIZE):
+        self.max_size = max_size
+        self._plans = OrderedDict()
+        self._schema_hash = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.uncacheable = 0
+        self.invalidations = 0
+
+    def _check_schema(self, schema_fingerprint: str):
+        schema_hash = hashlib.sha256(schema_fingerprint.encode("utf-8")).hexdigest()
+        if schema_hash != self._schema_hash:
+            if self._plans:
+                self.invalidations += 1
+                print("♻️ 資料表結構已變更，清空 SQL 查詢計畫快取")
+            self._plans.clear()
+            self._schema_hash = schema_hash
+
+    def get(self, question: str, schema_fingerprint: str) -> Optional[str]:
+        key, params = normalize_question(question)
+        with self._lock:
+            self._check_schema(schema_fingerprint)
+            template = self._plans.get(key)
+            if template is None:
+                self.misses += 1
+                return None
+            self._plans.move_to_end(key)
+            self.hits += 1
+        return bind_template(template, params)
+
+    def put(self, question: str, schema_fingerprint: str, sql: str):
+        key, params = normalize_question(question)
+        template = build_template(sql, params)
+        with self._lock:
+            self._check_schema(schema_fingerprint)
+            if template is None:
+                self.uncacheable += 1
+                return
+            self._plans[key] = template
+            self._plans.move_to_end(key)
+            while len(self._plans) > self.max_size:
+                self._plans.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._plans.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "uncacheable": self.uncacheable,
+            "invalidations": self.invalidations,
+            "size": len(self._plans),
+        }
@@ -0,0 +1,378 @@
+# tracing.py
+# 問答流程的追蹤與指標：
+# - span(name, **attrs) 記錄一個階段的耗時與屬性（LLM token 數與費用、SQL 筆數、快取是否命中），巢狀的 span 會記下 parent
+# - start_trace(name) 包住一次完整的問答，結束時整份 trace 寫成 TRACE_PATH 的一行 JSON，前端除錯面板也用同一份
+# - 每個階段的耗時累積成 Prometheus histogram，另外用最近 METRICS_WINDOW 筆算 p50 / p95 / p99
+# - start_metrics_server() 在本機開 /metrics（Prometheus text format），不需要另外安裝 prometheus_client
+# thread pool 裡的工作要用 wrap(fn) 包起來送出，才會掛在送出工作的 span 底下
+# 設定全部來自環境變數，見 README「效能相關設定」
+
+import contextvars
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Iterator, Optional
+
+TRACE_PATH = os.getenv("TRACE_PATH", "data/traces.jsonl")     # 空字串表示不寫檔
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(50 * 1024 * 1024)))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))          # 0 表示不開 /metrics
+METRICS_WINDOW = int(os.getenv("METRICS_WINDOW", "1000"))
+
+# 每 1M tokens 的美元價格（輸入, 輸出），模型名稱以前綴比對（gpt-4o-2024-08-06 算 gpt-4o）
+# 地端模型或新模型用 LLM_PRICES 補上，例如 LLM_PRICES='{"llama3": [0, 0]}'
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.6),
+    "gpt-4o": (2.5, 10.0),
+    "gpt-4-turbo": (10.0, 30.0),
+    "gpt-4": (30.0, 60.0),
+    "gpt-3.5-turbo": (0.5, 1.5),
+}
+MODEL_PRICES.update({model: tuple(price) for model, price in json.loads(os.getenv("LLM_PRICES") or "{}").items()})
+
+HISTOGRAM_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+_COUNTER_HELP = {
+    "soc_llm_calls_total": "LLM 呼叫次數（cached=true 為本機快取命中）",
+    "soc_llm_tokens_total": "LLM 使用的 token 數",
+    "soc_llm_cost_usd_total": "LLM 費用估算（美元）",
+    "soc_sql_rows_total": "問答 SQL 讀回的筆數",
+    "soc_cache_lookups_total": "各快取的查詢次數與命中",
+}
+
+
+def llm_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """依 MODEL_PRICES 估算一次呼叫的費用，未知的模型回傳 0"""
+    matches = [name for name in MODEL_PRICES if model == name or model.startswith(name + "-")]
+    if not matches:
+        return 0.0
+    input_price, output_price = MODEL_PRICES[max(matches, key=len)]
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+
+
+# ==== 指標 ====
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(labels: tuple) -> str:
+    return "{" + ",".join(f'{key}="{_escape_label(value)}"' for key, value in labels) + "}" if labels else ""
+
+
+class Metrics:
+    """行程內的 counter 與每個階段的耗時 histogram"""
+
+    def __init__(self, window: int = METRICS_WINDOW, buckets: tuple = HISTOGRAM_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)          # (名稱, labels) -> 值
+        self._histograms = {}                        # 階段 -> [各 bucket 次數, 總和, 次數]
+        self._recent = defaultdict(lambda: deque(maxlen=window))
+
+    def inc(self, name: str, amount: float = 1.0, **labels):
+        with self._lock:
+            self._counters[(name, tuple(sorted(labels.items())))] += amount
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            histogram = self._histograms.setdefault(stage, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+            self._recent[stage].append(seconds)
+
+    def summary(self) -> dict:
+        """{階段: {"count": 總次數, "p50": 秒, "p95": 秒, "p99": 秒}}，百分位數只看最近 window 筆"""
+        with self._lock:
+            recent = {stage: sorted(values) for stage, values in self._recent.items()}
+            counts = {stage: histogram[2] for stage, histogram in self._histograms.items()}
+        result = {}
+        for stage, values in recent.items():
+            result[stage] = {"count": counts[stage]}
+            for q in QUANTILES:
+                # nearest-rank 百分位數
+                result[stage][f"p{int(q * 100)}"] = values[max(0, math.ceil(q * len(values)) - 1)]
+        return result
+
+    def render(self) -> str:
+        """Prometheus text exposition format"""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {stage: (list(h[0]), h[1], h[2]) for stage, h in self._histograms.items()}
+        lines = []
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f"# HELP {name} {_COUNTER_HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} counter")
+            for (counter, labels), value in sorted(counters.items()):
+                if counter == name:
+                    lines.append(f"{name}{_labels(labels)} {value:g}")
+
+        lines.append("# HELP soc_stage_duration_seconds 各階段耗時")
+        lines.append("# TYPE soc_stage_duration_seconds histogram")
+        for stage, (bucket_counts, total, count) in sorted(histograms.items()):
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                lines.append(f'soc_stage_duration_seconds_bucket{{stage="{_escape_label(stage)}",le="{bound:g}"}} {bucket_count}')
+            lines.append(f'soc_stage_duration_seconds_bucket{{stage="{_escape_label(stage)}",le="+Inf"}} {count}')
+            lines.append(f'soc_stage_duration_seconds_sum{{stage="{_escape_label(stage)}"}} {total:.6f}')
+            lines.append(f'soc_stage_duration_seconds_count{{stage="{_escape_label(stage)}"}} {count}')
+
+        lines.append("# HELP soc_stage_latency_recent_seconds 各階段最近幾次的耗時百分位數")
+        lines.append("# TYPE soc_stage_latency_recent_seconds gauge")
+        for stage, stats in sorted(self.summary().items()):
+            for q in QUANTILES:
+                lines.append(f'soc_stage_latency_recent_seconds{{stage="{_escape_label(stage)}",quantile="{q:g}"}} '
+                             f'{stats[f"p{int(q * 100)}"]:.6f}')
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self._recent.clear()
+
+
+metrics = Metrics()
+
+
+# ==== 追蹤 ====
+
+class Span:
+    def __init__(self, name: str, parent_id: Optional[str], attrs: dict):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.parent_id = parent_id
+        self.attrs = dict(attrs)
+        self.start = time.perf_counter()
+        self.duration = None
+        self.error = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+
+class Trace:
+    """一次問答的所有 span；不同 thread 結束的 span 都會加進來"""
+
+    def __init__(self, name: str):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.started_at = time.time()
+        self.root = None
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start)
+        origin = self.root.start if self.root else (spans[0].start if spans else 0.0)
+        # 最外層（整次問答）不列入，直接掛在它底下的階段深度為 0
+        parents = {span.id: span.parent_id for span in spans if span is not self.root}
+
+        def depth(span: Span) -> int:
+            level, parent = 0, span.parent_id
+            while parent in parents:
+                level, parent = level + 1, parents[parent]
+            return level
+
+        llm_spans = [span for span in spans if span.name == "llm"]
+        return {
+            "trace_id": self.id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_ms": round(self.root.duration * 1000, 2) if self.root and self.root.duration is not None else None,
+            "attrs": dict(self.root.attrs) if self.root else {},
+            "llm": {
+                "calls": len(llm_spans),
+                "cache_hits": sum(1 for span in llm_spans if span.attrs.get("cached")),
+                "prompt_tokens": sum(span.attrs.get("prompt_tokens", 0) for span in llm_spans),
+                "completion_tokens": sum(span.attrs.get("completion_tokens", 0) for span in llm_spans),
+                "cost_usd": round(sum(span.attrs.get("cost_usd", 0.0) for span in llm_spans), 6),
+            },
+            "spans": [{
+                "id": span.id,
+                "parent_id": span.parent_id,
+                "name": span.name,
+                "depth": depth(span),
+                "start_ms": round((span.start - origin) * 1000, 2),
+                "duration_ms": round(span.duration * 1000, 2) if span.duration is not None else None,
+                "attrs": span.attrs,
+                "error": span.error,
+            } for span in spans if span is not self.root],
+        }
+
+
+_current_trace = contextvars.ContextVar("soc_trace", default=None)
+_current_span = contextvars.ContextVar("soc_span", default=None)
+_trace_file_lock = threading.Lock()
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def annotate(**attrs):
+    """把屬性記在目前這次問答（trace 的最外層），例如最後走的是哪一條路徑"""
+    trace = _current_trace.get()
+    if trace is not None and trace.root is not None:
+        trace.root.set(**attrs)
+
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[Span]:
+    """記錄一個階段；不在任何 trace 裡時（例如批次筆記工作）只累積指標"""
+    trace = _current_trace.get()
+    parent = _current_span.get()
+    current = Span(name, parent.id if parent else None, attrs)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except Exception as e:
+        current.error = repr(e)
+        raise
+    finally:
+        current.duration = time.perf_counter() - current.start
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            # 包在 generator 裡的 span 沒跑完就被回收時，可能在別的 context 結束
+            pass
+        if trace is not None:
+            trace.add(current)
+        metrics.observe(name, current.duration)
+
+
+def _write_trace(record: dict):
+    if not TRACE_PATH:
+        return
+    line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+    with _trace_file_lock:
+        directory = os.path.dirname(TRACE_PATH)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # 超過上限就把舊檔改名成 .1，只保留一份舊檔
+        if os.path.exists(TRACE_PATH) and os.path.getsize(TRACE_PATH) > TRACE_MAX_BYTES:
+            os.replace(TRACE_PATH, TRACE_PATH + ".1")
+        with open(TRACE_PATH, "a", encoding="utf-8") as f:
+            f.write(line)
+
+
+@contextmanager
+def start_trace(name: str, **attrs) -> Iterator[Trace]:
+    """開始一次完整的追蹤；結束後 trace.to_dict() 即為寫進 JSONL 的內容"""
+    trace = Trace(name)
+    trace_token = _current_trace.set(trace)
+    try:
+        with span(name, **attrs) as root:
+            trace.root = root
+            yield trace
+    finally:
+        try:
+            _current_trace.reset(trace_token)
+        except ValueError:
+            pass
+        try:
+            _write_trace(trace.to_dict())
+        except OSError as e:
+            print(f"⚠️ 無法寫入追蹤檔 {TRACE_PATH}：{e}")
+
+
+def wrap(fn: Callable) -> Callable:
+    """讓 fn 在別的 thread 執行時沿用目前的 trace 與 span；每次呼叫各用一份 context 複本，可以同時執行"""
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return context.copy().run(fn, *args, **kwargs)
+
+    return run
+
+
+# ==== 常用的記錄方式 ====
+
+def record_llm_call(current: Optional[Span], model: str, prompt_tokens: int = 0, completion_tokens: int = 0,
+                    cached: bool = False, estimated: bool = False):
+    cost = 0.0 if cached else llm_cost(model, prompt_tokens, completion_tokens)
+    metrics.inc("soc_llm_calls_total", model=model, cached=str(cached).lower())
+    if not cached:
+        metrics.inc("soc_llm_tokens_total", prompt_tokens, model=model, kind="prompt")
+        metrics.inc("soc_llm_tokens_total", completion_tokens, model=model, kind="completion")
+        metrics.inc("soc_llm_cost_usd_total", cost, model=model)
+    if current is not None:
+        current.set(cached=cached, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                    cost_usd=round(cost, 6))
+        if estimated:
+            current.set(tokens_estimated=True)
+
+
+def record_cache(cache: str, hit: bool, count: int = 1):
+    """快取查詢結果；目前的 span 上會累加 <cache>_cache_hits / <cache>_cache_misses"""
+    if count <= 0:
+        return
+    metrics.inc("soc_cache_lookups_total", count, cache=cache, result="hit" if hit else "miss")
+    current = _current_span.get()
+    if current is not None:
+        key = f"{cache}_cache_{'hits' if hit else 'misses'}"
+        current.attrs[key] = current.attrs.get(key, 0) + count
+
+
+def record_sql_rows(current: Optional[Span], rows: int, truncated: bool = False):
+    metrics.inc("soc_sql_rows_total", rows)
+    if current is not None:
+        current.set(rows=rows, truncated=truncated)
+
+
+# ==== /metrics ====
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0].rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_metrics_server = None
+_metrics_server_started = False
+_metrics_server_lock = threading.Lock()
+
+
+def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT):
+    """在背景 thread 開 /metrics，整個行程只開一次；port 為 0 或已被佔用時不開，回傳 server 或 None"""
+    global _metrics_server, _metrics_server_started
+    if port <= 0:
+        return None
+    with _metrics_server_lock:
+        # Streamlit 每次 rerun 都會呼叫，失敗過一次就不再嘗試
+        if not _metrics_server_started:
+            _metrics_server_started = True
+            try:
+                server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            except OSError as e:
+                print(f"⚠️ 無法開啟 metrics endpoint {host}:{port}：{e}")
+                return None
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            print(f"📈 Prometheus metrics：http://{host}:{server.server_address[1]}/metrics")
+            _metrics_server = server
+    return _metrics_server
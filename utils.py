@@ -1,7 +1,12 @@
 # utils.py
 
+import hashlib
+import ipaddress
+import os
+import socket
+from typing import Iterator, Optional, Tuple
+import numpy as np
 import pandas as pd
-from chromadb import PersistentClient
 
 # 將每一列轉換成純文字格式，排除 'time' 欄
 def row_to_text(row: pd.Series) -> str:
@@ -16,13 +21,192 @@ def row_to_text(row: pd.Series) -> str:
         parts.append(f"{col}: {val_str}")
     return " | ".join(parts)
 
-# 批次轉換整個 DataFrame
+# 批次轉換整個 DataFrame：逐欄做字串運算，結果與逐列呼叫 row_to_text 相同
 def dataframe_to_texts(df: pd.DataFrame) -> list:
-    return [row_to_text(row) for _, row in df.iterrows()]
+    columns = [col for col in df.columns if col != "time"]
+    if not columns or df.empty:
+        return [row_to_text(row) for _, row in df.iterrows()]
+    parts = [
+        f"{col}: " + df[col].astype(str).str.strip().where(df[col].notna(), "")
+        for col in columns
+    ]
+    texts = parts[0]
+    for part in parts[1:]:
+        texts = texts + " | " + part
+    return texts.tolist()
+
+# Chroma metadata：排除 'time' 欄，空值存成 "nan"
+def dataframe_to_metadatas(df: pd.DataFrame) -> list:
+    columns = [col for col in df.columns if col != "time"]
+    values = pd.DataFrame(
+        {col: df[col].astype(str).str.strip().where(df[col].notna(), "nan") for col in columns},
+        index=df.index,
+    )
+    return values.to_dict("records")
 
 CHROMA_DIR = "data/chroma_db"
 
 def get_chroma_client():
+    # chromadb 很重，用到才 import
+    from chromadb import PersistentClient
     print(f"📁 使用的 Chroma 資料夾: {CHROMA_DIR}")
     return PersistentClient(path=CHROMA_DIR)
 
+
+# ==== 大檔分批讀取 ====
+# SIEM 匯出的 CSV / XLSX 可能有好幾 GB，一次讀成 DataFrame 會 OOM。
+# iter_record_batches 每次只回傳 batch_size 筆，SQLite 寫入與 embedding 都逐批處理
+READ_BATCH_SIZE = int(os.getenv("READ_BATCH_SIZE", "20000"))
+
+# pd.read_excel / read_csv 預設當成空值的字串
+_NA_STRINGS = {
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+}
+
+def _cell_to_str(value):
+    # 與 pd.read_excel(dtype=str) 的結果一致：空值為 NaN，其餘轉字串
+    if value is None or (isinstance(value, str) and value in _NA_STRINGS):
+        return np.nan
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+def _iter_xlsx_batches(source, batch_size: int) -> Iterator[pd.DataFrame]:
+    """
+    openpyxl read-only 模式逐列讀取第一個工作表
+    與 pd.read_excel 相同：中間的空白列保留成全部 NaN 的一列，只有檔尾的空白列丟掉
+    """
+    from openpyxl import load_workbook
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(name) if name is not None else f"Unnamed: {i}" for i, name in enumerate(header)]
+        batch = []
+        # 空白列先記著，後面還有資料才補進去
+        blank_rows = 0
+        for row in rows:
+            values = [_cell_to_str(value) for value in row[:len(columns)]]
+            values += [np.nan] * (len(columns) - len(values))
+            if all(value is np.nan for value in values):
+                blank_rows += 1
+                continue
+            for _ in range(blank_rows):
+                batch.append([np.nan] * len(columns))
+            blank_rows = 0
+            batch.append(values)
+            if len(batch) >= batch_size:
+                yield pd.DataFrame(batch, columns=columns, dtype=object)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=columns, dtype=object)
+    finally:
+        workbook.close()
+
+def iter_record_batches(source, batch_size: int = READ_BATCH_SIZE, name: str = None) -> Iterator[pd.DataFrame]:
+    """
+    分批讀取 .csv / .xlsx，每批最多 batch_size 筆，所有欄位都以字串讀入
+    source 可以是路徑或檔案物件（例如 streamlit 上傳的檔案），檔案物件要用 name 判斷格式
+    """
+    name = name or getattr(source, "name", None) or str(source)
+    if name.endswith(".csv"):
+        yield from pd.read_csv(source, dtype=str, chunksize=batch_size)
+    elif name.endswith(".xlsx"):
+        yield from _iter_xlsx_batches(source, batch_size)
+    else:
+        raise ValueError("❌ 不支援的檔案格式，請提供 .csv 或 .xlsx 檔案")
+
+
+# ==== 入庫欄位正規化 ====
+def ip_to_key(value) -> Optional[bytes]:
+    """IP 轉成 16 bytes 可排序的 BLOB；IPv4 以 ::ffff:a.b.c.d 表示，所以 IPv4 也是連續區間。無法解析回傳 None"""
+    try:
+        ip = ipaddress.ip_address(str(value).strip())
+    except ValueError:
+        return None
+    if ip.version == 4:
+        return b"\x00" * 10 + b"\xff\xff" + ip.packed
+    return ip.packed
+
+_IPV4_MAPPED_OFFSET = 0xFFFF << 32
+
+def cidr_bounds(cidr) -> Tuple[int, int]:
+    """
+    CIDR（或單一 IP）涵蓋的 [起, 迄]，以 ip_to_key 的整數值表示（IPv4 對應到 ::ffff:0:0/96 裡的區間）
+    大量網段時 ipaddress.ip_network 太慢，直接用 inet_pton 解析；格式錯誤丟 ValueError
+    """
+    text = str(cidr).strip()
+    address, _, prefix = text.partition("/")
+    family, bits, offset = (socket.AF_INET6, 128, 0) if ":" in address else (socket.AF_INET, 32, _IPV4_MAPPED_OFFSET)
+    try:
+        value = int.from_bytes(socket.inet_pton(family, address), "big")
+    except OSError:
+        raise ValueError(f"不是有效的 IP / CIDR：{cidr}") from None
+    length = int(prefix) if prefix else bits
+    if not 0 <= length <= bits:
+        raise ValueError(f"不是有效的 IP / CIDR：{cidr}")
+    host_bits = bits - length
+    start = value >> host_bits << host_bits
+    return offset + start, offset + (start | ((1 << host_bits) - 1))
+
+def cidr_to_key_range(cidr) -> Tuple[bytes, bytes]:
+    """cidr_bounds 的 bytes 版本，可以直接和 *_ip_num 欄位比較"""
+    start, end = cidr_bounds(cidr)
+    return start.to_bytes(16, "big"), end.to_bytes(16, "big")
+
+def ip_subnet(value, ipv4_prefix: int = 24, ipv6_prefix: int = 64) -> Optional[str]:
+    """IP 所在的網段，例如 10.1.2.3 -> 10.1.2.0/24；無法解析回傳 None"""
+    try:
+        ip = ipaddress.ip_address(str(value).strip())
+    except ValueError:
+        return None
+    prefix = ipv4_prefix if ip.version == 4 else ipv6_prefix
+    return str(ipaddress.ip_network(f"{ip}/{prefix}", strict=False))
+
+def parse_event_times(series: pd.Series):
+    """
+    解析告警時間欄位，回傳 (ISO 字串 Series, epoch 秒 Series)，無法解析的為 None
+    原始資料可能像 "2025/1/22 14:40, 15:20"，只取第一個時間
+    """
+    first = series.fillna("").astype(str).str.split(",").str[0].str.strip()
+    parsed = pd.to_datetime(first, errors="coerce", format="mixed")
+    iso = parsed.dt.strftime("%Y-%m-%d %H:%M:%S").astype(object).where(parsed.notna(), None)
+    epoch = (parsed.astype("int64") // 10**9).astype(object).where(parsed.notna(), None)
+    return iso, epoch
+
+def drop_unnamed_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Excel 多出來的空白欄位（Unnamed: N）不入庫"""
+    return df.loc[:, [col for col in df.columns if not str(col).startswith("Unnamed:")]]
+
+def compute_row_ids(df: pd.DataFrame) -> pd.Series:
+    """
+    以內容算出穩定的 row id（sha256 前 32 碼），SQLite 與 Chroma 共用
+    欄位依名稱排序後以 欄位=值 串接，值先去頭尾空白，所以欄位順序或 dtype 不同也會得到同一個 id
+    """
+    columns = sorted(col for col in df.columns if not str(col).startswith("Unnamed:"))
+    # 去空白與加上欄位名稱都逐欄向量化處理，不用 apply(axis=1) 逐列組字串，增量匯入時大檔才不會卡在這裡
+    parts = [(f"{col}=" + df[col].fillna("").astype(str).str.strip()).tolist() for col in columns]
+    return pd.Series([hashlib.sha256("\x1f".join(values).encode("utf-8")).hexdigest()[:32] for values in zip(*parts)],
+                     index=df.index, dtype=object)
+
+# ==== 全文檢索 ====
+# payload / note / alert.signature 的 FTS5 索引（trigram，可做任意子字串與中文搜尋），
+# 由 xlsx_to_database 建立並用 trigger 同步，query.search_text 查詢
+FTS_COLUMNS = ["alert.signature", "payload", "note"]
+# trigram 索引只能找 3 個字元以上的字串，更短的關鍵字改用 LIKE
+FTS_MIN_TERM_LENGTH = 3
+
+def fts_table_name(table_name: str) -> str:
+    return f"{table_name}_fts"
+
+# ==== 統計彙總表 ====
+# 依 告警名稱 / IP / 網域 與 每小時 / 每天 預先算好的事件數、首次與最後出現時間，
+# 由 xlsx_to_database 匯入時更新；計數、排名類的問題直接查這兩張表，不用對原始資料 GROUP BY
+ROLLUP_DIMENSIONS = ["alert.signature", "src_ip", "dest_ip", "domain"]
+ROLLUP_GRANULARITIES = ["hourly", "daily"]
+
+def rollup_table_name(table_name: str, granularity: str) -> str:
+    return f"{table_name}_rollup_{granularity}"